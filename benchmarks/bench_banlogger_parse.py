@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+'''Measures the parsing cost of a ",log auto" over a synthetic 4000-line window,
+with the former per-line regexes and with the single-pass classifier.
+
+Usage: python benchmarks/bench_banlogger_parse.py [repetitions]'''
+
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+
+import banlogger
+from utils import BackwardLines
+import logparse
+
+WINDOW = 4000
+NICKS = ['nick{}'.format(number) for number in range(150)]
+
+VALID_NICK = logparse.VALID_NICK
+ISO8601 = r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\+\d{2}:\d{2}'
+MUTE_REGEX = re.compile(ISO8601+r' --  Mode #?\w+ \(\+b m:(.*)\) by ('+VALID_NICK+r') \((.*)\)')
+BAN_REGEX = re.compile(ISO8601+r' --  Mode #?\w+ \(\+b (.*)\) by ('+VALID_NICK+r') \((.*)\)')
+KICK_REGEX = re.compile(ISO8601+r' <-- ('+VALID_NICK+r') \((.*)\) has kicked (' +
+                        VALID_NICK+r') \(?(.*)\)?')
+REMOVED_REGEX = re.compile(ISO8601+r' <-- ('+VALID_NICK +
+                           r') \((.*)\) has left \(?Removed by ('+VALID_NICK+r').*\)?')
+MSG_REGEX = re.compile(ISO8601+r'     ('+VALID_NICK+r') \((.*)\) (.*)')
+SWITCH_REGEX = re.compile(ISO8601+r' --  ('+VALID_NICK +
+                          r') \((.*)\) is now known as ('+VALID_NICK+')')
+JOIN_REGEX = re.compile(ISO8601+r' --> ('+VALID_NICK+r') \((.*)\) has joined .*')
+
+
+def make_window():
+    '''Returns 4000 log lines, the ban being early so most of the window is scanned.'''
+    random.seed(1)
+    lines = []
+    for number in range(WINDOW):
+        stamp = '2019-03-01T{:02}:{:02}:{:02}+00:00'.format(number // 3600, number // 60 % 60,
+                                                            number % 60)
+        nick = random.choice(NICKS)
+        hostmask = '{0}!uid{1}@ip.{1}.example.com'.format(nick, NICKS.index(nick))
+        if number == 200:
+            lines.append(stamp + ' --> target (target!u@target.host) has joined #cc')
+        elif number == 300:
+            lines.append(stamp + ' --  Mode #cc (+b *!*@target.host) by op (op!o@staff)')
+        elif number % 50 == 0:
+            lines.append(stamp + ' --> {} ({}) has joined #cc'.format(nick, hostmask))
+        else:
+            lines.append(stamp + '     {} ({}) some chat message number {}'.format(
+                nick, hostmask, number))
+    return lines
+
+
+def log_auto_before(lines):
+    '''The regex-based parsing of a ,log auto before the classifier.'''
+    action_index = None
+    for line_index, line_str in reversed(list(enumerate(lines))):
+        mute_match = MUTE_REGEX.match(line_str)
+        ban_match = BAN_REGEX.match(line_str)
+        kick_match = KICK_REGEX.match(line_str)
+        removed_match = REMOVED_REGEX.match(line_str)
+        ban_match = BAN_REGEX.match(line_str)
+        if mute_match or ban_match or kick_match or removed_match:
+            action_index = line_index
+            break
+    host = ban_match.group(1).split('@')[1]
+    nick = None
+    for line_str in reversed(lines[:action_index]):
+        message_match = MSG_REGEX.match(line_str)
+        switch_match = SWITCH_REGEX.match(line_str)
+        join_match = JOIN_REGEX.match(line_str)
+        if message_match and message_match.group(2).split('@')[1] == host:
+            nick = message_match.group(1)
+            break
+        if switch_match and switch_match.group(2).split('@')[1] == host:
+            nick = switch_match.group(3)
+            break
+        if join_match and join_match.group(2).split('@')[1] == host:
+            nick = join_match.group(1)
+            break
+    start_index = None
+    for line_index, line_str in reversed(list(enumerate(lines[:action_index]))):
+        join_match = JOIN_REGEX.match(line_str)
+        if join_match and join_match.group(2).split('@')[1] == host:
+            start_index = line_index
+            break
+    pretty = []
+    for line in lines[start_index:action_index + 3]:
+        message_match = MSG_REGEX.match(line)
+        if message_match:
+            line = line.replace('(' + message_match.group(2) + ') ', '', 1).replace(
+                message_match.group(1), '<' + message_match.group(1) + '>', 1)
+        pretty.append(line[0:10]+' '+line[11:19]+line[25:len(line)])
+    return nick, pretty
+
+
+def log_auto_after(lines):
+    '''The parsing of a ,log auto with the classifier.'''
+    log_events = BackwardLines(logparse.parse_lines(reversed(lines)), WINDOW)
+    action_position = banlogger.get_action_line_index(log_events.iter_from(0), 0)
+    relevant_info = banlogger.get_action_context_info(log_events, action_position)
+    oldest_position = banlogger.get_first_index(log_events.iter_from(action_position+1),
+                                                relevant_info) + action_position + 1
+    newest_position = max(0, action_position - 2)
+    pretty = banlogger.prettify_lines(log_events.chronological(newest_position, oldest_position))
+    return relevant_info['nick'], pretty
+
+
+def main():
+    '''Runs the benchmark.'''
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    lines = make_window()
+    assert log_auto_before(lines) == log_auto_after(lines)
+    before = timeit.timeit(lambda: log_auto_before(lines), number=repetitions) / repetitions
+    after = timeit.timeit(lambda: log_auto_after(lines), number=repetitions) / repetitions
+    print('parse cost per ,log auto over {} lines: before {:.1f} ms, after {:.1f} ms '
+          '({:.1f}x)'.format(WINDOW, before * 1000, after * 1000, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+'''Measures how many chanlogs lines can be formatted per second,
+with the per-line str.format of the templates and with the compiled formatters.
+
+Usage: python benchmarks/bench_chanlogs_format.py [line number]'''
+
+import os
+import sys
+import timeit
+from datetime import datetime
+from pytz import timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+
+import chanlogs
+
+
+class FakeTrigger(str):
+    '''Carries the attributes used by the templates.'''
+
+
+def make_trigger():
+    '''Returns a trigger looking like a channel message.'''
+    trigger = FakeTrigger('hello there, how is everybody doing today?')
+    trigger.nick = 'somebody'
+    trigger.hostmask = 'somebody!uid123456@ip.1.2.3.4.example.com'
+    trigger.sender = '#casualconversation'
+    trigger.args = ['#casualconversation', '+b', '*!*@ip.1.2.3.4.example.com']
+    return trigger
+
+
+def format_before(tpl, trigger, **kwargs):
+    '''The formatting done for every line before the templates were compiled.'''
+    dt_obj = datetime.utcnow()
+    dt_obj = dt_obj.replace(tzinfo=timezone('UTC'))
+    dt_obj = dt_obj.astimezone(timezone('America/Toronto'))
+    dt_obj = dt_obj.replace(microsecond=0)
+    return tpl.format(trigger=trigger, datetime=dt_obj.isoformat(),
+                      date=dt_obj.date().isoformat(), time=dt_obj.time().isoformat(),
+                      **kwargs) + "\n"
+
+
+def main():
+    '''Runs the benchmark.'''
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    trigger = make_trigger()
+    clock = chanlogs.LogClock('America/Toronto')
+    formatters = {kind: chanlogs.compile_template(tpl)
+                  for kind, (_, tpl) in chanlogs.TEMPLATES.items()}
+
+    for kind, (_, tpl) in sorted(chanlogs.TEMPLATES.items()):
+        formatter = formatters[kind]
+        assert formatter(trigger, clock.now(), {'message': trigger}) == \
+            format_before(tpl, trigger, message=trigger)
+        before = timeit.timeit(lambda: format_before(tpl, trigger, message=trigger),
+                               number=number)
+        after = timeit.timeit(lambda: formatter(trigger, clock.now(), {'message': trigger}),
+                              number=number)
+        print('{:8} before: {:>10.0f} lines/s   after: {:>10.0f} lines/s   ({:.1f}x)'.format(
+            kind, number / before, number / after, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+'''Measures the html rendering of log pastes of 400, 4000 and 40000 lines,
+with pygments.highlight and with the streaming renderer of loghtml.
+
+Usage: python benchmarks/bench_paste_render.py [repetitions]'''
+
+import io
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+import pygments
+from pygments.lexers import IrcLogsLexer
+from pygments.formatters import HtmlFormatter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+
+import loghtml
+
+SIZES = (400, 4000, 40000)
+NICKS = ['nick{}'.format(number) for number in range(150)]
+
+
+def make_paste(lines_number):
+    '''Returns a paste like the ones of prettify_lines.'''
+    random.seed(1)
+    lines = []
+    for number in range(lines_number):
+        stamp = '2019-03-01 {:02}:{:02}:{:02}'.format(number // 3600 % 24, number // 60 % 60,
+                                                      number % 60)
+        nick = random.choice(NICKS)
+        if number % 50 == 0:
+            lines.append(stamp + ' --> {0} ({0}!uid@ip.example.com) has joined #cc'.format(nick))
+        elif number % 97 == 0:
+            lines.append(stamp + ' <-- op (op!o@staff) has kicked {} (spam <3 & "quotes")'.format(
+                nick))
+        else:
+            lines.append(stamp + '     <{}> some chat message number {}: hi'.format(nick, number))
+    return '\n'.join(lines)
+
+
+def render_before(paste):
+    '''The rendering before the streaming renderer, with its encoding for the upload.'''
+    return pygments.highlight(paste, IrcLogsLexer(),
+                              HtmlFormatter(full=True, style='monokai')).encode('utf-8')
+
+
+def render_after(paste):
+    '''The rendering with the streaming renderer.'''
+    buffer = io.BytesIO()
+    loghtml.render_html(paste, buffer)
+    return buffer.getvalue()
+
+
+def peak_memory(func, paste):
+    '''Returns the peak memory allocated while running func, in bytes.'''
+    tracemalloc.start()
+    func(paste)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    '''Runs the benchmark.'''
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    render_after('')  # computes the document header once, like the first paste of the bot
+    for lines_number in SIZES:
+        paste = make_paste(lines_number)
+        assert render_before(paste) == render_after(paste)
+        number = max(1, repetitions * SIZES[0] // lines_number)
+        before = timeit.timeit(lambda: render_before(paste), number=number) / number
+        after = timeit.timeit(lambda: render_after(paste), number=number) / number
+        print('{:>6} lines: before {:8.1f} ms {:8.1f} MiB peak, after {:7.1f} ms {:6.1f} MiB peak '
+              '({:.1f}x faster)'.format(lines_number, before * 1000,
+                                        peak_memory(render_before, paste) / 2**20, after * 1000,
+                                        peak_memory(render_after, paste) / 2**20, before / after))
+
+
+if __name__ == '__main__':
+    main()
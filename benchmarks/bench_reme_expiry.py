@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+'''Measures the 30-second tick of reme forgetting the users not seen for 14 days, with 100k
+tracked nicks last seen over the last 14 days and 2000 of them in the allowed channels:
+the walk of the channels and of every user before, and the expiry queue of remestore after.
+
+Usage: python benchmarks/bench_reme_expiry.py [nicks] [ticks]'''
+
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+
+from remestore import ExpiryQueue
+
+DAYS = 14
+TICK = 30
+PRESENT = 2000
+
+
+def tick_before(users, present, now):
+    '''The tick before the expiry queue: every present user is seen, every user is read.'''
+    for user in present:
+        users[user][1] = now
+    users_to_delete = [user for user, (first_seen, last_seen, _) in users.items()
+                       if (last_seen - first_seen).days > DAYS]
+    for user in users_to_delete:
+        del users[user]
+
+
+def tick_after(users, queue, present, now):
+    '''The tick with the expiry queue: only the users whose time came are read.'''
+    for user in queue.expired(now.timestamp()):
+        if user in present:
+            users[user][1] = now
+            queue.seen(user, now.timestamp())
+        else:
+            del users[user]
+
+
+def main():
+    '''Runs the benchmark.'''
+    nicks_number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    ticks_number = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    rng = random.Random(1)
+    start = datetime.datetime(2019, 3, 1)
+    users = dict()
+    for number in range(nicks_number):
+        last_seen = start - datetime.timedelta(seconds=rng.uniform(0, DAYS * 86400))
+        users['nick{}'.format(number)] = [last_seen - datetime.timedelta(hours=1), last_seen, 1]
+    present = set(rng.sample(sorted(users), PRESENT))
+
+    before_users = {user: list(entry) for user, entry in users.items()}
+    before = 0
+    for tick in range(ticks_number):
+        now = start + datetime.timedelta(seconds=tick * TICK)
+        tick_start = time.perf_counter()
+        tick_before(before_users, present, now)
+        before += time.perf_counter() - tick_start
+
+    queue = ExpiryQueue(DAYS * 86400, {user: entry[1].timestamp()
+                                       for user, entry in users.items()})
+    after = 0
+    for tick in range(ticks_number):
+        now = start + datetime.timedelta(seconds=tick * TICK)
+        tick_start = time.perf_counter()
+        tick_after(users, queue, present, now)
+        after += time.perf_counter() - tick_start
+
+    print('{} nicks, {} ticks: before {:.2f} ms per tick, after {:.1f} us per tick '
+          '({:.0f}x faster), {} users forgotten'.format(
+              nicks_number, ticks_number, before / ticks_number * 1000,
+              after / ticks_number * 10**6, before / after, nicks_number - len(users)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+'''Measures the memory taken per user tracked by reme, with 50k users: a dict of the stats as
+lists of two datetimes and a count before, a dict of UserStats records, and the UserTable
+of remestore after. The nicks are the same in every case and are counted too.
+
+Usage: python benchmarks/bench_reme_memory.py [users]'''
+
+import datetime
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+
+from remestore import UserStats, UserTable
+
+
+def make_list(first_seen, last_seen, lines):
+    '''Returns the stats of a user as before.'''
+    return [datetime.datetime.fromtimestamp(first_seen), datetime.datetime.fromtimestamp(last_seen),
+            lines]
+
+
+def make_users(nicks, rng, users, make_stats):
+    '''Fills users with random stats made by make_stats(first seen, last seen, lines),
+    in epoch seconds, and returns it.'''
+    for nick in nicks:
+        first_seen = 1551398400 + rng.randint(0, 86400 * 14)
+        last_seen = first_seen + rng.randint(0, 86400)
+        if isinstance(users, UserTable):
+            users.seen(nick, first_seen)
+            users.seen(nick, last_seen, rng.randint(0, 500))
+        else:
+            users[nick] = make_stats(first_seen, last_seen, rng.randint(0, 500))
+    return users
+
+
+def measure(users_number, users, make_stats=None):
+    '''Returns the bytes taken per user by the users, nicks included.'''
+    tracemalloc.start()
+    nicks = ['nick{}'.format(number) for number in range(users_number)]
+    users = make_users(nicks, random.Random(1), users, make_stats)
+    taken = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(users) == users_number
+    return taken / users_number
+
+
+def main():
+    '''Runs the benchmark.'''
+    users_number = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    before = measure(users_number, dict(), make_list)
+    print('{} users: before {:.0f} bytes per user'.format(users_number, before))
+    for name, users, make_stats in (('UserStats', dict(), UserStats),
+                                    ('UserTable', UserTable(), None)):
+        after = measure(users_number, users, make_stats)
+        print('{}: {:.0f} bytes per user ({:.0f} bytes less)'.format(name, after, before - after))
+
+
+if __name__ == '__main__':
+    main()
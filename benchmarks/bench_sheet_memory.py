@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+'''Measures the resident memory taken by the rows of a synthetic sheet of 200k rows:
+kept as the lists of strings decoded from the API, and kept in a RowStore with the fields
+of few distinct values interned. Every variant runs in its own process and decodes the same
+rows, which are then formatted for ,search through namedtuples and through views.
+
+Usage: python benchmarks/bench_sheet_memory.py [rows]'''
+
+import collections
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+
+from bench_sheet_search import make_nick
+from sheetstore import RowStore
+
+FIELDS = ['date', 'username', 'result', 'length', 'operator', 'operator2', 'reason', 'channel',
+          'host', 'log', 'notes']
+INTERNED_FIELDS = ('result', 'length', 'operator', 'channel')
+RESULTS = ['Kick', 'Ban', 'Quiet', 'Kickban', 'Warning']
+LENGTHS = ['', '', '1h', '1d', '7d', '30d', 'permanent']
+OPERATORS = ['op{}'.format(number) for number in range(15)]
+CHANNELS = ['#cc', '#cc-help', '#cc-offtopic', '#cc-staff']
+REASONS = ['spam', 'flood', 'trolling', 'ban evasion', 'offensive language', 'advertising']
+
+
+def make_rows(rows_number, rng):
+    '''Returns sheet rows with every field filled.'''
+    rows = []
+    for number in range(rows_number):
+        nick = make_nick(rng)
+        rows.append(['2019-{:02}-{:02}'.format(rng.randint(1, 12), rng.randint(1, 28)), nick,
+                     rng.choice(RESULTS), rng.choice(LENGTHS), rng.choice(OPERATORS),
+                     rng.choice(OPERATORS + [''] * 30), rng.choice(REASONS),
+                     rng.choice(CHANNELS),
+                     '{}!uid{}@ip.{}.example'.format(nick, rng.randint(0, 99999),
+                                                     rng.randint(0, 255)),
+                     'https://paste.example/{:08x}'.format(number), ''])
+    return rows
+
+
+def resident_memory():
+    '''Returns the resident memory of the process in bytes.'''
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(variant, rows_path):
+    '''Prints the resident memory taken by the rows of a JSON file kept as in a variant,
+    and the duration of formatting the last 1000 rows.'''
+    before = resident_memory()
+    with open(rows_path) as rows_file:
+        # like the rows decoded from the API, every value is its own string
+        rows = json.load(rows_file)
+    rows_number = len(rows)
+    if variant == 'store':
+        rows = RowStore(rows, FIELDS, INTERNED_FIELDS)
+    taken = resident_memory() - before
+
+    entry_type = collections.namedtuple('LOGENTRY', FIELDS + ['index'])
+    start = time.perf_counter()
+    for position in range(rows_number - 1000, rows_number):
+        if variant == 'store':
+            entry = rows.view(position, position + 2)
+        else:
+            entry = entry_type(*rows[position][:len(FIELDS)], index=position + 2)
+        '{} on {} ({}) {} [{}]'.format(entry.result, entry.username, entry.host, entry.length,
+                                       entry.index)
+    formatting = time.perf_counter() - start
+    print(taken, formatting)
+
+
+def main():
+    '''Runs the benchmark.'''
+    if len(sys.argv) > 2:
+        measure(sys.argv[1], sys.argv[2])
+        return
+    rows_number = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    results = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        rows_path = os.path.join(directory, 'rows.json')
+        with open(rows_path, 'w') as rows_file:
+            json.dump(make_rows(rows_number, random.Random(1)), rows_file)
+        for variant in ('lists', 'store'):
+            output = subprocess.check_output([sys.executable, __file__, variant, rows_path])
+            taken, formatting = output.split()
+            results[variant] = int(taken), float(formatting)
+    for variant, (taken, formatting) in results.items():
+        print('{} rows as {}: {:.1f} MiB resident, 1000 rows formatted in {:.2f} ms'.format(
+            rows_number, variant, taken / 2**20, formatting * 1000))
+    print('{:.1f}x less memory'.format(results['lists'][0] / results['store'][0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+'''Measures the searches of ,search on a synthetic sheet of 100k rows: the nick searches
+with a fuzz.ratio on every row and with the nick index of sheetindex, and the searches of
+pieces of masks with a substring test on every row and with the host index, and the same
+searches repeated on an unchanged Sheet, which remembers their results.
+
+Usage: python benchmarks/bench_sheet_search.py [rows] [queries]'''
+
+import os
+import random
+import sys
+import time
+from fuzzywuzzy import fuzz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+
+import sheetindex
+
+RATIO = 75
+NICK_COLUMN = 1
+HOST_COLUMN = 8
+WORDS = ['cool', 'dark', 'moon', 'sky', 'star', 'wolf', 'cat', 'user', 'guest', 'lazy', 'happy',
+         'pixel', 'shadow', 'night', 'blue', 'red', 'fox', 'tiger', 'river', 'storm']
+
+
+def make_nick(rng):
+    '''Returns a nick looking like the ones of the sheets.'''
+    nick = rng.choice(WORDS)
+    if rng.random() < 0.6:
+        nick += rng.choice(['', '_', '-']) + rng.choice(WORDS)
+    if rng.random() < 0.5:
+        nick += str(rng.randint(0, 9999))
+    if rng.random() < 0.2:
+        nick = nick.capitalize()
+    return nick + '_' * (rng.random() < 0.1)
+
+
+def make_rows(rows_number, rng):
+    '''Returns sheet rows with the nick and host columns filled.'''
+    rows = []
+    for _ in range(rows_number):
+        nick = make_nick(rng)
+        rows.append(['2019-03-01', nick, 'Kick', '', 'op', '', 'spam', '#cc',
+                     '{}!uid{}@ip.{}.example'.format(nick, rng.randint(0, 99999),
+                                                     rng.randint(0, 255))])
+    return rows
+
+
+def search_before(rows, term):
+    '''The nick search before the index.'''
+    return [index for index, line in enumerate(rows)
+            if line and fuzz.ratio(term.lower(), line[NICK_COLUMN].lower()) >= RATIO]
+
+
+def search_hosts_before(rows, fragment):
+    '''The host search before the index.'''
+    return [index for index, line in enumerate(rows) if line and fragment in line[HOST_COLUMN]]
+
+
+def make_fragments(rows, fragments_number, rng):
+    '''Returns pieces of the hosts of the rows: uids, ip parts and nick prefixes.'''
+    fragments = []
+    for _ in range(fragments_number):
+        host = rng.choice(rows)[HOST_COLUMN]
+        start = rng.choice([0, host.index('!') + 1, host.index('@') + 1])
+        fragments.append(host[start:start + rng.randint(4, 10)])
+    return fragments
+
+
+def measure(search_before, search_after, terms):
+    '''Returns the mean durations of the searches of terms before and after, in seconds.'''
+    before = after = 0
+    for term in terms:
+        start = time.perf_counter()
+        expected = search_before(term)
+        before += time.perf_counter() - start
+        start = time.perf_counter()
+        found = search_after(term)
+        after += time.perf_counter() - start
+        assert found == expected, term
+    return before / len(terms), after / len(terms)
+
+
+def main():
+    '''Runs the benchmark.'''
+    rows_number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    queries_number = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rng = random.Random(1)
+    rows = make_rows(rows_number, rng)
+    terms = [make_nick(rng) for _ in range(queries_number)]
+    fragments = make_fragments(rows, queries_number, rng)
+
+    start = time.perf_counter()
+    sheet_index = sheetindex.SheetIndex(rows, NICK_COLUMN, HOST_COLUMN)
+    build = time.perf_counter() - start
+    print('{} rows, indexes built in {:.0f} ms'.format(rows_number, build * 1000))
+
+    for name, (before, after) in (
+            ('nicks', measure(lambda term: search_before(rows, term),
+                              lambda term: sheet_index.nicks.search(term, RATIO), terms)),
+            ('hosts', measure(lambda fragment: search_hosts_before(rows, fragment),
+                              sheet_index.hosts.search, fragments))):
+        print('{} per query: before {:.2f} ms, after {:.2f} ms ({:.1f}x faster)'.format(
+            name, before * 1000, after * 1000, before / after))
+
+    sheet = sheetindex.Sheet(rows, NICK_COLUMN, HOST_COLUMN)
+    first, repeated = measure(lambda term: sheet.search(term, RATIO),
+                              lambda term: sheet.search(term, RATIO), terms + fragments)
+    print('repeated searches of a Sheet: first {:.2f} ms, then {:.1f} us'.format(
+        first * 1000, repeated * 10**6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+'''Measures the startup of logtools on a synthetic sheet of 100k rows: indexing the
+downloaded rows (without the download itself), and loading the snapshot of the sheet
+and of its indexes saved by the last refresh.
+
+Usage: python benchmarks/bench_sheet_snapshot.py [rows]'''
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+
+import sheetindex
+from bench_sheet_search import make_rows
+
+
+def main():
+    '''Runs the benchmark.'''
+    rows_number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rows = make_rows(rows_number, random.Random(1))
+
+    start = time.perf_counter()
+    sheet = sheetindex.Sheet(rows)
+    build = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'sheets.snapshot')
+        start = time.perf_counter()
+        sheetindex.save_snapshot(path, {'sheet': sheet})
+        save = time.perf_counter() - start
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        loaded = sheetindex.load_snapshot(path)['sheet']
+        load = time.perf_counter() - start
+    assert loaded.search('moon', 75)[1] == sheet.search('moon', 75)[1]
+
+    print('{} rows: indexing the downloaded rows {:.0f} ms, snapshot saved in {:.0f} ms '
+          '({:.1f} MiB), loaded in {:.0f} ms'.format(rows_number, build * 1000, save * 1000,
+                                                     size / 2**20, load * 1000))
+
+
+if __name__ == '__main__':
+    main()
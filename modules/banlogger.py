@@ -3,21 +3,30 @@
 
 import json
 import os
-import re
 import shlex
 import sys
 import argparse
-import subprocess
+import itertools
+import time
 import urllib
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from sopel import module
 from sopel.config.types import StaticSection, ListAttribute, ValidatedAttribute, FilenameAttribute
+from sopel.config.types import ChoiceAttribute
+from sopel.config import ConfigurationError
 from pyshorteners import Shortener
 
 # hack for relative import
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from utils import from_admin_channel_only, get_mod_emoji, create_s3_paste
+from utils import from_admin_channel_only, get_mod_emoji, create_configured_paste
+from utils import get_executor, run_in_background
+from utils import iter_lines_backwards, iter_lines_from, count_lines, BackwardLines
+import logparse
+from logindex import parse_timestamp
+from logactions import APPROPRIATE_BACKTRACK_NUMBER, is_banner_bot, get_action_relevant_info
+from logactions import deduce_last_nickname_or_hostmask, extract_macro_info
 
 
 class BanLoggerSection(StaticSection):
@@ -26,6 +35,14 @@ class BanLoggerSection(StaticSection):
     loggable_channels = ListAttribute('loggable_channels')
     base_form_url = ValidatedAttribute('base_form_url')
     s3_bucket_name = ValidatedAttribute('s3_bucket_name')
+    paste_backend = ChoiceAttribute('paste_backend', ['s3', 'local'], default='s3')
+    paste_dir = FilenameAttribute('paste_dir', directory=True, default=None)
+    paste_base_url = ValidatedAttribute('paste_base_url', default=None)
+    paste_cache_path = FilenameAttribute('paste_cache_path', default=None)
+    paste_cache_size = ValidatedAttribute('paste_cache_size', int, default=1000)
+    workers = ValidatedAttribute('workers', int, default=4)
+    max_queued_work = ValidatedAttribute('max_queued_work', int, default=16)
+    ack_delay = ValidatedAttribute('ack_delay', float, default=2.0)
 
 
 def configure(config):
@@ -37,40 +54,19 @@ LOG_CMD_PARSER = None
 
 URL_SHORTENER = None
 
-# Format them with the appropriate information!
-VALID_NICK = r'[a-zA-Z0-9_\-\\\[\]\{\}\^\`\|]+'
-ISO8601 = r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\+\d{2}:\d{2}'
-OPT_DURATION_GROUP = r'(\+\d{1,3}[smhdy])? ?'
-
-MUTE_REGEX = re.compile(ISO8601+r' --  Mode #?\w+ \(\+b m:(.*)\) by ('+VALID_NICK+r') \((.*)\)')
-BAN_REGEX = re.compile(ISO8601+r' --  Mode #?\w+ \(\+b (.*)\) by ('+VALID_NICK+r') \((.*)\)')
-KICK_REGEX = re.compile(ISO8601+r' <-- ('+VALID_NICK+r') \((.*)\) has kicked (' +
-                        VALID_NICK+r') \(?(.*)\)?')
-REMOVED_REGEX = re.compile(ISO8601+r' <-- ('+VALID_NICK +
-                           r') \((.*)\) has left \(?Removed by ('+VALID_NICK+r').*\)?')
-MSG_REGEX = re.compile(ISO8601+r'     ('+VALID_NICK+r') \((.*)\) (.*)')
-SWITCH_REGEX = re.compile(ISO8601+r' --  ('+VALID_NICK +
-                          r') \((.*)\) is now known as ('+VALID_NICK+')')
-JOIN_REGEX = re.compile(ISO8601+r' --> ('+VALID_NICK+r') \((.*)\) has joined .*')
-
-KICK_MACRO_REGEX = re.compile(ISO8601+r'     ('+VALID_NICK +
-                              r') \(.*\) !ki?c?k? ('+VALID_NICK+r') ?(.*)')
-MUTE_MACRO_REGEX = re.compile(ISO8601+r'     ('+VALID_NICK+r') \(.*\) !mu?t?e? ' +
-                              OPT_DURATION_GROUP+r'('+VALID_NICK+r') ?(.*)')
-BAN_MACRO_REGEX = re.compile(ISO8601+r'     ('+VALID_NICK+r') \(.*\) !k?i?c?k?ba?n? ' +
-                             OPT_DURATION_GROUP+r'('+VALID_NICK+r') ?(.*)')
-
 
 def setup(bot):
     '''Invoked when module is loaded.'''
     bot.config.define_section('banlogger', BanLoggerSection, validate=True)
+    if bot.config.banlogger.paste_backend == 'local' and not bot.config.banlogger.paste_dir:
+        raise ConfigurationError('banlogger: paste_backend = local needs a paste_dir')
 
     argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     global LOG_CMD_PARSER
     LOG_CMD_PARSER = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     LOG_CMD_PARSER.add_argument('mode',
                                 type=str,
-                                choices=['recent', 'auto'],
+                                choices=['recent', 'auto', 'batch'],
                                 default='auto',
                                 help='the desired logging mode')
     LOG_CMD_PARSER.add_argument('--linenumber',
@@ -86,28 +82,50 @@ def setup(bot):
                                 choices=range(1, 4001),
                                 default=4000,
                                 metavar="[1-4000]",
-                                help='the maximum number of lines to search in auto mode')
+                                help='the maximum number of lines to search in '
+                                     'auto and batch modes')
     LOG_CMD_PARSER.add_argument('--maxlogautolines',
                                 '-b',
                                 type=int,
                                 choices=range(1, 4001),
                                 default=400,
                                 metavar="[1-4000]",
-                                help='the maximum number of lines for the log in auto mode')
+                                help='the maximum number of lines for the log in '
+                                     'auto and batch modes')
     LOG_CMD_PARSER.add_argument('--followinglines',
                                 '-f',
                                 type=int,
                                 choices=range(0, 101),
                                 default=2,
                                 metavar="[0-100]",
-                                help='the desired number of lines after the action in auto mode')
+                                help='the desired number of lines after the action in '
+                                     'auto and batch modes')
     LOG_CMD_PARSER.add_argument('--skip',
                                 '-s',
                                 type=int,
                                 choices=range(11),
                                 default=0,
                                 metavar="[0-10]",
-                                help='the number of actions to skip in auto mode')
+                                help='the number of actions to skip in auto and batch modes')
+    LOG_CMD_PARSER.add_argument('--count',
+                                '-n',
+                                type=int,
+                                choices=range(1, 51),
+                                default=10,
+                                metavar="[1-50]",
+                                help='the maximum number of actions per channel in batch mode')
+    LOG_CMD_PARSER.add_argument('--window',
+                                '-w',
+                                type=int,
+                                choices=range(0, 1441),
+                                default=60,
+                                metavar="[0-1440]",
+                                help='only log the actions of the past minutes in batch mode '
+                                     '(0 for no limit)')
+    LOG_CMD_PARSER.add_argument('--allchans',
+                                '-a',
+                                action='store_true',
+                                help='log the actions of every loggable channel in batch mode')
     LOG_CMD_PARSER.add_argument('--chan',
                                 '-c',
                                 type=str.lower,
@@ -118,14 +136,22 @@ def setup(bot):
     global URL_SHORTENER
     URL_SHORTENER = Shortener('Tinyurl', timeout=10)
 
-    bot.memory['last_log_information'] = {'nick': None,
-                                          'result': None,
-                                          'length': None,
-                                          'operator': None,
-                                          'channel': None,
-                                          'reason': None,
-                                          'host': None,
-                                          'paste': None}
+    # one record per logged action, all the ones of the last batch
+    bot.memory['last_log_information'] = [{'nick': None,
+                                           'result': None,
+                                           'length': None,
+                                           'operator': None,
+                                           'channel': None,
+                                           'reason': None,
+                                           'host': None,
+                                           'paste': None}]
+
+
+def shutdown(bot):
+    '''Invoked when the module is unloaded or the bot quits.'''
+    if bot.memory.contains('command_executor'):
+        bot.memory['command_executor'].shutdown(wait=False)
+        del bot.memory['command_executor']
 
 
 CHANNEL_FOR_LOG = {'#casualconversation': '#Casualconversation',
@@ -133,16 +159,11 @@ CHANNEL_FOR_LOG = {'#casualconversation': '#Casualconversation',
                    '#casualnsfw': '#CasualNSFW',
                    '#casualappeals': 'All'}
 
-APPROPRIATE_BACKTRACK_NUMBER = 8  # The number of lines to analyze before an action
-
 
 @module.commands('log')
 @from_admin_channel_only
 def log(bot, trigger):
     '''Bot function to log a ban in a given channel, has multiple options.'''
-
-    extra_info = ''
-
     arguments = trigger.groups()[1]
     if arguments is None:
         bot.reply('No arguments :(   To learn the command syntax, please use -h')
@@ -156,70 +177,220 @@ def log(bot, trigger):
             bot.reply('invalid arguments :(   To learn the command syntax, please use -h')
         return
 
-    if args.mode == 'recent':
-        log_content = read_log_file(bot, args.chan, args.linenumber)
-        log_lines = log_content.split('\n')
-        start_index = 0
-        end_index = len(log_lines)
-        action_index = get_action_line_index(log_lines, args.skip)
-        if action_index is None:
-            relevant_info = dict()
-        else:  # duplicated, but I'm not comfortable because it's used below too
-            relevant_info = get_action_relevant_info(log_lines[action_index])
-            deduce_last_nickname_or_hostmask(log_lines[:action_index], relevant_info)
-            if is_banner_bot(relevant_info['operator']):
-                backtrack_index = max(0, action_index-APPROPRIATE_BACKTRACK_NUMBER)
-                extract_macro_info(log_lines[backtrack_index:action_index], relevant_info)
-    elif args.mode == 'auto':
-        log_content = read_log_file(bot, args.chan, args.maxautolines)
-        log_lines = log_content.split('\n')
-        log_length = len(log_lines)
-
-        action_index = get_action_line_index(log_lines, args.skip)
-        if action_index is None:
-            bot.reply('I did not find any action in the past {} lines :('.format(args.maxautolines))
-            return
-        end_index = min(log_length, action_index+args.followinglines+1)  # +1 to include the index
-
-        relevant_info = get_action_relevant_info(log_lines[action_index])
-        deduce_last_nickname_or_hostmask(log_lines[:action_index], relevant_info)
-        if is_banner_bot(relevant_info['operator']):
-            backtrack_index = max(0, action_index-APPROPRIATE_BACKTRACK_NUMBER)
-            extract_macro_info(log_lines[backtrack_index:action_index], relevant_info)
-
-        if 'host' not in relevant_info or 'nick' not in relevant_info:
-            print(relevant_info)
-            bot.reply('For some strange reason I do not have the hostmask yet, stopping search')
-            return
+    if args.mode == 'batch':
+        run_in_background(bot, 'logbatch', make_batch_log, bot, args)
+    else:
+        run_in_background(bot, 'log', make_log, bot, args)
 
-        start_index = get_first_index(log_lines[:action_index], relevant_info)
-        if start_index is None:
-            extra_info = extra_info + '(could not find join of user, log may miss some context) '
-            start_index = 0
 
-        if end_index - start_index > args.maxlogautolines:
-            extra_info += 'only using {} lines, use -b if needed '.format(args.maxlogautolines)
-            start_index = end_index - args.maxlogautolines
+def make_log(bot, args):
+    '''Reads the relevant part of the log, pastes it and replies with the link.
+    Runs on the worker pool.'''
+    timings = get_executor(bot).timings
+    with timings.measure('log.read'):
+        relevant_log = read_relevant_log(bot, args)
+    if relevant_log is None:
+        return
+    relevant_info, log_events, extra_info = relevant_log
 
-    prettified_lines = prettify_lines(log_lines[start_index:end_index])
-    relevant_content = '\n'.join(prettified_lines)
+    with timings.measure('log.prettify'):
+        relevant_content = '\n'.join(prettify_lines(log_events))
     try:
-        url_content = create_s3_paste(bot.config.banlogger.s3_bucket_name, relevant_content)
+        url_content = create_configured_paste(bot, relevant_content)
     except json.decoder.JSONDecodeError as err:
         bot.reply('The paste service is down :(')
         raise Exception(err)
     relevant_info['log_url'] = url_content
     relevant_info['channel'] = CHANNEL_FOR_LOG[args.chan]
 
-    bot.memory['last_log_information'] = relevant_info
+    bot.memory['last_log_information'] = [relevant_info]
     bot.reply('Logged here: {} {}'.format(url_content, extra_info))
 
 
-def is_banner_bot(nickname):
-    '''Returns true if the bot can ban people'''
-    return nickname in ('Casual_Ban_Bot',
-                        'NSA',
-                        'ChanServ')
+def make_batch_log(bot, args):
+    '''Logs the actions selected by the batch mode in one or all the loggable channels,
+    in a single paste with a section per action, and replies with the link.
+    Runs on the worker pool.'''
+    channels = bot.config.banlogger.loggable_channels if args.allchans else [args.chan]
+    if not channels:
+        bot.reply('There is no loggable channel :(')
+        return
+    # the channels are read in parallel, within the limit of the worker pool
+    readers_number = max(1, min(len(channels), bot.config.banlogger.workers))
+    timings = get_executor(bot).timings
+    with timings.measure('logbatch.read'):
+        with ThreadPoolExecutor(readers_number) as readers:
+            readings = [readers.submit(read_channel_actions, bot, args, channel)
+                        for channel in channels]
+            channel_sections = [reading.result() for reading in readings]
+    # oldest action first
+    sections = sorted(itertools.chain.from_iterable(channel_sections),
+                      key=lambda section: section[0] or 0)
+    if not sections:
+        bot.reply('I did not find any action to log :(')
+        return
+
+    with timings.measure('logbatch.prettify'):
+        paste_lines = []
+        for number, (_, channel, relevant_info, log_events, extra_info) in enumerate(sections, 1):
+            paste_lines.append(format_section_header(number, len(sections), channel,
+                                                     relevant_info, extra_info))
+            paste_lines.extend(prettify_lines(log_events))
+            paste_lines.append('')
+    try:
+        url_content = create_configured_paste(bot, '\n'.join(paste_lines))
+    except json.decoder.JSONDecodeError as err:
+        bot.reply('The paste service is down :(')
+        raise Exception(err)
+
+    records = []
+    for _, channel, relevant_info, _, _ in sections:
+        relevant_info['log_url'] = url_content
+        relevant_info['channel'] = CHANNEL_FOR_LOG[channel]
+        records.append(relevant_info)
+    bot.memory['last_log_information'] = records
+    bot.reply('Logged {} actions here: {} (,form gives their forms)'.format(len(records),
+                                                                          url_content))
+
+
+def read_channel_actions(bot, args, channel):
+    '''Finds the actions of a channel selected by the batch mode arguments, with a single read
+    of its last lines. Returns the time, channel, information, events (oldest first)
+    and extra information of every action, most recent first.'''
+    filepath = get_log_path(bot, channel)
+    identities = get_identities(bot)
+    log_events = read_log_lines(bot, channel, args.maxautolines)
+    since = time.time() - args.window * 60 if args.window else None
+    skip = args.skip
+    sections = []
+    for action_position, event in enumerate(log_events.iter_from(0)):
+        action_time = parse_timestamp(event.line)
+        if since is not None and action_time is not None and action_time < since:
+            break
+        if not logparse.action_kind(event):
+            continue
+        if skip > 0:
+            skip -= 1
+            continue
+        relevant_info = get_action_context_info(log_events, action_position, identities, filepath)
+        newest_position, oldest_position, extra_info = get_log_range(
+            log_events, action_position, None, relevant_info, args, identities, filepath)
+        sections.append((action_time, channel, relevant_info,
+                         log_events.chronological(newest_position, oldest_position), extra_info))
+        if len(sections) >= args.count:
+            break
+    return sections
+
+
+def format_section_header(number, sections_number, channel, relevant_info, extra_info):
+    '''Returns the line introducing the log of an action in a batch paste.'''
+    header = '===== {}/{} {}: {} on {} ({}) by {}'.format(
+        number, sections_number, channel, relevant_info['result'],
+        relevant_info.get('nick', '?'), relevant_info.get('host', '?'),
+        relevant_info['operator'])
+    if extra_info:
+        header += ' ' + extra_info.strip()
+    return header + ' ====='
+
+
+def read_relevant_log(bot, args):
+    '''Finds the action and the relevant lines around it according to the command arguments.
+    Returns the information about the action, the events (oldest first) and extra information
+    for the mod, or None if there is nothing to log (the mod is told why).'''
+    extra_info = ''
+    filepath = get_log_path(bot, args.chan)
+    identities = get_identities(bot)
+    if args.mode == 'recent':
+        log_events = read_log_lines(bot, args.chan, args.linenumber)
+        newest_position = 0
+        oldest_position = log_events.read_all() - 1
+        action_position = get_action_line_index(log_events.iter_from(0), args.skip)
+        if action_position is None:
+            relevant_info = dict()
+        else:
+            relevant_info = get_action_context_info(log_events, action_position,
+                                                    identities, filepath)
+    elif args.mode == 'auto':
+        log_events, action_position, action = read_indexed_action_lines(
+            bot, args.chan, args.skip, args.maxautolines, args.followinglines)
+        action_offset = None
+        target_hostmask = None
+        if log_events is None:
+            log_events = read_log_lines(bot, args.chan, args.maxautolines)
+            action_position = get_action_line_index(log_events.iter_from(0), args.skip)
+        else:
+            action_offset = action['offset']
+            target_hostmask = action.get('hostmask')
+        if action_position is None:
+            bot.reply('I did not find any action in the past {} lines :('.format(args.maxautolines))
+            return None
+        relevant_info = get_action_context_info(log_events, action_position,
+                                                identities, filepath, target_hostmask)
+
+        if 'host' not in relevant_info or 'nick' not in relevant_info:
+            print(relevant_info)
+            bot.reply('For some strange reason I do not have the hostmask yet, stopping search')
+            return None
+
+        newest_position, oldest_position, extra_info = get_log_range(
+            log_events, action_position, action_offset, relevant_info, args, identities, filepath)
+
+    return relevant_info, log_events.chronological(newest_position, oldest_position), extra_info
+
+
+def get_log_range(log_events, action_position, action_offset, relevant_info, args,
+                  identities, filepath):
+    '''Returns the positions of the newest and oldest lines to log around an action,
+    from a few lines after it to the join of the user, and extra information for the mod'''
+    extra_info = ''
+    newest_position = max(0, action_position-args.followinglines)
+    oldest_position = None
+    if 'host' in relevant_info:
+        oldest_position = get_join_position(identities, filepath, log_events[action_position],
+                                            action_offset, relevant_info)
+        if oldest_position is not None:
+            oldest_position += action_position
+        else:
+            oldest_position = get_first_index(log_events.iter_from(action_position+1),
+                                              relevant_info)
+            if oldest_position is not None:
+                oldest_position += action_position+1
+    if oldest_position is None:
+        extra_info += '(could not find join of user, log may miss some context) '
+        oldest_position = log_events.read_all() - 1
+
+    if oldest_position - newest_position + 1 > args.maxlogautolines:
+        extra_info += 'only using {} lines, use -b if needed '.format(args.maxlogautolines)
+        oldest_position = newest_position + args.maxlogautolines - 1
+    # the join known by the identity tracker may be farther than the searched lines
+    log_events.max_lines = max(log_events.max_lines, oldest_position + 1)
+    return newest_position, oldest_position, extra_info
+
+
+@module.commands('actions')
+@from_admin_channel_only
+def last_actions(bot, trigger):
+    '''Lists the last moderation actions of a channel: ,actions [#channel] [number]'''
+    channel = '#casualconversation'
+    number = 3
+    for argument in (trigger.groups()[1] or '').split():
+        if argument.startswith('#'):
+            channel = argument.lower()
+        elif argument.isdigit():
+            number = max(1, min(int(argument), 10))
+    if channel not in bot.config.banlogger.loggable_channels:
+        bot.reply('I do not log {} :('.format(channel))
+        return
+    if not bot.memory.contains('chanlog_actions'):
+        bot.reply('The action index is not available, is chanlogs enabled?')
+        return
+
+    actions = bot.memory['chanlog_actions'].last(get_log_path(bot, channel), number)
+    if not actions:
+        bot.reply('No action known in {}.'.format(channel))
+    for skip, action in enumerate(actions):
+        bot.say('\u25A0 [-s {}] {time} {kind} on {target} by {operator}'.format(skip, **action),
+                max_messages=2)
 
 
 ENTRY_INDEXES = {'nick': '1999262323', 'result': '1898835520', 'length': '1118037499',
@@ -231,20 +402,32 @@ ENTRY_INDEXES = {'nick': '1999262323', 'result': '1898835520', 'length': '111803
 @module.commands('form')
 @from_admin_channel_only
 def serve_filled_form(bot, trigger):
-    '''Serves a filled form from the memorized information of the last log.'''
-    form_url = bot.config.banlogger.base_form_url
-    for info_type, info_value in bot.memory['last_log_information'].items():
-        if info_value is not None:
-            form_url += '&entry.{}={}'.format(ENTRY_INDEXES[info_type],
-                                              urllib.parse.quote_plus(info_value))
+    '''Serves the filled forms from the memorized information of the last log.'''
+    form_urls = []
+    for log_information in bot.memory['last_log_information']:
+        form_url = bot.config.banlogger.base_form_url
+        for info_type, info_value in log_information.items():
+            if info_value is not None:
+                form_url += '&entry.{}={}'.format(ENTRY_INDEXES[info_type],
+                                                  urllib.parse.quote_plus(info_value))
+        form_urls.append((log_information.get('nick'), form_url))
     center_emoji = get_mod_emoji(trigger.nick)
+    run_in_background(bot, 'form', shorten_form_urls, bot, form_urls, center_emoji)
 
-    try:
-        shortened_url = URL_SHORTENER.short(form_url)
-    except requests.exceptions.ReadTimeout:
-        bot.reply('TinyURL connection timeout.')
-    else:
-        bot.reply('\U0001F449'+center_emoji+'\U0001F449 ' + shortened_url)
+
+def shorten_form_urls(bot, form_urls, center_emoji):
+    '''Shortens the urls of the filled forms and replies with them. Runs on the worker pool.'''
+    for nick, form_url in form_urls:
+        try:
+            shortened_url = URL_SHORTENER.short(form_url)
+        except requests.exceptions.ReadTimeout:
+            bot.reply('TinyURL connection timeout.')
+            return
+        if len(form_urls) == 1:
+            bot.reply('\U0001F449'+center_emoji+'\U0001F449 ' + shortened_url)
+        else:
+            bot.say('\u25A0 {}: \U0001F449{}\U0001F449 {}'.format(nick, center_emoji,
+                                                                 shortened_url))
 
 
 @module.commands('helplog')
@@ -253,220 +436,180 @@ def helplog(bot, trigger):
     '''Serves the help information for the command.'''
     help_content = LOG_CMD_PARSER.format_help()
     help_content = help_content.replace('sopel', ',log')
+    run_in_background(bot, 'helplog', paste_help, bot, help_content)
+
+
+def paste_help(bot, help_content):
+    '''Pastes the help information and replies with the link. Runs on the worker pool.'''
     try:
-        url = create_s3_paste(bot.config.banlogger.s3_bucket_name,
-                              help_content,
-                              wanted_title="logcommandhelp")
+        url = create_configured_paste(bot, help_content, wanted_title="logcommandhelp")
     except json.decoder.JSONDecodeError as err:
         bot.reply("The paste service is down :(")
         raise Exception(err)
     bot.reply(url)
 
 
-def prettify_lines(lines):
+@module.commands('timings')
+@from_admin_channel_only
+def report_timings(bot, trigger):
+    '''Reports the recent durations of the stages of the slow commands.'''
+    summary = get_executor(bot).timings.summary()
+    if not summary:
+        bot.reply('Nothing was timed yet.')
+        return
+    bot.say(' | '.join('{}: {} runs, mean {:.0f} ms, max {:.0f} ms'.format(
+        stage, runs, mean * 1000, maximum * 1000) for stage, runs, mean, maximum in summary),
+            max_messages=3)
+
+
+def prettify_lines(log_events):
     '''Reformats parts of the log to make them more human-readable'''
-    # remove the host on regular messages
-    lines_reordered_fields = []
-    lines_compact_time = []
-    for line in lines:
-        message_match = MSG_REGEX.match(line)
-        if message_match:
-            host_str = '(' + message_match.group(2) + ') '
-            nick_str = message_match.group(1)
-            new_nick_str = '<' + nick_str + '>'
-            better_line = line.replace(host_str, '', 1).replace(nick_str, new_nick_str, 1)
-            lines_reordered_fields.append(better_line)
+    new_lines = []
+    for event in log_events:
+        # remove the host on regular messages
+        if event.kind == logparse.MESSAGE and event.nick is not None:
+            line = event.line[:event.header_length] + '<' + event.nick + '> ' + event.text
         else:
-            lines_reordered_fields.append(line)
-
-    # reformat the timestamp a bit (remove the T, remove the timezone part)
-    for line in lines_reordered_fields:
-        lines_compact_time.append(line[0:10]+' '+line[11:19]+line[25:len(line)])
+            line = event.line
 
-    new_lines = lines_compact_time
+        # reformat the timestamp a bit (remove the T, remove the timezone part)
+        new_lines.append(line[0:10]+' '+line[11:19]+line[25:len(line)])
 
     return new_lines
 
 
-def read_log_file(bot, channel_name, lines_number):
-    '''Reads a log file, returns the lines'''
+def get_log_path(bot, channel_name):
+    '''Returns the path of the log file of a channel'''
     fixed_chan_name = channel_name.lstrip('#')
-    filepath = os.path.join(bot.config.chanlogs.dir, '{}.log'.format(fixed_chan_name))
-    cmd = ('tail', '-n', '{}'.format(lines_number), filepath)
-    output = None
-    output = subprocess.check_output(list(cmd))
-
-    log_content = output.decode('utf8')
-    return log_content
-
-
-VPN_MESSAGE_PART = 'You must register your nickname to use a VPN connection on this channel.'
-
-
-def get_action_line_index(log_lines, action_number_to_skip):
-    '''Gets the index of the action done by a mod'''
-
-    index_to_return = None
-
-    for line_index, line_str in reversed(list(enumerate(log_lines))):
-        mute_match = MUTE_REGEX.match(line_str)
-        ban_match = BAN_REGEX.match(line_str)
-        simple_kick_match = KICK_REGEX.match(line_str)
-        removed_by_op_match = REMOVED_REGEX.match(line_str)
-        ban_match = BAN_REGEX.match(line_str)
-        is_an_action = mute_match or ban_match or simple_kick_match or removed_by_op_match
-        if (simple_kick_match and
-                simple_kick_match.group(1) == 'gonzobot'):  # ugh duckhunt
-            continue
-        if (simple_kick_match and
-                simple_kick_match.group(1) == 'StormBot' and
-                VPN_MESSAGE_PART in simple_kick_match.group(3)):  # vpn timed ban part 1
-            continue
-        if (ban_match and
-                ban_match.group(2) == 'StormBot' and
-                'U:' in ban_match.group(1)):  # vpn timed ban part 2
-            continue
-        if (ban_match and
-                ban_match.group(2) == 'StormBot' and
-                'fix-your-connection' in ban_match.group(1)):  # connection fix timed ban
-            continue
-        if is_an_action and action_number_to_skip <= 0:
-            index_to_return = line_index
-            break
-        elif is_an_action:
+    return os.path.join(bot.config.chanlogs.dir, '{}.log'.format(fixed_chan_name))
+
+
+def read_log_lines(bot, channel_name, lines_number):
+    '''Returns the events of the last lines of a log file, read lazily from the most recent one'''
+    filepath = get_log_path(bot, channel_name)
+
+    # the lines written recently are kept in memory by chanlogs
+    lines_iterator = None
+    if bot.memory.contains('chanlog_recent'):
+        recent_lines = bot.memory['chanlog_recent'].tail(filepath, lines_number)
+        if recent_lines is not None:
+            lines_iterator = reversed(recent_lines)
+    if lines_iterator is None:
+        lines_iterator = iter_lines_backwards(filepath)
+
+    return BackwardLines(logparse.parse_lines(lines_iterator), lines_number)
+
+
+def get_identities(bot):
+    '''Returns the identity tracker of chanlogs, or None if it is not loaded'''
+    if not bot.memory.contains('chanlog_identities'):
+        return None
+    return bot.memory['chanlog_identities']
+
+
+def read_indexed_action_lines(bot, channel_name, skip, lines_number, following_lines):
+    '''Reads the lines around an action known by the action index of chanlogs.
+    Returns the events, read lazily from the most recent one, the position of the action
+    and its record (with its offset in the file and the hostmask of its target),
+    or (None, None, None) if the action is not in the index.'''
+    if not bot.memory.contains('chanlog_actions'):
+        return None, None, None
+    filepath = get_log_path(bot, channel_name)
+
+    # actions are indexed once their line is written
+    bot.memory['chanlog_writer'].sync(5)
+    action = bot.memory['chanlog_actions'].latest(filepath, skip)
+    if action is None:
+        return None, None, None
+
+    newer_lines = list(itertools.islice(iter_lines_from(filepath, action['offset']),
+                                        following_lines+1))
+    if not newer_lines or not logparse.action_kind(logparse.parse_line(newer_lines[0])):
+        print('the action index does not match {}'.format(filepath))
+        return None, None, None
+
+    action_position = len(newer_lines)-1
+    lines_iterator = itertools.chain(reversed(newer_lines),
+                                     iter_lines_backwards(filepath, end_offset=action['offset']))
+    log_events = BackwardLines(logparse.parse_lines(lines_iterator), action_position+lines_number)
+    return log_events, action_position, action
+
+
+def get_action_line_index(log_events, action_number_to_skip):
+    '''Gets the position of the action done by a mod, in lines from the most recent one.
+    The events are given most recent first, and are only read until the action is found.'''
+    for line_index, event in enumerate(log_events):
+        if logparse.action_kind(event):
+            if action_number_to_skip <= 0:
+                return line_index
             action_number_to_skip -= 1
 
-    return index_to_return
-
-
-def get_action_relevant_info(line_str):
-    '''Returns a dictionary of useful information from the action line'''
-    relevant_info = dict()
-    mute_match = MUTE_REGEX.match(line_str)
-    ban_match = BAN_REGEX.match(line_str)
-    simple_kick_match = KICK_REGEX.match(line_str)
-    removed_by_op_match = REMOVED_REGEX.match(line_str)
-
-    # permanent bans are downgraded to timed bans during backtrack
-    if mute_match:
-        relevant_info['result'] = 'Permanent Mute'
-        relevant_info['host'] = mute_match.group(1).split('@')[1]
-        relevant_info['operator'] = mute_match.group(2)
-    elif ban_match:
-        relevant_info['result'] = 'Permanent Ban'
-        relevant_info['host'] = ban_match.group(1).split('@')[1]
-        relevant_info['operator'] = ban_match.group(2)
-    elif simple_kick_match:
-        relevant_info['result'] = 'Kick'
-        relevant_info['operator'] = simple_kick_match.group(1)
-        relevant_info['nick'] = simple_kick_match.group(3)
-        relevant_info['reason'] = simple_kick_match.group(4)
-    elif removed_by_op_match:
-        relevant_info['result'] = 'Kick'  # for logging purposes, interpreted as kick
-        relevant_info['nick'] = removed_by_op_match.group(1)
-        relevant_info['host'] = removed_by_op_match.group(2).split('@')[1]
-        relevant_info['operator'] = removed_by_op_match.group(3)
+    return None
+
 
+def get_action_context_info(log_events, action_position, identities=None, filepath=None,
+                            target_hostmask=None):
+    '''Returns the information about the action, completed with the hostmask of its target
+    recorded by the action index, or what the identity tracker knows about the user,
+    or else with the events preceding it'''
+    action_event = log_events[action_position]
+    relevant_info = get_action_relevant_info(action_event)
+    if not recall_nickname_or_hostmask(identities, filepath, action_event, relevant_info,
+                                       target_hostmask):
+        deduce_last_nickname_or_hostmask(log_events.iter_from(action_position+1), relevant_info)
+    if is_banner_bot(relevant_info['operator']):
+        extract_macro_info(itertools.islice(log_events.iter_from(action_position+1),
+                                            APPROPRIATE_BACKTRACK_NUMBER),
+                           relevant_info)
     return relevant_info
 
 
-def deduce_last_nickname_or_hostmask(log_lines, relevant_info):
-    '''Deduces the nickname from the hostmask or vice-versa'''
-    if 'host' not in relevant_info:
-        missing_info = 'host'
-        known_info = 'nick'
-    elif 'nick' not in relevant_info:
-        missing_info = 'nick'
-        known_info = 'host'
-    else:
-        # all the info is already available
-        print('deducing failed')
-        return
-
-    for line_str in reversed(log_lines):
-        # If they speak, we have their hostmask and nick
-        # If they switch their nick, we get their hostmask and nick that way too
-        # If we get their join line, that gives us their nick and hostmask
-        message_match = MSG_REGEX.match(line_str)
-        switch_match = SWITCH_REGEX.match(line_str)
-        join_match = JOIN_REGEX.match(line_str)
-        if missing_info == 'nick':
-            if message_match and message_match.group(2).split('@')[1] == relevant_info[known_info]:
-                relevant_info[missing_info] = message_match.group(1)
-                break
-            if switch_match and switch_match.group(2).split('@')[1] == relevant_info[known_info]:
-                relevant_info[missing_info] = switch_match.group(3)
-                break
-            if join_match and join_match.group(2).split('@')[1] == relevant_info[known_info]:
-                relevant_info[missing_info] = join_match.group(1)
-                break
-        elif missing_info == 'host':
-            if message_match and message_match.group(1) == relevant_info[known_info]:
-                relevant_info[missing_info] = message_match.group(2).split('@')[1]
-                break
-            if switch_match and switch_match.group(3) == relevant_info[known_info]:
-                relevant_info[missing_info] = switch_match.group(2).split('@')[1]
-                break
-            if join_match and join_match.group(1) == relevant_info[known_info]:
-                relevant_info[missing_info] = join_match.group(2).split('@')[1]
-                break
-
-
-def get_first_index(log_lines, relevant_info):
-    '''Returns the first index (join) of the user, otherwise None is returned'''
-    for line_index, line_str in reversed(list(enumerate(log_lines))):
-        join_match = JOIN_REGEX.match(line_str)
-        if join_match and join_match.group(2).split('@')[1] == relevant_info['host']:
+def recall_nickname_or_hostmask(identities, filepath, action_event, relevant_info,
+                                target_hostmask=None):
+    '''Completes the nickname from the hostmask or vice-versa with the ones in use at the time
+    of the action: the hostmask of the target recorded with the action by chanlogs (known for
+    the kicks of the users in the live index), or else the ones known by the identity tracker.
+    Returns False if they are not known'''
+    if 'host' not in relevant_info and 'nick' in relevant_info and target_hostmask:
+        relevant_info['host'] = target_hostmask.split('@', 1)[-1]
+        return True
+    if identities is None:
+        return False
+    action_time = parse_timestamp(action_event.line)
+    if 'nick' not in relevant_info and 'host' in relevant_info:
+        nick = identities.nick_of(filepath, relevant_info['host'], action_time)
+        if nick is None:
+            return False
+        relevant_info['nick'] = nick
+    elif 'host' not in relevant_info and 'nick' in relevant_info:
+        host = identities.host_of(filepath, relevant_info['nick'], action_time)
+        if host is None:
+            return False
+        relevant_info['host'] = host
+    return True
+
+
+def get_join_position(identities, filepath, action_event, action_offset, relevant_info):
+    '''Returns the number of lines from the join of the user to the action (excluded),
+    from the join offset known by the identity tracker, or None if it is not known'''
+    if identities is None or action_offset is None:
+        return None
+    join_offset = identities.join_of(filepath, relevant_info['host'],
+                                     parse_timestamp(action_event.line))
+    if join_offset is None or join_offset >= action_offset:
+        return None
+    join_event = logparse.parse_line(next(iter_lines_from(filepath, join_offset), ''))
+    if join_event.kind != logparse.JOIN or join_event.host != relevant_info['host']:
+        print('the identity tracker does not match {}'.format(filepath))
+        return None
+    return count_lines(filepath, join_offset, action_offset)
+
+
+def get_first_index(log_events, relevant_info):
+    '''Returns the position of the join of the user in events given most recent first,
+    otherwise None is returned'''
+    for line_index, event in enumerate(log_events):
+        if event.kind == logparse.JOIN and event.host == relevant_info['host']:
             return line_index
 
     return None
-
-
-def extract_macro_info(log_lines, relevant_info):
-    '''Searches for macro information, if available, for example !k, then extracts relevant info'''
-    if 'nick' not in relevant_info:
-        return  # to detect the correct line
-
-    for _, line_str in reversed(list(enumerate(log_lines))):
-        kick_match = KICK_MACRO_REGEX.match(line_str)
-        mute_match = MUTE_MACRO_REGEX.match(line_str)
-        ban_match = BAN_MACRO_REGEX.match(line_str)
-        if (kick_match and
-                kick_match.group(2) == relevant_info['nick']):
-            relevant_info['operator'] = kick_match.group(1)
-            relevant_info['reason'] = kick_match.group(3)
-            break
-        elif (mute_match and
-              mute_match.group(3) == relevant_info['nick'] and
-              relevant_info['result'] == 'Permanent Mute'):
-            relevant_info['operator'] = mute_match.group(1)
-            if mute_match.group(2):
-                relevant_info['length'] = format_time(mute_match.group(2))
-                relevant_info['result'] = 'Timed Mute'
-            relevant_info['reason'] = mute_match.group(4)
-            break
-        elif (ban_match and
-              ban_match.group(3) == relevant_info['nick'] and
-              relevant_info['result'] == 'Permanent Ban'):
-            relevant_info['operator'] = ban_match.group(1)
-            if ban_match.group(2):
-                relevant_info['length'] = format_time(ban_match.group(2))
-                relevant_info['result'] = 'Timed Ban'
-            relevant_info['reason'] = ban_match.group(4)
-            break
-
-
-def format_time(unformatted_time):
-    '''Returns the time in a format fit for the spreadsheet'''
-    time_unformatted = unformatted_time.strip('+')
-    if 's' in time_unformatted:
-        time_unformatted = time_unformatted.replace('y', ' years')
-    elif 'm' in time_unformatted:
-        time_unformatted = time_unformatted.replace('m', ' minutes')
-    elif 'h' in time_unformatted:
-        time_unformatted = time_unformatted.replace('h', ' hours')
-    elif 'd' in time_unformatted:
-        time_unformatted = time_unformatted.replace('d', ' days')
-    elif 'y' in time_unformatted:
-        time_unformatted = time_unformatted.replace('y', ' years')
-    return time_unformatted
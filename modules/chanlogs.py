@@ -13,7 +13,10 @@ from __future__ import unicode_literals
 import os
 import os.path
 import re
-import threading
+import sys
+import time
+from string import Formatter
+from _string import formatter_field_name_split
 from datetime import datetime
 from collections import defaultdict
 try:
@@ -25,6 +28,14 @@ import sopel.module
 import sopel.tools
 from sopel.config.types import StaticSection, ValidatedAttribute, FilenameAttribute
 
+# hack for relative import
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from logfiles import HandlePool, GroupCommitWriter, RecentLines
+from logindex import TimeIndexer, ActionIndex
+from identity import IdentityTracker, LiveUsers, JOIN_RECORD
+import logparse
+
 
 MESSAGE_TPL = "{datetime}     {trigger.nick} ({trigger.hostmask}) {message}"
 ACTION_TPL = "{datetime}     {trigger.nick} ({trigger.hostmask}) * {message}"
@@ -38,6 +49,18 @@ NICK_TPL = "{datetime} --  {trigger.nick} ({trigger.hostmask}) is now known as {
 JOIN_TPL = "{datetime} --> {trigger.nick} ({trigger.hostmask}) has joined {trigger}"
 PART_TPL = "{datetime} <-- {trigger.nick} ({trigger.hostmask}) has left ({trigger})"
 QUIT_TPL = "{datetime} *** {trigger.nick} ({trigger.hostmask}) has quit IRC ({trigger.args[0]})"
+# kind of line: (configuration setting, default template)
+TEMPLATES = {'message': ('message_template', MESSAGE_TPL),
+             'action': ('action_template', ACTION_TPL),
+             'mode_2': ('mode_template', MODE_TPL_2),
+             'mode_3': ('mode_template', MODE_TPL_3),
+             'kick': ('kick_template', KICK_TPL),
+             'nick': ('nick_template', NICK_TPL),
+             'join': ('join_template', JOIN_TPL),
+             'part': ('part_template', PART_TPL),
+             'quit': ('quit_template', QUIT_TPL)}
+STAMP_FIELDS = {'datetime': 0, 'date': 1, 'time': 2}
+CONVERSIONS = {'s': 'str', 'r': 'repr', 'a': 'ascii'}
 # According to Wikipedia
 BAD_CHARS = re.compile(r'[\/?%*:|"<>. ]')
 
@@ -62,6 +85,22 @@ class ChanlogsSection(StaticSection):
     part_template = ValidatedAttribute('part_template', default=None)
     quit_template = ValidatedAttribute('quit_template', default=None)
     nick_template = ValidatedAttribute('nick_template', default=None)
+    max_open_files = ValidatedAttribute('max_open_files', int, default=64)
+    """Maximum number of log files kept open at the same time"""
+    flush_interval = ValidatedAttribute('flush_interval', int, default=200)
+    """Milliseconds a line may wait before being written, 0 writes every line immediately"""
+    flush_bytes = ValidatedAttribute('flush_bytes', int, default=65536)
+    """Pending bytes that trigger a write before the flush interval elapses"""
+    time_index = ValidatedAttribute('time_index', parse=bool, default=True)
+    """Keep a time index next to every log file"""
+    time_index_lines = ValidatedAttribute('time_index_lines', int, default=500)
+    """Maximum number of lines between two time index records"""
+    recent_lines = ValidatedAttribute('recent_lines', int, default=4000)
+    """Number of recent lines of every log file kept in memory, 0 to disable"""
+    recent_max_bytes = ValidatedAttribute('recent_max_bytes', int, default=2097152)
+    """Approximate cap in bytes (utf-8) of the recent lines of every log file"""
+    identity_max_age = ValidatedAttribute('identity_max_age', int, default=24)
+    """Hours after which the nicks and hosts of users not seen anymore are forgotten"""
 
 
 def configure(config):
@@ -73,18 +112,46 @@ def configure(config):
     )
 
 
+class LogClock:
+    """
+    Provides the timestamps of the log lines. The timezone is resolved once,
+    and without microsecond precision the timestamps are formatted once per second.
+    """
+    def __init__(self, tz_name=None, microseconds=False):
+        if pytz:
+            self.tzinfo = timezone(tz_name or 'UTC')
+        else:
+            self.tzinfo = None
+        self.microseconds = microseconds
+        self._cache = (None, None)
+
+    def now(self):
+        """
+        Returns a (datetime, date, time, datetime object) tuple for the current time.
+        """
+        current_time = time.time()
+        if self.microseconds:
+            return self._stamp(current_time)
+        second = int(current_time)
+        cached_second, stamp = self._cache
+        if second != cached_second:
+            stamp = self._stamp(second)
+            self._cache = (second, stamp)
+        return stamp
+
+    def _stamp(self, timestamp):
+        if self.tzinfo is None:
+            dt_obj = datetime.utcfromtimestamp(timestamp)
+        else:
+            dt_obj = datetime.fromtimestamp(timestamp, self.tzinfo)
+        return (dt_obj.isoformat(), dt_obj.date().isoformat(), dt_obj.time().isoformat(), dt_obj)
+
+
 def get_datetime(bot):
     """
     Returns a datetime object of the current time.
     """
-    dt_obj = datetime.utcnow()
-    if pytz:
-        dt_obj = dt_obj.replace(tzinfo=timezone('UTC'))
-        if bot.config.chanlogs.localtime:
-            dt_obj = dt_obj.astimezone(timezone(bot.config.clock.tz))
-    if not bot.config.chanlogs.microseconds:
-        dt_obj = dt_obj.replace(microsecond=0)
-    return dt_obj
+    return bot.memory['chanlog_clock'].now()[3]
 
 
 def get_fpath(bot, trigger, channel=None):
@@ -100,35 +167,168 @@ def get_fpath(bot, trigger, channel=None):
 
     dt_obj = get_datetime(bot)
     if bot.config.chanlogs.by_day:
-        fname = "{channel}-{date}.log".format(channel=channel, date=dt_obj.date().isoformat())
+        date = dt_obj.date().isoformat()
+        if date != bot.memory['chanlog_day']:
+            # the files of the previous day will not be written to anymore
+            bot.memory['chanlog_day'] = date
+            bot.memory['chanlog_writer'].rollover()
+            bot.memory['chanlog_recent'].clear()
+        fname = "{channel}-{date}.log".format(channel=channel, date=date)
     else:
         fname = "{channel}.log".format(channel=channel)
     return os.path.join(basedir, fname)
 
 
-def _format_template(tpl, bot, trigger, **kwargs):
-    dt_obj = get_datetime(bot)
+def _field_expression(field_name):
+    """
+    Returns the python expression fetching a template field from the formatter arguments.
+    """
+    first, rest = formatter_field_name_split(field_name)
+    if first == 'trigger':
+        expression = 'trigger'
+    elif first in STAMP_FIELDS:
+        expression = 'stamp[{}]'.format(STAMP_FIELDS[first])
+    elif isinstance(first, str) and first.isidentifier():
+        expression = 'kwargs[{!r}]'.format(first)
+    else:
+        raise ValueError('unsupported template field: {}'.format(field_name))
+    for is_attribute, key in rest:
+        if is_attribute:
+            if not key.isidentifier():
+                raise ValueError('unsupported template field: {}'.format(field_name))
+            expression += '.' + key
+        else:
+            expression += '[{!r}]'.format(key)
+    return expression
+
+
+def compile_template(tpl):
+    """
+    Parses a log line template once and returns a function formatting it.
+    The function is called with the trigger, a LogClock.now() tuple and a dict
+    of the extra fields, and returns the line with its newline.
+    """
+    pieces = []
+    for literal, field_name, format_spec, conversion in Formatter().parse(tpl):
+        if literal:
+            pieces.append(repr(literal))
+        if field_name is None:
+            continue
+        if '{' in format_spec:
+            # nested replacement fields are left to str.format
+            return lambda trigger, stamp, kwargs: tpl.format(
+                trigger=trigger, datetime=stamp[0], date=stamp[1], time=stamp[2], **kwargs
+            ) + "\n"
+        expression = _field_expression(field_name)
+        if conversion:
+            expression = '{}({})'.format(CONVERSIONS[conversion], expression)
+        pieces.append('format({}, {!r})'.format(expression, format_spec))
+    pieces.append(repr("\n"))
+
+    source = "lambda trigger, stamp, kwargs: ''.join(({},))".format(', '.join(pieces))
+    return eval(compile(source, '<chanlogs template>', 'eval'),
+                {'format': format, 'str': str, 'repr': repr, 'ascii': ascii})
+
+
+def compile_templates(config):
+    """
+    Returns a dict of the formatter functions for every kind of line,
+    using the templates from the configuration when they are set.
+    """
+    formatters = dict()
+    for kind, (setting, default_tpl) in TEMPLATES.items():
+        tpl = getattr(config, setting) or default_tpl
+        formatters[kind] = compile_template(tpl)
+    return formatters
+
+
+def _format_line(bot, kind, trigger, **kwargs):
+    """
+    Formats a line of the given kind with the current time.
+    """
+    stamp = bot.memory['chanlog_clock'].now()
+    return bot.memory['chanlog_formatters'][kind](trigger, stamp, kwargs)
 
-    formatted = tpl.format(
-        trigger=trigger, datetime=dt_obj.isoformat(),
-        date=dt_obj.date().isoformat(), time=dt_obj.time().isoformat(),
-        **kwargs
-    ) + "\n"
 
-    return formatted
+def _write_logline(bot, fpath, logline, record=None):
+    """
+    Queues a formatted line to be appended to a log file by the writer thread,
+    and keeps it in memory for the readers of recent lines.
+    The record of the line, if any (a moderation action or a join), goes to the listeners.
+    """
+    data = logline.encode('utf8')
+    bot.memory['chanlog_recent'].append(fpath, logline[:-1], len(data) - 1)
+    bot.memory['chanlog_writer'].write(fpath, data, record)
+
+
+def _get_hostmask(bot, nick):
+    """
+    Returns the hostmask of a nick in the channels of the bot, or None.
+    """
+    hostmask = bot.memory['live_users'].hostmask_of(nick)
+    if hostmask is None:
+        return None
+    return '{}!{}@{}'.format(*hostmask)
+
+
+def _action_record(bot, event):
+    """
+    Returns the action index record of an event, or None if it is not a moderation action.
+    """
+    if event.kind == logparse.KICK:
+        return logparse.action_record(event, _get_hostmask(bot, event.target))
+    return logparse.action_record(event)
+
+
+def _seen(bot, fpath, trigger, nick=None):
+    """
+    Records the nick (the one of the trigger by default) and host of a user in a log file.
+    """
+    bot.memory['chanlog_identities'].seen(fpath, str(nick or trigger.nick), trigger.host)
 
 
 def setup(bot):
     '''Invoked upon module loading.'''
     bot.config.define_section('chanlogs', ChanlogsSection)
 
-    # locks for log files
-    if not bot.memory.contains('chanlog_locks'):
-        bot.memory['chanlog_locks'] = sopel.tools.SopelMemoryWithDefault(threading.Lock)
+    # resolved once, used for every line
+    bot.memory['chanlog_clock'] = LogClock(bot.config.clock.tz if bot.config.chanlogs.localtime
+                                           else None,
+                                           bot.config.chanlogs.microseconds)
+    bot.memory['chanlog_formatters'] = compile_templates(bot.config.chanlogs)
+
+    # open log files and the thread writing to them, shared by all the handlers
+    shutdown(bot)
+    bot.memory['chanlog_files'] = HandlePool(bot.config.chanlogs.max_open_files)
+    bot.memory['chanlog_writer'] = GroupCommitWriter(bot.memory['chanlog_files'],
+                                                     bot.config.chanlogs.flush_interval / 1000,
+                                                     bot.config.chanlogs.flush_bytes)
+    if bot.config.chanlogs.time_index:
+        bot.memory['chanlog_writer'].listeners.append(
+            TimeIndexer(bot.memory['chanlog_files'], bot.config.chanlogs.time_index_lines))
+    bot.memory['chanlog_actions'] = ActionIndex(bot.memory['chanlog_files'])
+    bot.memory['chanlog_writer'].listeners.append(bot.memory['chanlog_actions'])
+    bot.memory['chanlog_identities'] = IdentityTracker(bot.config.chanlogs.identity_max_age * 3600)
+    bot.memory['chanlog_writer'].listeners.append(bot.memory['chanlog_identities'])
+    bot.memory['chanlog_writer'].start()
+    bot.memory['chanlog_day'] = None
+    bot.memory['chanlog_recent'] = RecentLines(bot.config.chanlogs.recent_lines,
+                                               bot.config.chanlogs.recent_max_bytes)
 
     # to keep track of joins parts and quits of users to log QUIT events correctly
     if not bot.memory.contains('channels_of_user'):
         bot.memory['channels_of_user'] = defaultdict(list)
+    # the nicks and hosts of the users in the channels, for the lookups of the other modules
+    if not bot.memory.contains('live_users'):
+        bot.memory['live_users'] = LiveUsers()
+
+
+def shutdown(bot):
+    '''Invoked when the module is unloaded or the bot quits.'''
+    if bot.memory.contains('chanlog_writer'):
+        bot.memory['chanlog_writer'].stop()
+    if bot.memory.contains('chanlog_files'):
+        bot.memory['chanlog_files'].close_all()
 
 
 @sopel.module.rule('.*')
@@ -141,15 +341,14 @@ def log_message(bot, message):
 
     # determine which template we want, message or action
     if message.tags.get('intent') == 'ACTION':
-        tpl = bot.config.chanlogs.action_template or ACTION_TPL
+        kind = 'action'
     else:
-        tpl = bot.config.chanlogs.message_template or MESSAGE_TPL
+        kind = 'message'
 
-    logline = _format_template(tpl, bot, message, message=message)
+    logline = _format_line(bot, kind, message, message=message)
     fpath = get_fpath(bot, message)
-    with bot.memory['chanlog_locks'][fpath]:
-        with open(fpath, "ab") as file_handle:
-            file_handle.write(logline.encode('utf8'))
+    _write_logline(bot, fpath, logline)
+    _seen(bot, fpath, message)
 
     # user channels management
     if message.sender not in bot.memory['channels_of_user'][message.nick]:
@@ -162,17 +361,22 @@ def log_message(bot, message):
 def log_mode(bot, trigger):
     '''Logs a mode change string.'''
     if len(trigger.args) == 3:
-        tpl = bot.config.chanlogs.mode_template or MODE_TPL_3
+        kind = 'mode_3'
     elif len(trigger.args) == 2:
-        tpl = bot.config.chanlogs.mode_template or MODE_TPL_2
+        kind = 'mode_2'
     else:
         return
 
-    logline = _format_template(tpl, bot, trigger)
+    logline = _format_line(bot, kind, trigger)
+    action = None
+    if len(trigger.args) == 3:
+        action = _action_record(bot, logparse.LogEvent(logline, logparse.MODE,
+                                                       nick=trigger.nick,
+                                                       hostmask=trigger.hostmask,
+                                                       target=trigger.args[2],
+                                                       text=trigger.args[1]))
     fpath = get_fpath(bot, trigger, channel=trigger.sender)
-    with bot.memory['chanlog_locks'][fpath]:
-        with open(fpath, "ab") as file_handle:
-            file_handle.write(logline.encode('utf8'))
+    _write_logline(bot, fpath, logline, action)
 
 
 @sopel.module.rule('.*')
@@ -180,15 +384,18 @@ def log_mode(bot, trigger):
 @sopel.module.unblockable
 def log_kick(bot, trigger):
     '''logs a kick line.'''
-    tpl = bot.config.chanlogs.mode_template or KICK_TPL
-    logline = _format_template(tpl, bot, trigger)
+    logline = _format_line(bot, 'kick', trigger)
+    action = _action_record(bot, logparse.LogEvent(logline, logparse.KICK,
+                                                   nick=trigger.nick,
+                                                   hostmask=trigger.hostmask,
+                                                   target=trigger.args[1],
+                                                   text=trigger.args[2]))
     fpath = get_fpath(bot, trigger, channel=trigger.sender)
-    with bot.memory['chanlog_locks'][fpath]:
-        with open(fpath, "ab") as file_handle:
-            file_handle.write(logline.encode('utf8'))
+    _write_logline(bot, fpath, logline, action)
     # user channels management
     if trigger.sender in bot.memory['channels_of_user'][trigger.nick]:
         bot.memory['channels_of_user'][trigger.nick].remove(trigger.sender)
+    _left(bot, trigger.sender, trigger.args[1])
 
 
 @sopel.module.rule('.*')
@@ -196,14 +403,14 @@ def log_kick(bot, trigger):
 @sopel.module.unblockable
 def log_join(bot, trigger):
     '''logs a join line.'''
-    tpl = bot.config.chanlogs.join_template or JOIN_TPL
-    logline = _format_template(tpl, bot, trigger)
+    logline = _format_line(bot, 'join', trigger)
     fpath = get_fpath(bot, trigger, channel=trigger.sender)
-    with bot.memory['chanlog_locks'][fpath]:
-        with open(fpath, "ab") as file_handle:
-            file_handle.write(logline.encode('utf8'))
+    join = {'kind': JOIN_RECORD, 'host': trigger.host, 'time': int(time.time())}
+    _write_logline(bot, fpath, logline, join)
+    _seen(bot, fpath, trigger)
     # user channels management
     bot.memory['channels_of_user'][trigger.nick].append(trigger.sender)
+    bot.memory['live_users'].joined(trigger.sender, trigger.nick, trigger.user, trigger.host)
 
 
 @sopel.module.rule('.*')
@@ -211,15 +418,22 @@ def log_join(bot, trigger):
 @sopel.module.unblockable
 def log_part(bot, trigger):
     '''logs a part line.'''
-    tpl = bot.config.chanlogs.part_template or PART_TPL
-    logline = _format_template(tpl, bot, trigger=trigger)
+    logline = _format_line(bot, 'part', trigger)
+    action = None
+    operator = logparse.removal_operator(trigger)
+    if operator:
+        action = _action_record(bot, logparse.LogEvent(logline, logparse.REMOVED,
+                                                       nick=trigger.nick,
+                                                       hostmask=trigger.hostmask,
+                                                       target=operator,
+                                                       text=trigger))
     fpath = get_fpath(bot, trigger, channel=trigger.sender)
-    with bot.memory['chanlog_locks'][fpath]:
-        with open(fpath, "ab") as file_handle:
-            file_handle.write(logline.encode('utf8'))
+    _write_logline(bot, fpath, logline, action)
+    _seen(bot, fpath, trigger)
     # user channels management
     if trigger.sender in bot.memory['channels_of_user'][trigger.nick]:
         bot.memory['channels_of_user'][trigger.nick].remove(trigger.sender)
+    _left(bot, trigger.sender, trigger.nick)
 
 
 @sopel.module.rule('.*')
@@ -229,19 +443,18 @@ def log_part(bot, trigger):
 @sopel.module.priority('high')
 def log_quit(bot, trigger):
     '''logs a quit line'''
-    tpl = bot.config.chanlogs.quit_template or QUIT_TPL
-    logline = _format_template(tpl, bot, trigger)
+    logline = _format_line(bot, 'quit', trigger)
     # make a copy of bot.privileges that we can safely iterate over
     privcopy = list(bot.privileges.items())
     # write logline to *all* channels that the user was present in
     for channel, _ in privcopy:
         if channel in bot.memory['channels_of_user'][trigger.nick]:
             fpath = get_fpath(bot, trigger, channel)
-            with bot.memory['chanlog_locks'][fpath]:
-                with open(fpath, "ab") as file_handle:
-                    file_handle.write(logline.encode('utf8'))
+            _write_logline(bot, fpath, logline)
+            _seen(bot, fpath, trigger)
     # user channels management
     del bot.memory['channels_of_user'][trigger.nick]
+    bot.memory['live_users'].quit(trigger.nick)
 
 
 @sopel.module.rule('.*')
@@ -249,8 +462,7 @@ def log_quit(bot, trigger):
 @sopel.module.unblockable
 def log_nick_change(bot, trigger):
     '''logs a nick change line.'''
-    tpl = bot.config.chanlogs.nick_template or NICK_TPL
-    logline = _format_template(tpl, bot, trigger)
+    logline = _format_line(bot, 'nick', trigger)
     old_nick = trigger.nick
     new_nick = trigger.sender
     # make a copy of bot.privileges that we can safely iterate over
@@ -259,9 +471,38 @@ def log_nick_change(bot, trigger):
     for channel, privileges in privcopy:
         if old_nick in privileges or new_nick in privileges:
             fpath = get_fpath(bot, trigger, channel)
-            with bot.memory['chanlog_locks'][fpath]:
-                with open(fpath, "ab") as file_handle:
-                    file_handle.write(logline.encode('utf8'))
+            _write_logline(bot, fpath, logline)
+            _seen(bot, fpath, trigger, new_nick)
     # user channels management
     bot.memory['channels_of_user'][new_nick].extend(bot.memory['channels_of_user'][old_nick])
     del bot.memory['channels_of_user'][old_nick]
+    bot.memory['live_users'].renamed(old_nick, new_nick)
+
+
+def _left(bot, channel, nick):
+    """
+    Records that a user left a channel, forgetting all its users if it is the bot.
+    """
+    if nick == bot.nick:
+        bot.memory['live_users'].forget_channel(channel)
+    else:
+        bot.memory['live_users'].left(channel, nick)
+
+
+@sopel.module.rule('.*')
+@sopel.module.event("315")
+@sopel.module.unblockable
+def sync_live_users(bot, trigger):
+    """
+    Records the users of a channel once the server listed them (end of the WHO reply),
+    which includes the ones that were there before the bot joined.
+    """
+    channel = sopel.tools.Identifier(trigger.args[1])
+    if channel not in bot.privileges:
+        return
+    members = []
+    for nick in list(bot.privileges[channel]):
+        user = bot.users.get(nick)
+        if user is not None:
+            members.append((str(user.nick), user.user, user.host))
+    bot.memory['live_users'].synced(channel, members)
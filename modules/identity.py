@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+'''This module keeps track of the nicks and hosts seen in the channel logs,
+and of the ones of the users currently in the channels.
+It does not depend on the bot framework.'''
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+JOIN_RECORD = 'join'
+# the rfc1459 casemapping of the nicks, the default one of IRC servers
+IRC_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\~', 'abcdefghijklmnopqrstuvwxyz{}|^')
+
+
+def irc_lower(nick):
+    '''Returns the lowercase form of a nick, under which it is unique on the network.'''
+    return nick.translate(IRC_LOWER)
+
+
+class IdentityTracker:
+    '''Maps the hosts seen in every log file to their recent nicks, and the nicks to their hosts,
+    with the time they were first and last seen, as well as the offsets of the joins of the hosts.
+    Users that were not seen for max_age seconds are forgotten.
+
+    The nicks and hosts are updated by the channel logger as events are logged.
+    Meant to also be a listener of a GroupCommitWriter, which gives the offsets of the joins
+    from their records: dicts of kind "join" with the time and host of the join.'''
+
+    def __init__(self, max_age=86400, history=8):
+        self.max_age = max_age
+        self.history = history
+        # (log path, host) -> deque of [first seen, last seen, nick], least recently seen first
+        self._hosts = OrderedDict()
+        # (log path, nick) -> deque of [first seen, last seen, host], least recently seen first
+        self._nicks = OrderedDict()
+        # (log path, host) -> deque of (time, offset) of the joins, least recently joined first
+        self._joins = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def _remember(self, entries, key, when, value):
+        '''Records that the value of a key was seen at a time. Lock must be held.'''
+        history = entries.get(key)
+        if history is None:
+            history = entries[key] = deque(maxlen=self.history)
+        else:
+            entries.move_to_end(key)
+        if history and history[-1][2] == value:
+            history[-1][1] = when
+        else:
+            history.append([when, when, value])
+
+    def _evict(self, now):
+        '''Forgets what was not seen for max_age seconds. Lock must be held.'''
+        limit = now - self.max_age
+        for entries, last_seen in ((self._hosts, lambda history: history[-1][1]),
+                                   (self._nicks, lambda history: history[-1][1]),
+                                   (self._joins, lambda history: history[-1][0])):
+            while entries:
+                key, history = next(iter(entries.items()))
+                if last_seen(history) >= limit:
+                    break
+                del entries[key]
+
+    def seen(self, fpath, nick, host, when=None):
+        '''Records that a nick with a host did something in a log file.'''
+        if not nick or not host:
+            return
+        when = int(time.time()) if when is None else when
+        with self._lock:
+            self._remember(self._hosts, (fpath, host), when, nick)
+            self._remember(self._nicks, (fpath, nick), when, host)
+            self._evict(when)
+
+    def __call__(self, fpath, offset, chunks, records):
+        joins = [(index, record) for index, record in records.items()
+                 if record.get('kind') == JOIN_RECORD]
+        if not joins:
+            return
+        offsets = [offset]
+        for chunk in chunks:
+            offsets.append(offsets[-1] + len(chunk))
+        with self._lock:
+            for index, record in joins:
+                key = (fpath, record['host'])
+                history = self._joins.get(key)
+                if history is None:
+                    history = self._joins[key] = deque(maxlen=self.history)
+                else:
+                    self._joins.move_to_end(key)
+                history.append((record['time'], offsets[index]))
+
+    def _value_at(self, entries, key, before):
+        '''Returns the value of a key in use at a time (None for the latest), or None.'''
+        with self._lock:
+            history = entries.get(key)
+            if history is None:
+                return None
+            for first_seen, _, value in reversed(history):
+                if before is None or first_seen <= before:
+                    return value
+        return None
+
+    def nick_of(self, fpath, host, before=None):
+        '''Returns the nick used by a host at a time (None for the latest), or None.'''
+        return self._value_at(self._hosts, (fpath, host), before)
+
+    def host_of(self, fpath, nick, before=None):
+        '''Returns the host used by a nick at a time (None for the latest), or None.'''
+        return self._value_at(self._nicks, (fpath, nick), before)
+
+    def join_of(self, fpath, host, before=None):
+        '''Returns the offset of the last join of a host at or before a time, or None.'''
+        with self._lock:
+            for join_time, offset in reversed(self._joins.get((fpath, host), ())):
+                if before is None or join_time <= before:
+                    return offset
+        return None
+
+
+class LiveUsers:
+    '''Maps the nicks of the users currently in the channels, case-insensitively, to their
+    user and host, and the hosts to their nicks, so that looking a user up is a single lookup.
+    Updated from the joins, parts, kicks, quits and nick changes, and from the list of users
+    of a channel when the bot joins it.'''
+
+    def __init__(self):
+        # lowercase nick -> [nick, user, host, set of lowercase channels]
+        self._users = dict()
+        # host -> set of lowercase nicks
+        self._nicks_by_host = dict()
+        # the hosts having several nicks
+        self._shared_hosts = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._users)
+
+    def _add(self, channel, nick, user, host):
+        '''Records that a user is in a channel. Lock must be held.'''
+        key = irc_lower(nick)
+        entry = self._users.get(key)
+        channels = set()
+        if entry is not None and entry[2] != host:
+            channels = entry[3]
+            self._remove(key)
+            entry = None
+        if entry is None:
+            entry = self._users[key] = [nick, user, host, channels]
+            nicks = self._nicks_by_host.setdefault(host, set())
+            nicks.add(key)
+            if len(nicks) > 1:
+                self._shared_hosts.add(host)
+        entry[0] = nick
+        entry[3].add(irc_lower(channel))
+
+    def _remove(self, key):
+        '''Forgets a user by lowercase nick. Lock must be held.'''
+        entry = self._users.pop(key, None)
+        if entry is None:
+            return
+        nicks = self._nicks_by_host[entry[2]]
+        nicks.discard(key)
+        if len(nicks) < 2:
+            self._shared_hosts.discard(entry[2])
+        if not nicks:
+            del self._nicks_by_host[entry[2]]
+
+    def joined(self, channel, nick, user, host):
+        '''Records that a user joined a channel.'''
+        if not host:
+            return
+        with self._lock:
+            self._add(channel, nick, user, host)
+
+    def left(self, channel, nick):
+        '''Records that a user parted or was kicked from a channel.'''
+        key = irc_lower(nick)
+        with self._lock:
+            entry = self._users.get(key)
+            if entry is None:
+                return
+            entry[3].discard(irc_lower(channel))
+            if not entry[3]:
+                self._remove(key)
+
+    def quit(self, nick):
+        '''Records that a user quit the network.'''
+        with self._lock:
+            self._remove(irc_lower(nick))
+
+    def renamed(self, old_nick, new_nick):
+        '''Records a nick change.'''
+        with self._lock:
+            entry = self._users.get(irc_lower(old_nick))
+            if entry is None:
+                return
+            self._remove(irc_lower(old_nick))
+            for channel in entry[3]:
+                self._add(channel, new_nick, entry[1], entry[2])
+
+    def synced(self, channel, members):
+        '''Records the users of a channel, (nick, user, host), replacing the known ones.'''
+        lowered_channel = irc_lower(channel)
+        with self._lock:
+            for key, entry in list(self._users.items()):
+                if lowered_channel in entry[3]:
+                    entry[3].discard(lowered_channel)
+                    if not entry[3]:
+                        self._remove(key)
+            for nick, user, host in members:
+                if host:
+                    self._add(channel, nick, user, host)
+
+    def forget_channel(self, channel):
+        '''Forgets the users of a channel the bot left.'''
+        self.synced(channel, ())
+
+    def hostmask_of(self, nick):
+        '''Returns the (nick, user, host) of a nick, as the user spells it, or None.'''
+        with self._lock:
+            entry = self._users.get(irc_lower(nick))
+            return None if entry is None else tuple(entry[:3])
+
+    def host_of(self, nick):
+        '''Returns the host of a nick, or None.'''
+        hostmask = self.hostmask_of(nick)
+        return None if hostmask is None else hostmask[2]
+
+    def shared_hosts(self, channels):
+        '''Returns the hosts used by several nicks in some channels: for every host,
+        the nicks and the channels among those where they are, lowercase.'''
+        channels = {irc_lower(channel) for channel in channels}
+        shared = dict()
+        with self._lock:
+            for host in self._shared_hosts:
+                nicks = dict()
+                for key in self._nicks_by_host[host]:
+                    nick, _, _, nick_channels = self._users[key]
+                    if nick_channels & channels:
+                        nicks[nick] = nick_channels & channels
+                if len(nicks) > 1:
+                    shared[host] = nicks
+        return shared
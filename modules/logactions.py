@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+'''This module extracts the information about the moderation actions from the channel logs.
+It does not depend on the bot framework.
+
+Every moderation action of existing logs can be extracted with:
+
+    python modules/logactions.py /path/to/chanlogs > actions.jsonl
+    python modules/logactions.py --format csv /path/to/chanlogs/talk.log > talk.csv
+
+The files are split between processes, big files by byte ranges. Each action is
+completed with the nick or host of its target and the macro used by the mod, as
+,log auto does, from the lines preceding it; an action is only completed with the
+lines of its own file. The actions of a byte range other than the first of its file
+only know the lines of the warmup bytes before the range, so that a target whose
+last line is further back is not completed, unlike with a chunk size bigger than the file.'''
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import re
+import sys
+from collections import deque
+
+# hack for relative import
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logparse
+from logparse import VALID_NICK
+from logindex import MINUTE_PREFIX_LENGTH, parse_timestamp
+from identity import IdentityTracker
+
+# Format them with the appropriate information!
+OPT_DURATION_GROUP = r'(\+\d{1,3}[smhdy])? ?'
+
+# matched against the text of messages
+KICK_MACRO_REGEX = re.compile(r'!ki?c?k? ('+VALID_NICK+r') ?(.*)')
+MUTE_MACRO_REGEX = re.compile(r'!mu?t?e? '+OPT_DURATION_GROUP+r'('+VALID_NICK+r') ?(.*)')
+BAN_MACRO_REGEX = re.compile(r'!k?i?c?k?ba?n? '+OPT_DURATION_GROUP+r'('+VALID_NICK+r') ?(.*)')
+
+APPROPRIATE_BACKTRACK_NUMBER = 8  # The number of lines to analyze before an action
+
+
+def is_banner_bot(nickname):
+    '''Returns true if the bot can ban people'''
+    return nickname in ('Casual_Ban_Bot',
+                        'NSA',
+                        'ChanServ')
+
+
+def mask_host(mask):
+    '''Returns the host part of a ban mask'''
+    return mask.split('@', 1)[-1]
+
+
+def get_action_relevant_info(event):
+    '''Returns a dictionary of useful information from the action event'''
+    relevant_info = dict()
+
+    # permanent bans are downgraded to timed bans during backtrack
+    if event.kind == logparse.MODE and event.target.startswith('m:'):
+        relevant_info['result'] = 'Permanent Mute'
+        relevant_info['host'] = mask_host(event.target[2:])
+        relevant_info['operator'] = event.nick
+    elif event.kind == logparse.MODE:
+        relevant_info['result'] = 'Permanent Ban'
+        relevant_info['host'] = mask_host(event.target)
+        relevant_info['operator'] = event.nick
+    elif event.kind == logparse.KICK:
+        relevant_info['result'] = 'Kick'
+        relevant_info['operator'] = event.nick
+        relevant_info['nick'] = event.target
+        relevant_info['reason'] = event.text
+    elif event.kind == logparse.REMOVED:
+        relevant_info['result'] = 'Kick'  # for logging purposes, interpreted as kick
+        relevant_info['nick'] = event.nick
+        relevant_info['host'] = event.host
+        relevant_info['operator'] = event.target
+
+    return relevant_info
+
+
+def deduce_last_nickname_or_hostmask(log_events, relevant_info):
+    '''Deduces the nickname from the hostmask or vice-versa, from events given most recent first'''
+    if 'host' not in relevant_info:
+        missing_info = 'host'
+        known_info = 'nick'
+    elif 'nick' not in relevant_info:
+        missing_info = 'nick'
+        known_info = 'host'
+    else:
+        # all the info is already available
+        print('deducing failed')
+        return
+
+    # If they speak, we have their hostmask and nick
+    # If they switch their nick, we get their hostmask and nick that way too
+    # If we get their join line, that gives us their nick and hostmask
+    for event in log_events:
+        if event.kind == logparse.NICK:
+            event_nick = event.target
+        elif event.kind in (logparse.MESSAGE, logparse.JOIN):
+            event_nick = event.nick
+        else:
+            continue
+        if missing_info == 'nick' and event.host == relevant_info[known_info]:
+            relevant_info[missing_info] = event_nick
+            break
+        elif missing_info == 'host' and event_nick == relevant_info[known_info]:
+            relevant_info[missing_info] = event.host
+            break
+
+
+def extract_macro_info(log_events, relevant_info):
+    '''Searches for macro information, if available, for example !k, then extracts relevant info.
+    The events are given most recent first.'''
+    if 'nick' not in relevant_info:
+        return  # to detect the correct line
+
+    for event in log_events:
+        if event.kind != logparse.MESSAGE or not event.text.startswith('!'):
+            continue
+        kick_match = KICK_MACRO_REGEX.match(event.text)
+        mute_match = MUTE_MACRO_REGEX.match(event.text)
+        ban_match = BAN_MACRO_REGEX.match(event.text)
+        if (kick_match and
+                kick_match.group(1) == relevant_info['nick']):
+            relevant_info['operator'] = event.nick
+            relevant_info['reason'] = kick_match.group(2)
+            break
+        elif (mute_match and
+              mute_match.group(2) == relevant_info['nick'] and
+              relevant_info['result'] == 'Permanent Mute'):
+            relevant_info['operator'] = event.nick
+            if mute_match.group(1):
+                relevant_info['length'] = format_time(mute_match.group(1))
+                relevant_info['result'] = 'Timed Mute'
+            relevant_info['reason'] = mute_match.group(3)
+            break
+        elif (ban_match and
+              ban_match.group(2) == relevant_info['nick'] and
+              relevant_info['result'] == 'Permanent Ban'):
+            relevant_info['operator'] = event.nick
+            if ban_match.group(1):
+                relevant_info['length'] = format_time(ban_match.group(1))
+                relevant_info['result'] = 'Timed Ban'
+            relevant_info['reason'] = ban_match.group(3)
+            break
+
+
+def format_time(unformatted_time):
+    '''Returns the time in a format fit for the spreadsheet'''
+    time_unformatted = unformatted_time.strip('+')
+    if 's' in time_unformatted:
+        time_unformatted = time_unformatted.replace('y', ' years')
+    elif 'm' in time_unformatted:
+        time_unformatted = time_unformatted.replace('m', ' minutes')
+    elif 'h' in time_unformatted:
+        time_unformatted = time_unformatted.replace('h', ' hours')
+    elif 'd' in time_unformatted:
+        time_unformatted = time_unformatted.replace('d', ' days')
+    elif 'y' in time_unformatted:
+        time_unformatted = time_unformatted.replace('y', ' years')
+    return time_unformatted
+
+
+# the information of an action, like the entries of the form of banlogger, and where it is
+FIELDS = ('time', 'channel', 'result', 'nick', 'host', 'operator', 'length', 'reason',
+          'file', 'offset')
+LOG_NAME_REGEX = re.compile(r'(.*?)(?:-\d{4}-\d{2}-\d{2})?\.log$')
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_WARMUP = 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 3600
+
+
+class ActionExtractor:
+    '''Extracts the moderation actions of the events of a log file, read in order.
+    Only the last events and the nicks and hosts seen in the last max_age seconds are kept.'''
+
+    def __init__(self, channel, max_age=DEFAULT_MAX_AGE):
+        self.channel = channel
+        self.identities = IdentityTracker(max_age, history=1)
+        self.recent_events = deque(maxlen=APPROPRIATE_BACKTRACK_NUMBER)
+        self._minute = (None, None)
+
+    def _epoch(self, line):
+        '''Returns the epoch seconds of a line, close enough for forgetting the users:
+        the timestamps are only parsed once per minute.'''
+        prefix = line[:MINUTE_PREFIX_LENGTH]
+        if prefix != self._minute[0]:
+            epoch = parse_timestamp(line)
+            if epoch is None:
+                # the time of the last line with a timestamp, None before the first one
+                return self._minute[1]
+            self._minute = (prefix, epoch)
+        return self._minute[1]
+
+    def feed(self, event):
+        '''Returns the information about the action of an event, or None if it is not one.'''
+        relevant_info = None
+        if logparse.action_kind(event):
+            relevant_info = self._action_info(event)
+
+        # the same events as the ones used by deduce_last_nickname_or_hostmask
+        if event.kind in (logparse.MESSAGE, logparse.JOIN):
+            event_nick = event.nick
+        elif event.kind == logparse.NICK:
+            event_nick = event.target
+        else:
+            event_nick = None
+        if event_nick and event.host:
+            when = self._epoch(event.line)
+            # without a time, the users would be forgotten as of now
+            if when is not None:
+                self.identities.seen(self.channel, event_nick, event.host, when)
+        self.recent_events.append(event)
+        return relevant_info
+
+    def _action_info(self, event):
+        '''Returns the information about an action, completed with the preceding events.'''
+        relevant_info = get_action_relevant_info(event)
+        if 'nick' not in relevant_info:
+            nick = self.identities.nick_of(self.channel, relevant_info['host'])
+            if nick is not None:
+                relevant_info['nick'] = nick
+        elif 'host' not in relevant_info:
+            host = self.identities.host_of(self.channel, relevant_info['nick'])
+            if host is not None:
+                relevant_info['host'] = host
+        if is_banner_bot(relevant_info['operator']):
+            extract_macro_info(reversed(self.recent_events), relevant_info)
+        relevant_info['time'] = event.timestamp
+        relevant_info['channel'] = self.channel
+        return relevant_info
+
+
+def channel_of(log_path):
+    '''Returns the channel of a log file, from its name.'''
+    match = LOG_NAME_REGEX.match(os.path.basename(log_path))
+    if match is None:
+        raise ValueError('{} is not a chanlogs .log file'.format(log_path))
+    return '#' + match.group(1)
+
+
+def extract_range(log_path, start, end, warmup=DEFAULT_WARMUP, max_age=DEFAULT_MAX_AGE):
+    '''Returns the actions of the lines of a log file starting between two offsets.
+    The lines of the warmup bytes before the start are only read for the context.'''
+    extractor = ActionExtractor(channel_of(log_path), max_age)
+    actions = []
+    with open(log_path, 'rb') as log_file:
+        offset = max(0, start - warmup)
+        if offset > 0:
+            # the lines belong to the range in which they start
+            log_file.seek(offset - 1)
+            offset += len(log_file.readline()) - 1
+        for line in log_file:
+            if offset >= end:
+                break
+            event = logparse.parse_line(line.rstrip(b'\n').decode('utf8', 'replace'))
+            relevant_info = extractor.feed(event)
+            if relevant_info is not None and offset >= start:
+                relevant_info['file'] = log_path
+                relevant_info['offset'] = offset
+                actions.append(relevant_info)
+            offset += len(line)
+    return actions
+
+
+def _extract_task(task):
+    '''Runs extract_range in a worker process.'''
+    return extract_range(*task)
+
+
+def split_tasks(log_paths, chunk_size=DEFAULT_CHUNK_SIZE, warmup=DEFAULT_WARMUP,
+                max_age=DEFAULT_MAX_AGE):
+    '''Returns the arguments of extract_range for every file, or byte range of the big files.'''
+    tasks = []
+    for log_path in log_paths:
+        size = os.path.getsize(log_path)
+        for start in range(0, max(size, 1), chunk_size):
+            tasks.append((log_path, start, min(start + chunk_size, size), warmup, max_age))
+    return tasks
+
+
+def extract_actions(log_paths, jobs=None, chunk_size=DEFAULT_CHUNK_SIZE, warmup=DEFAULT_WARMUP,
+                    max_age=DEFAULT_MAX_AGE):
+    '''Yields the actions of log files in order, extracted by a pool of jobs processes
+    (one per core by default, none if 1).'''
+    tasks = split_tasks(log_paths, chunk_size, warmup, max_age)
+    if jobs == 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield from _extract_task(task)
+        return
+    with multiprocessing.Pool(jobs) as pool:
+        for actions in pool.imap(_extract_task, tasks):
+            yield from actions
+
+
+def find_log_files(paths):
+    '''Returns the log files of a list of files and directories, in which the other files
+    (indexes, rotated logs) are skipped. Raises ValueError for a file that is not a log file.'''
+    log_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            log_paths.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                    if LOG_NAME_REGEX.match(name)))
+        else:
+            channel_of(path)
+            log_paths.append(path)
+    return log_paths
+
+
+def main(argv=None):
+    '''Command line entry point.'''
+    parser = argparse.ArgumentParser(description='Extracts the moderation actions of chanlogs '
+                                                 'files.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('paths', nargs='+',
+                        help='the .log files or the directories containing them')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl',
+                        help='the output format')
+    parser.add_argument('--output', '-o', help='the output file, the standard output if not given')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='the number of processes, one per core if not given')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE // 2**20,
+                        help='the size in MiB of the byte ranges of the big files')
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP // 2**10,
+                        help='the KiB read before a byte range for the context of its actions; '
+                             'the nicks and hosts of the users not seen within them are unknown '
+                             'to the actions of the range')
+    parser.add_argument('--max-age', type=int, default=DEFAULT_MAX_AGE // 3600,
+                        help='the hours after which the nick and host of a user are forgotten')
+    args = parser.parse_args(argv)
+
+    try:
+        log_paths = find_log_files(args.paths)
+    except (OSError, ValueError) as err:
+        parser.error(str(err))
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            writer = csv.DictWriter(output, FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            write = writer.writerow
+        else:
+            write = lambda action: output.write(json.dumps(action) + '\n')
+        for action in extract_actions(log_paths, args.jobs, max(1, args.chunk_size) * 2**20,
+                                      args.warmup * 2**10, args.max_age * 3600):
+            write(action)
+    except OSError as err:
+        print(err, file=sys.stderr)
+        return 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
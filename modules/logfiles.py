@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+'''This module contains the file handling used by the channel logger.
+It does not depend on the bot framework.'''
+
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class HandlePool:
+    '''Keeps a bounded number of append-mode log files open.
+    The least recently used handle is closed when the limit is reached.'''
+
+    def __init__(self, max_open=64):
+        self.max_open = max(1, max_open)
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __contains__(self, fpath):
+        return fpath in self._handles
+
+    def _get(self, fpath):
+        '''Returns the open handle for the path, opening it if needed. Lock must be held.'''
+        handle = self._handles.get(fpath)
+        if handle is not None:
+            self._handles.move_to_end(fpath)
+            return handle
+        while len(self._handles) >= self.max_open:
+            _, oldest = self._handles.popitem(last=False)
+            oldest.close()
+        handle = open(fpath, 'ab')
+        self._handles[fpath] = handle
+        return handle
+
+    def write(self, fpath, data, flush=True):
+        '''Appends bytes to the file, returns the offset at which they were written.'''
+        with self._lock:
+            handle = self._get(fpath)
+            offset = handle.tell()
+            handle.write(data)
+            if flush:
+                handle.flush()
+            return offset
+
+    def flush(self):
+        '''Flushes every open handle.'''
+        with self._lock:
+            for handle in self._handles.values():
+                handle.flush()
+
+    def close(self, fpath):
+        '''Closes the handle of a single file, if it is open.'''
+        with self._lock:
+            handle = self._handles.pop(fpath, None)
+            if handle is not None:
+                handle.close()
+
+    def close_all(self):
+        '''Flushes and closes every open handle.'''
+        with self._lock:
+            while self._handles:
+                _, handle = self._handles.popitem(last=False)
+                handle.close()
+
+
+class RecentLines:
+    '''Keeps the last formatted lines of every log file in memory.
+    Each file keeps at most max_lines lines and roughly max_bytes of text, encoded in utf-8.'''
+
+    def __init__(self, max_lines=4000, max_bytes=2097152):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self._buffers = dict()
+        # log path: [bytes of the lines, deque of the bytes of every line]
+        self._sizes = dict()
+        self._lock = threading.Lock()
+
+    def append(self, fpath, line, size=None):
+        '''Remembers a line (without its newline) written to a file.
+        Its size in bytes is computed if not given.'''
+        if self.max_lines <= 0:
+            return
+        if size is None:
+            size = len(line.encode('utf8'))
+        with self._lock:
+            buffer = self._buffers.get(fpath)
+            if buffer is None:
+                buffer = self._buffers[fpath] = deque()
+                self._sizes[fpath] = [0, deque()]
+            sizes = self._sizes[fpath]
+            buffer.append(line)
+            sizes[1].append(size)
+            sizes[0] += size
+            while len(buffer) > self.max_lines or (sizes[0] > self.max_bytes and len(buffer) > 1):
+                buffer.popleft()
+                sizes[0] -= sizes[1].popleft()
+
+    def tail(self, fpath, lines_number):
+        '''Returns the last lines of a file, or None if fewer lines are in memory.'''
+        with self._lock:
+            buffer = self._buffers.get(fpath)
+            if buffer is None or len(buffer) < lines_number:
+                return None
+            start = len(buffer) - lines_number
+            return [buffer[index] for index in range(start, len(buffer))]
+
+    def clear(self):
+        '''Forgets every line.'''
+        with self._lock:
+            self._buffers.clear()
+            self._sizes.clear()
+
+
+_ROLLOVER = object()
+_STOP = object()
+
+
+class GroupCommitWriter(threading.Thread):
+    '''Appends lines to files from a dedicated thread.
+    Lines are batched per file and written when the flush interval elapses
+    or when enough bytes are pending, whichever comes first.
+    A flush interval of 0 writes and flushes every line as soon as it arrives.
+    Listeners are called from the thread after every write with the path,
+    the offset of the first line, the list of lines and a dict of the records
+    given with some of the lines, by line index. The listeners having a rollover method
+    have it called from the thread once the files were closed by rollover.'''
+
+    def __init__(self, pool, flush_interval=0.2, flush_bytes=65536):
+        super().__init__(name='chanlogs-writer', daemon=True)
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.commits = 0
+        self.listeners = []
+        self._queue = queue.Queue()
+        self._pending = OrderedDict()
+        self._pending_bytes = 0
+
+    def write(self, fpath, data, record=None):
+        '''Queues bytes to be appended to a file, never blocks on the disk.
+        The record, if any, is handed to the listeners with the line.'''
+        self._queue.put((fpath, (data, record)))
+
+    def rollover(self):
+        '''Writes what is pending, then closes every open file, the files written so far
+        not being written to anymore.'''
+        self._queue.put((_ROLLOVER, None))
+
+    def sync(self, timeout=None):
+        '''Blocks until everything queued before the call is on disk.'''
+        done = threading.Event()
+        self._queue.put((done, None))
+        return done.wait(timeout)
+
+    def stop(self, timeout=None):
+        '''Writes what is pending and stops the thread.'''
+        self._queue.put((_STOP, None))
+        self.join(timeout)
+
+    def run(self):
+        deadline = None
+        while True:
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = max(0, deadline - time.monotonic())
+            try:
+                fpath, data = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._commit()
+                deadline = None
+                continue
+
+            if isinstance(fpath, str):
+                data, record = data
+                chunks, records = self._pending.setdefault(fpath, ([], dict()))
+                if record is not None:
+                    records[len(chunks)] = record
+                chunks.append(data)
+                self._pending_bytes += len(data)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if self.flush_interval <= 0 or self._pending_bytes >= self.flush_bytes:
+                    self._commit()
+                    deadline = None
+                continue
+
+            self._commit()
+            deadline = None
+            if fpath is _STOP:
+                break
+            elif fpath is _ROLLOVER:
+                try:
+                    self.pool.close_all()
+                except OSError as err:
+                    print('chanlogs could not close the log files: {}'.format(err))
+                self._rollover_listeners()
+            else:
+                fpath.set()
+
+    def _rollover_listeners(self):
+        '''Tells the listeners that the files written so far are done with.'''
+        for listener in self.listeners:
+            rollover = getattr(listener, 'rollover', None)
+            if rollover is None:
+                continue
+            try:
+                rollover()
+            except Exception as err:
+                print('chanlogs listener rollover failed: {!r}'.format(err))
+
+    def _commit(self):
+        '''Writes every pending batch. Never raises, so that the thread keeps writing.'''
+        try:
+            self._write_pending()
+        except Exception as err:
+            print('chanlogs writer failed: {!r}'.format(err))
+
+    def _write_pending(self):
+        '''Writes every pending batch, one write per file.'''
+        pending = self._pending
+        self._pending = OrderedDict()
+        self._pending_bytes = 0
+        for fpath, (chunks, records) in pending.items():
+            try:
+                offset = self.pool.write(fpath, b''.join(chunks))
+            except OSError as err:
+                print('chanlogs could not write {} lines to {}: {}'.format(len(chunks), fpath, err))
+                continue
+            self.commits += 1
+            for listener in self.listeners:
+                try:
+                    listener(fpath, offset, chunks, records)
+                except Exception as err:
+                    # a listener is never allowed to stop the logging
+                    print('chanlogs listener failed for {}: {!r}'.format(fpath, err))
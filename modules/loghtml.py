@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+'''This module renders the pastes of channel logs to html.
+It does not depend on the bot framework.
+
+The lines written by banlogger.prettify_lines are rendered directly, with the
+markup and stylesheet of the Pygments IRC logs lexer and monokai style, which
+are computed once. Other lines are highlighted by Pygments one at a time, so the
+output is the one of pygments.highlight, except for the lines ending with
+whitespace, which the lexer sometimes merges with the next line.'''
+
+import re
+import pygments
+from pygments.lexers import IrcLogsLexer
+from pygments.formatters import HtmlFormatter
+
+STYLE = 'monokai'
+LINES_PER_WRITE = 256
+
+# "2019-03-01 10:00:00     <nick> text"
+MESSAGE_LINE = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\s+)(<[^>]*>\s*)(?=\S)')
+# "2019-03-01 10:00:00 --> nick (hostmask) has joined #channel", same for <--, --  and ***
+EVENT_LINE = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\s+)((?:\*{3}|<?-[!@=P]?->?)\s*)'
+                        r'(\S+\s+)(?=\S)')
+# a "nick:" prefix starting a message
+PREFIX = re.compile(r'\S+:(?!//)')
+
+_LEXER = IrcLogsLexer()
+_LINE_FORMATTER = HtmlFormatter(nowrap=True)
+_DOCUMENT = None
+
+
+def _document():
+    '''Returns the (header, footer) of the html document, computed once.'''
+    global _DOCUMENT
+    if _DOCUMENT is None:
+        sample = pygments.highlight('sample', _LEXER, HtmlFormatter(full=True, style=STYLE))
+        header, _, footer = sample.partition('sample\n')
+        _DOCUMENT = (header, footer)
+    return _DOCUMENT
+
+
+def escape(text):
+    '''Escapes a piece of text like the Pygments html formatter.'''
+    # much faster than str.translate for short strings
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;') \
+               .replace('"', '&quot;').replace("'", '&#39;')
+
+
+def render_line(line):
+    '''Returns the html of a single line (without newline), with its newline.'''
+    match = MESSAGE_LINE.match(line)
+    if match:
+        # timestamps never need to be escaped
+        html = '<span class="cp">' + match.group(1) + '</span><span class="nt">' + \
+               escape(match.group(2)) + '</span>'
+        text_start = position = match.end()
+        prefix = PREFIX.match(line, position)
+        while prefix:
+            position = prefix.end()
+            prefix = PREFIX.match(line, position)
+        if position > text_start:
+            # consecutive prefixes are a single span
+            html += '<span class="na">' + escape(line[text_start:position]) + '</span>'
+        return html + escape(line[position:]) + '\n'
+
+    match = EVENT_LINE.match(line)
+    # lines starting with "<" and containing ">" are taken for messages by the lexer
+    if match and not (match.group(2).startswith('<') and '>' in line):
+        return '<span class="cp">' + match.group(1) + '</span><span class="k">' + \
+               escape(match.group(2)) + '</span><span class="s">' + escape(match.group(3)) + \
+               '</span><span class="c">' + escape(line[match.end():]) + '</span>\n'
+
+    return pygments.format(_LEXER.get_tokens(line + '\n'), _LINE_FORMATTER)
+
+
+def render_html(text, buffer):
+    '''Writes the full html document of a text to a binary buffer, by batches of lines,
+    like pygments.highlight with the IRC logs lexer and a full monokai html formatter.'''
+    header, footer = _document()
+    buffer.write(header.encode('utf8'))
+
+    # like the lexer, normalize the newlines and ignore the leading and trailing ones
+    if text.startswith('\ufeff'):
+        text = text[1:]
+    text = text.replace('\r\n', '\n').replace('\r', '\n').strip('\n')
+    pieces = []
+    start = 0
+    while start <= len(text):
+        end = text.find('\n', start)
+        if end < 0:
+            end = len(text)
+        pieces.append(render_line(text[start:end]))
+        if len(pieces) >= LINES_PER_WRITE:
+            buffer.write(''.join(pieces).encode('utf8'))
+            pieces.clear()
+        start = end + 1
+    buffer.write(''.join(pieces).encode('utf8'))
+
+    buffer.write(footer.encode('utf8'))
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+'''This module contains the time index kept next to the channel log files.
+It does not depend on the bot framework.
+
+The index of "channel.log" is "channel.log.idx", a sequence of fixed-size
+records (epoch seconds, byte offset) pointing to the first line of every
+minute, and to one line every few hundred lines within busy minutes.
+It can be rebuilt from existing logs with:
+
+    python modules/logindex.py rebuild /path/to/chanlogs/*.log
+
+The moderation actions of "channel.log" are kept in "channel.log.actions",
+one JSON object per line, and are rebuilt by the same command.
+'''
+
+import argparse
+import calendar
+import datetime
+import json
+import os
+import re
+import struct
+import sys
+import threading
+from collections import deque
+
+# hack for relative import
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logparse
+
+INDEX_SUFFIX = '.idx'
+ACTIONS_SUFFIX = '.actions'
+INDEX_RECORD = struct.Struct('<qQ')
+DEFAULT_EVERY_LINES = 500
+# the minute part of the timestamp starting every line, e.g. 2019-01-31T23:59
+MINUTE_PREFIX_LENGTH = 16
+
+TIMESTAMP_REGEX = re.compile(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.\d+)?'
+                             r'(?:([+-])(\d{2}):(\d{2}))?')
+
+
+def index_path(log_path):
+    '''Returns the path of the index of a log file.'''
+    return log_path + INDEX_SUFFIX
+
+
+def parse_timestamp(line):
+    '''Returns the epoch seconds of the timestamp starting a log line, or None.
+    Timestamps without an offset are considered to be in UTC.'''
+    if isinstance(line, bytes):
+        line = line[:40].decode('utf8', 'replace')
+    match = TIMESTAMP_REGEX.match(line)
+    if not match:
+        return None
+    year, month, day, hour, minute, second = (int(i) for i in match.groups()[:6])
+    epoch = calendar.timegm((year, month, day, hour, minute, second))
+    if match.group(7):
+        offset = int(match.group(8)) * 3600 + int(match.group(9)) * 60
+        epoch += -offset if match.group(7) == '+' else offset
+    return epoch
+
+
+def to_epoch(moment):
+    '''Returns the epoch seconds of a datetime (naive ones are UTC) or of a number.'''
+    if isinstance(moment, datetime.datetime):
+        if moment.tzinfo is None:
+            return calendar.timegm(moment.timetuple())
+        return moment.timestamp()
+    return moment
+
+
+class TimeIndexer:
+    '''Appends index records as lines are written to the log files.
+    Meant to be a listener of a GroupCommitWriter.'''
+
+    def __init__(self, pool, every_lines=DEFAULT_EVERY_LINES):
+        self.pool = pool
+        self.every_lines = every_lines
+        # log path: [minute prefix of the last record, lines since the last record]
+        self._state = dict()
+
+    def __call__(self, fpath, offset, chunks, records):
+        state = self._state.setdefault(fpath, [None, 0])
+        records = []
+        for chunk in chunks:
+            prefix = chunk[:MINUTE_PREFIX_LENGTH]
+            if prefix != state[0] or state[1] >= self.every_lines:
+                epoch = parse_timestamp(chunk)
+                if epoch is not None:
+                    records.append(INDEX_RECORD.pack(epoch, offset))
+                    state[0] = prefix
+                    state[1] = 0
+            state[1] += 1
+            offset += len(chunk)
+        if records:
+            self.pool.write(index_path(fpath), b''.join(records))
+
+    def rollover(self):
+        '''Forgets the state of every file, which are not written to anymore.
+        Called by the GroupCommitWriter on rollover.'''
+        self._state.clear()
+
+
+def actions_path(log_path):
+    '''Returns the path of the moderation actions of a log file.'''
+    return log_path + ACTIONS_SUFFIX
+
+
+class ActionIndex:
+    '''Keeps the moderation actions of every log file, with the offset of their line.
+    Meant to be a listener of a GroupCommitWriter, the records given with the lines
+    being dicts of the action (kind, operator, target and hostmask), other records are ignored.
+    The last max_actions actions of a file are kept in memory, all of them on disk.
+    The files written to before a rollover are dropped from memory and loaded again if read.'''
+
+    def __init__(self, pool, max_actions=1000):
+        self.pool = pool
+        self.max_actions = max_actions
+        self._actions = dict()
+        self._lock = threading.Lock()
+
+    def _load(self, fpath):
+        '''Returns the actions of a file, loading them from disk once. Lock must be held.'''
+        actions = self._actions.get(fpath)
+        if actions is None:
+            actions = deque(maxlen=self.max_actions)
+            try:
+                with open(actions_path(fpath), 'rb') as actions_file:
+                    for line in deque(actions_file, maxlen=self.max_actions):
+                        try:
+                            actions.append(json.loads(line.decode('utf8')))
+                        except ValueError:
+                            continue  # partially written line
+            except FileNotFoundError:
+                pass
+            self._actions[fpath] = actions
+        return actions
+
+    def __call__(self, fpath, offset, chunks, records):
+        if not records:
+            return
+        new_actions = []
+        for index, chunk in enumerate(chunks):
+            record = records.get(index)
+            if record is not None and record['kind'] in logparse.ACTION_KINDS:
+                action = dict(record)
+                action['time'] = chunk[:chunk.find(b' ')].decode('utf8')
+                action['offset'] = offset
+                new_actions.append(action)
+            offset += len(chunk)
+        if not new_actions:
+            return
+        with self._lock:
+            self._load(fpath).extend(new_actions)
+            self.pool.write(actions_path(fpath),
+                            b''.join(json.dumps(action).encode('utf8') + b'\n'
+                                     for action in new_actions))
+
+    def rollover(self):
+        '''Drops the actions in memory, their files are not written to anymore.
+        Called by the GroupCommitWriter on rollover.'''
+        with self._lock:
+            self._actions.clear()
+
+    def latest(self, fpath, skip=0):
+        '''Returns the most recent action of a file after skipping some, or None.'''
+        with self._lock:
+            actions = self._load(fpath)
+            if skip >= len(actions):
+                return None
+            return actions[-1-skip]
+
+    def last(self, fpath, number):
+        '''Returns the last actions of a file, most recent first.'''
+        with self._lock:
+            actions = self._load(fpath)
+            return [actions[-1-index] for index in range(min(number, len(actions)))]
+
+
+def build_index(log_path, every_lines=DEFAULT_EVERY_LINES):
+    '''(Re)builds the index of a log file from its content, returns the record number.'''
+    records = 0
+    last_prefix = None
+    lines_since_record = 0
+    offset = 0
+    tmp_path = index_path(log_path) + '.tmp'
+    with open(log_path, 'rb') as log_file, open(tmp_path, 'wb') as index_file:
+        for line in log_file:
+            prefix = line[:MINUTE_PREFIX_LENGTH]
+            if prefix != last_prefix or lines_since_record >= every_lines:
+                epoch = parse_timestamp(line)
+                if epoch is not None:
+                    index_file.write(INDEX_RECORD.pack(epoch, offset))
+                    records += 1
+                    last_prefix = prefix
+                    lines_since_record = 0
+            lines_since_record += 1
+            offset += len(line)
+    os.replace(tmp_path, index_path(log_path))
+    return records
+
+
+def build_actions(log_path):
+    '''(Re)builds the moderation actions of a log file from its content, returns their number.'''
+    actions = 0
+    offset = 0
+    tmp_path = actions_path(log_path) + '.tmp'
+    with open(log_path, 'rb') as log_file, open(tmp_path, 'wb') as actions_file:
+        for line in log_file:
+            # only the lines of the kick, part and mode markers can be actions
+            marker_start = line.find(b' ')
+            if line[marker_start:marker_start+5] in (b' <-- ', b' --  '):
+                event = logparse.parse_line(line.rstrip(b'\n').decode('utf8', 'replace'))
+                action = logparse.action_record(event)
+                if action is not None:
+                    action['time'] = event.timestamp
+                    action['offset'] = offset
+                    actions_file.write(json.dumps(action).encode('utf8') + b'\n')
+                    actions += 1
+            offset += len(line)
+    os.replace(tmp_path, actions_path(log_path))
+    return actions
+
+
+def find_offset(log_path, moment):
+    '''Returns the offset of a line written at or before the moment,
+    from which reading finds every line written after it.'''
+    target = to_epoch(moment)
+    try:
+        index_file = open(index_path(log_path), 'rb')
+    except FileNotFoundError:
+        return 0
+    with index_file:
+        index_file.seek(0, os.SEEK_END)
+        record_number = index_file.tell() // INDEX_RECORD.size
+        # the last record strictly before the moment, lines of the same second may precede it
+        low, high = 0, record_number
+        while low < high:
+            middle = (low + high) // 2
+            index_file.seek(middle * INDEX_RECORD.size)
+            epoch, _ = INDEX_RECORD.unpack(index_file.read(INDEX_RECORD.size))
+            if epoch < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return 0
+        index_file.seek((low - 1) * INDEX_RECORD.size)
+        _, offset = INDEX_RECORD.unpack(index_file.read(INDEX_RECORD.size))
+    if offset > os.path.getsize(log_path):
+        return 0  # the index does not match the file anymore
+    return offset
+
+
+def iter_lines_between(log_path, start, end):
+    '''Yields the lines (without newline) written between two moments, inclusive.
+    Moments are datetimes or epoch seconds.'''
+    start = to_epoch(start)
+    end = to_epoch(end)
+    with open(log_path, 'rb') as log_file:
+        log_file.seek(find_offset(log_path, start))
+        for line in log_file:
+            epoch = parse_timestamp(line)
+            if epoch is None:
+                continue
+            if epoch > end:
+                break
+            if epoch >= start:
+                yield line.rstrip(b'\n').decode('utf8', 'replace')
+
+
+def read_lines_between(log_path, start, end):
+    '''Returns the lines written between two moments, inclusive.'''
+    return list(iter_lines_between(log_path, start, end))
+
+
+def main(argv=None):
+    '''Command line entry point.'''
+    parser = argparse.ArgumentParser(description='Manages the time index of chanlogs files.')
+    subparsers = parser.add_subparsers(dest='command')
+    rebuild_parser = subparsers.add_parser('rebuild',
+                                           help='rebuild the time and action indexes of log files')
+    rebuild_parser.add_argument('files', nargs='+', help='the .log files')
+    rebuild_parser.add_argument('--every-lines', type=int, default=DEFAULT_EVERY_LINES,
+                                help='maximum number of lines between two records')
+    read_parser = subparsers.add_parser('read', help='print the lines between two moments')
+    read_parser.add_argument('file', help='the .log file')
+    read_parser.add_argument('start', help='ISO 8601 timestamp, UTC if no offset is given')
+    read_parser.add_argument('end', help='ISO 8601 timestamp, UTC if no offset is given')
+    args = parser.parse_args(argv)
+
+    if args.command == 'rebuild':
+        for log_path in args.files:
+            try:
+                records = build_index(log_path, args.every_lines)
+                actions = build_actions(log_path)
+            except OSError as err:
+                print('{}: {}'.format(log_path, err), file=sys.stderr)
+                return 1
+            print('{}: {} records, {} actions'.format(log_path, records, actions))
+    elif args.command == 'read':
+        start = parse_timestamp(args.start)
+        end = parse_timestamp(args.end)
+        if start is None or end is None:
+            parser.error('invalid timestamp')
+        for line in iter_lines_between(args.file, start, end):
+            print(line)
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+'''This module parses the lines written by the channel logger.
+It does not depend on the bot framework.
+
+Every line is a timestamp, a fixed-width marker and a rest whose shape
+depends on the marker, so each line is classified and split only once.'''
+
+import re
+
+MESSAGE = 'message'
+JOIN = 'join'
+PART = 'part'
+REMOVED = 'removed'
+KICK = 'kick'
+MODE = 'mode'
+NICK = 'nick'
+QUIT = 'quit'
+OTHER = 'other'
+
+# the kinds of moderation actions
+ACTION_KINDS = ('kick', 'mute', 'ban', 'removed')
+
+MESSAGE_MARKER = '     '
+JOIN_MARKER = ' --> '
+LEAVE_MARKER = ' <-- '
+CHANGE_MARKER = ' --  '
+QUIT_MARKER = ' *** '
+MARKER_LENGTH = 5
+
+REMOVED_PREFIX = 'Removed by '
+VPN_MESSAGE_PART = 'You must register your nickname to use a VPN connection on this channel.'
+
+VALID_NICK = r'[a-zA-Z0-9_\-\\\[\]\{\}\^\`\|]+'
+NICK_REGEX = re.compile(VALID_NICK)
+
+
+class LogEvent:
+    '''A parsed log line.
+
+    nick and hostmask are the ones of the user doing the event; for the other fields:
+    message: text is the message
+    join: target is the channel
+    part and quit: text is the reason
+    removed: nick was removed by the target operator, text is the reason
+    kick: target is the kicked nick, text is the reason
+    mode: text is the mode change (e.g. +b), target is its parameter or None
+    nick: target is the new nick
+
+    Most lines are messages, and most readers only need to know that they are,
+    so the fields of messages are only split the first time they are read.
+    '''
+    __slots__ = ('line', 'kind', 'target', '_marker_start', '_nick', '_hostmask', '_host', '_text')
+
+    def __init__(self, line, kind, marker_start=-1, nick=None, hostmask=None, target=None,
+                 text=None):
+        self.line = line
+        self.kind = kind
+        self.target = target
+        self._marker_start = marker_start
+        self._nick = nick
+        self._hostmask = hostmask
+        self._host = None
+        self._text = text
+
+    def _split_message(self):
+        '''Splits the fields of a message line.'''
+        user = _split_user(self.line[self._marker_start + MARKER_LENGTH:])
+        if user is None:
+            self._nick = self._hostmask = self._text = ''
+        else:
+            self._nick, self._hostmask, self._text = user
+
+    @property
+    def timestamp(self):
+        '''The timestamp starting the line, or None.'''
+        if self._marker_start <= 0:
+            return None
+        return self.line[:self._marker_start]
+
+    @property
+    def header_length(self):
+        '''The length of the timestamp and marker starting the line.'''
+        return self._marker_start + MARKER_LENGTH
+
+    @property
+    def nick(self):
+        '''The nick of the user doing the event, or None.'''
+        if self._nick is None and self.kind == MESSAGE:
+            self._split_message()
+        return self._nick or None
+
+    @property
+    def hostmask(self):
+        '''The hostmask of the user doing the event, or None.'''
+        if self._hostmask is None and self.kind == MESSAGE:
+            self._split_message()
+        return self._hostmask or None
+
+    @property
+    def host(self):
+        '''The host part of the hostmask, or None.'''
+        if self._host is None:
+            hostmask = self.hostmask
+            if hostmask is None or '@' not in hostmask:
+                return None
+            self._host = hostmask[hostmask.index('@') + 1:]
+        return self._host
+
+    @property
+    def text(self):
+        '''The text of the event, see the class documentation.'''
+        if self._text is None and self.kind == MESSAGE:
+            self._split_message()
+        return self._text
+
+    def __repr__(self):
+        return 'LogEvent({!r}, {!r}, nick={!r}, hostmask={!r}, target={!r}, text={!r})'.format(
+            self.kind, self.timestamp, self.nick, self.hostmask, self.target, self.text)
+
+
+def _split_user(rest):
+    '''Splits "nick (hostmask) rest", returns (nick, hostmask, rest) or None.'''
+    nick_end = rest.find(' (')
+    if nick_end <= 0:
+        return None
+    hostmask_end = rest.find(') ', nick_end)
+    if hostmask_end < 0:
+        if not rest.endswith(')'):
+            return None
+        hostmask_end = len(rest) - 1
+    return rest[:nick_end], rest[nick_end + 2:hostmask_end], rest[hostmask_end + 2:]
+
+
+def _strip_parentheses(text):
+    '''Returns the text without its enclosing parentheses.'''
+    if text.startswith('(') and text.endswith(')'):
+        return text[1:-1]
+    return text
+
+
+def removal_operator(reason):
+    '''Returns the operator of a part reason like "Removed by nick", or None.'''
+    if not reason.startswith(REMOVED_PREFIX):
+        return None
+    operator = NICK_REGEX.match(reason, len(REMOVED_PREFIX))
+    return operator and operator.group()
+
+
+def _parse_mode(line, marker_start, rest):
+    '''Parses "Mode #chan (+b mask) by nick (hostmask)".'''
+    by_index = rest.rfind(' by ')
+    open_index = rest.find(' (', 5)
+    if by_index < 0 or open_index < 0 or open_index > by_index:
+        return LogEvent(line, OTHER, marker_start)
+    change = rest[open_index + 2:by_index].rstrip()
+    user = _split_user(rest[by_index + 4:])
+    if not change.endswith(')') or user is None:
+        return LogEvent(line, OTHER, marker_start)
+    change = change[:-1].split(' ', 1)
+    return LogEvent(line, MODE, marker_start, user[0], user[1],
+                    target=change[1] if len(change) > 1 else None, text=change[0])
+
+
+def parse_line(line):
+    '''Returns the LogEvent of a log line.'''
+    marker_start = line.find(' ')
+    if marker_start <= 0:
+        return LogEvent(line, OTHER)
+    marker = line[marker_start:marker_start + MARKER_LENGTH]
+    if marker == MESSAGE_MARKER:
+        return LogEvent(line, MESSAGE, marker_start)
+
+    rest = line[marker_start + MARKER_LENGTH:]
+    if marker == CHANGE_MARKER and rest.startswith('Mode ') and not rest.startswith('Mode ('):
+        return _parse_mode(line, marker_start, rest)
+    user = _split_user(rest)
+    if user is None:
+        return LogEvent(line, OTHER, marker_start)
+    nick, hostmask, rest = user
+
+    if marker == JOIN_MARKER:
+        if rest.startswith('has joined '):
+            return LogEvent(line, JOIN, marker_start, nick, hostmask, target=rest[11:])
+    elif marker == LEAVE_MARKER:
+        if rest.startswith('has kicked '):
+            kicked = rest[11:].split(' ', 1)
+            reason = _strip_parentheses(kicked[1]) if len(kicked) > 1 else ''
+            return LogEvent(line, KICK, marker_start, nick, hostmask, target=kicked[0],
+                            text=reason)
+        if rest.startswith('has left '):
+            reason = _strip_parentheses(rest[9:])
+            operator = removal_operator(reason)
+            if operator:
+                return LogEvent(line, REMOVED, marker_start, nick, hostmask,
+                                target=operator, text=reason)
+            return LogEvent(line, PART, marker_start, nick, hostmask, text=reason)
+    elif marker == CHANGE_MARKER:
+        if rest.startswith('is now known as '):
+            return LogEvent(line, NICK, marker_start, nick, hostmask, target=rest[16:])
+    elif marker == QUIT_MARKER:
+        if rest.startswith('has quit IRC '):
+            return LogEvent(line, QUIT, marker_start, nick, hostmask,
+                            text=_strip_parentheses(rest[13:]))
+    return LogEvent(line, OTHER, marker_start)
+
+
+def parse_lines(lines):
+    '''Yields the LogEvent of every line.'''
+    for line in lines:
+        yield parse_line(line)
+
+
+def action_kind(event):
+    '''Returns the kind of moderation action of an event (ban, mute, kick or removed),
+    or None if it is not one. Actions of the bots that are not done by mods are ignored.'''
+    if event.kind == KICK:
+        if event.nick == 'gonzobot':  # ugh duckhunt
+            return None
+        if event.nick == 'StormBot' and VPN_MESSAGE_PART in event.text:  # vpn timed ban part 1
+            return None
+        return 'kick'
+    if event.kind == MODE:
+        if event.text != '+b' or event.target is None:
+            return None
+        if event.nick == 'StormBot' and 'U:' in event.target:  # vpn timed ban part 2
+            return None
+        if event.nick == 'StormBot' and 'fix-your-connection' in event.target:
+            return None  # connection fix timed ban
+        return 'mute' if event.target.startswith('m:') else 'ban'
+    if event.kind == REMOVED:
+        return 'removed'
+    return None
+
+
+def action_record(event, kicked_hostmask=None):
+    '''Returns the action index record of an event, or None if it is not a moderation action.
+    The record has the kind of action, the operator, the target (nick or mask) and its hostmask,
+    which is only known for kicks if given.'''
+    kind = action_kind(event)
+    if kind is None:
+        return None
+    if kind == 'removed':
+        operator, target, hostmask = event.target, event.nick, event.hostmask
+    elif kind == 'kick':
+        operator, target, hostmask = event.nick, event.target, kicked_hostmask
+    else:
+        operator, target, hostmask = event.nick, event.target, event.target
+    return {'kind': kind, 'operator': operator, 'target': target, 'hostmask': hostmask}
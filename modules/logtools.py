@@ -1,20 +1,22 @@
 #!/usr/bin/env python3
 '''Stuff about making the spreadsheet information a bit more useful'''
 
-import collections
 import shlex
 import argparse
 import sys
 import os
-from copy import copy
+import threading
 from apiclient.discovery import build
-from fuzzywuzzy import fuzz
+from apiclient.errors import HttpError
 from sopel import module
-from sopel.config.types import StaticSection, ListAttribute, ValidatedAttribute
+from sopel.tools import Identifier
+from sopel.config.types import StaticSection, ListAttribute, ValidatedAttribute, FilenameAttribute
 
 # hack for relative import
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from utils import from_admin_channel_only, create_s3_paste
+from utils import from_admin_channel_only, create_configured_paste, run_in_background
+from utils import get_live_users
+from sheetindex import Sheet, save_snapshot, load_snapshot
 
 
 class LogToolsSection(StaticSection):
@@ -22,6 +24,8 @@ class LogToolsSection(StaticSection):
     google_api_key_password = ValidatedAttribute('google_api_key_password')
     admin_channels = ListAttribute('admin_channels')
     acceptable_fuzz_ratio = ValidatedAttribute('acceptable_fuzz_ratio', int, default=75)
+    full_refresh_every = ValidatedAttribute('full_refresh_every', int, default=10)
+    snapshot_path = FilenameAttribute('snapshot_path', default=None)
     spreadsheet_id = ValidatedAttribute('spreadsheet_id')
     relevant_sheets = ListAttribute('relevant_sheets')
     relevant_range = ValidatedAttribute('relevant_range')
@@ -38,11 +42,17 @@ SEARCH_CMD_PARSER = argparse.ArgumentParser(formatter_class=argparse.ArgumentDef
 SEARCH_CMD_PARSER.add_argument('terms',
                                type=str,
                                nargs='+',
-                               help='the nick or piece of mask to search')
+                               help='the nick or piece of mask to search, a piece of mask '
+                                    'with a leading ^ or a trailing $ only matches the start '
+                                    'or end of the masks')
 SEARCH_CMD_PARSER.add_argument('-c', '--convert', action='store_true')
 
-LOGENTRY = None
+SHEET_FIELDS = None
 LINE_REPORT_FORMAT = None
+# the fields with few distinct values, stored once per sheet
+INTERNED_FIELDS = ('result', 'length', 'operator', 'channel')
+# the report lines of the rows by sheet name: the RowStore of the rows and the lines by position
+REPORT_LINES = dict()
 
 def setup(bot):
     '''Invoked when the module is loaded.'''
@@ -55,31 +65,77 @@ def setup(bot):
     for sheet_name in bot.config.logtools.relevant_sheets:
         if sheet_name in bot.memory:
             del bot.memory[sheet_name]
-
-    sheet_fields_with_index = copy(bot.config.logtools.sheet_fields)
-    sheet_fields_with_index.append("index")
-    global LOGENTRY
-    LOGENTRY = collections.namedtuple("LOGENTRY", sheet_fields_with_index)
+    global SHEET_FIELDS
+    SHEET_FIELDS = list(bot.config.logtools.sheet_fields)
     global LINE_REPORT_FORMAT
     LINE_REPORT_FORMAT = bot.config.logtools.line_report_format
+    REPORT_LINES.clear()
 
+    bot.memory['sheet_refresh_number'] = 0
+    load_sheet_snapshot(bot)
 
-ACCEPTABLE_RATIO = 75
 
+NICK_COLUMN = 1
+HOST_COLUMN = 8
 
-def search_for_indexes(bot, search_term):
-    '''Searches the data in the sheets, returns the indexes.'''
-    found_indexes = []
+
+def load_sheet_snapshot(bot):
+    '''Loads the sheets saved by the last refresh, if configured, and refreshes them
+    in the background: until then, the commands use the slightly stale rows of the snapshot
+    rather than waiting for a full download.'''
+    if not bot.config.logtools.snapshot_path:
+        return
+    snapshot = load_snapshot(bot.config.logtools.snapshot_path)
+    loaded = False
+    for sheet_name in bot.config.logtools.relevant_sheets:
+        sheet = snapshot.get(sheet_name)
+        # the rows are read by field name, a snapshot of other fields is stale
+        if sheet is not None and list(sheet.rows.fields) == SHEET_FIELDS:
+            bot.memory[sheet_name] = sheet
+            loaded = True
+    if loaded:
+        threading.Thread(target=refresh_spreadsheet_content, args=(bot,), daemon=True).start()
+
+
+def find_host(bot, nick):
+    '''Returns the host of a nick in the channels, case-insensitively, or None.
+    It is looked up in the live index of chanlogs, then in the users known by sopel, which
+    also knows the users the index missed (before the first WHO sync, after a reload).'''
+    live_users = get_live_users(bot)
+    if live_users is not None:
+        host = live_users.host_of(nick)
+        if host is not None:
+            return host
+    user = bot.users.get(Identifier(nick))
+    return None if user is None else user.host
+
+
+def search_for_rows(bot, search_term):
+    '''Searches the data in the sheets, returns the report lines of the found rows by index
+    for every sheet. The sheets remember their last results until they change.'''
+    found_rows = []
 
     for sheet in bot.config.logtools.relevant_sheets:
-        index_list = []
-        for index, line in enumerate(bot.memory[sheet]):
-            if line and (search_term in line[8] or fuzz.ratio(search_term.lower(),
-                                                              line[1].lower()) >= ACCEPTABLE_RATIO):
-                index_list.append(index)
-        found_indexes.append(index_list)
+        sheet_rows, positions = bot.memory[sheet].search(
+            search_term, bot.config.logtools.acceptable_fuzz_ratio)
+        found_rows.append({position: get_report_line(sheet_rows, position, sheet)
+                           for position in positions})
+
+    return found_rows
 
-    return found_indexes
+
+def get_report_line(sheet_rows, position, sheet_name):
+    '''Returns the report line of a row, formatted once: the rows of a RowStore never change,
+    a sheet whose rows changed gets a new RowStore.'''
+    known_rows, lines = REPORT_LINES.get(sheet_name, (None, None))
+    if known_rows is not sheet_rows:
+        lines = dict()
+        REPORT_LINES[sheet_name] = (sheet_rows, lines)
+    line = lines.get(position)
+    if line is None:
+        line = lines[position] = format_spreadsheet_line(
+            sheet_rows.view(position, position + FIRST_ROW), sheet_name)
+    return line
 
 
 @module.commands('latest')
@@ -89,15 +145,15 @@ def latest(bot, trigger):
     if bot.config.logtools.relevant_sheets[0] not in bot.memory:
         refresh_spreadsheet_content(bot)
 
-    entry_number = len(bot.memory[bot.config.logtools.relevant_sheets[0]])
+    # the rows of a sheet are only appended to, or replaced by new ones during a refresh
+    sheet_rows = bot.memory[bot.config.logtools.relevant_sheets[0]].rows
+    entry_number = len(sheet_rows)
 
     sheet_1_instances = []
 
     for an_index in range(max(entry_number-3-1, 0), entry_number-1):
-        relevant_row = bot.memory[bot.config.logtools.relevant_sheets[0]][an_index]
-        if any(relevant_row):
-            current_entry = create_entry_from_row(relevant_row, an_index)
-            report_str = format_spreadsheet_line(current_entry, '2019')
+        if any(sheet_rows.view(an_index)):
+            report_str = get_report_line(sheet_rows, an_index, '2019')
             sheet_1_instances.append(report_str)
     for an_instance in sheet_1_instances:
         bot.say('\u25A0 ' + an_instance, max_messages=2)
@@ -123,11 +179,8 @@ def search(bot, trigger):
     if args.convert:
         search_terms = []
         for a_nick in args.terms:
-            lowercase_users = dict()
-            for user in bot.users:
-                lowercase_users[user.lower()] = bot.users[user].host
-            if a_nick.lower() in lowercase_users:
-                host_term = lowercase_users[a_nick.lower()]
+            host_term = find_host(bot, a_nick)
+            if host_term is not None:
                 search_terms.append(host_term)
                 bot.say('Converted {} to {}, using it for the search...'.format(a_nick, host_term))
             else:
@@ -141,28 +194,21 @@ def search(bot, trigger):
     if bot.config.logtools.relevant_sheets[0] not in bot.memory:
         refresh_spreadsheet_content(bot)
 
-    indexes_by_sheet = []
+    rows_by_sheet = []
     for _ in bot.config.logtools.relevant_sheets:
-        indexes_by_sheet.append([])
+        rows_by_sheet.append(dict())
 
     for a_term in search_terms:
         if a_term is None:
             continue
-        term_indexes_by_sheet = search_for_indexes(bot, a_term)
-        for index, content in enumerate(term_indexes_by_sheet):
-            indexes_by_sheet[index].extend(content)
-
-    for i, _ in enumerate(indexes_by_sheet):
-        indexes_by_sheet[i] = list(sorted(set(indexes_by_sheet[i])))
+        term_rows_by_sheet = search_for_rows(bot, a_term)
+        for index, content in enumerate(term_rows_by_sheet):
+            rows_by_sheet[index].update(content)
 
     instances_per_sheet = []
     for i, sheet in enumerate(bot.config.logtools.relevant_sheets):
-        sheet_found_indexes = indexes_by_sheet[i]
         curr_sheet_instances = []
-        for match_index in sheet_found_indexes:
-            relevant_row = bot.memory[sheet][match_index]
-            current_entry = create_entry_from_row(relevant_row, match_index)
-            report_str = format_spreadsheet_line(current_entry, sheet)
+        for match_index, report_str in sorted(rows_by_sheet[i].items()):
             curr_sheet_instances.append(report_str)
         instances_per_sheet.append(curr_sheet_instances)
 
@@ -171,9 +217,7 @@ def search(bot, trigger):
         instances.extend(instance_list)
 
     if len(instances) > 3:
-        answer = '\U0001F914 ' + create_s3_paste(bot.config.banlogger.s3_bucket_name,
-                                                 '\n'.join(instances))
-        bot.say(answer, max_messages=3)
+        run_in_background(bot, 'search', paste_instances, bot, instances)
     elif not instances:
         bot.say('None found.')
     else:
@@ -182,15 +226,14 @@ def search(bot, trigger):
             bot.say(answer, max_messages=2)
 
 
-def create_entry_from_row(spreadsheet_row, row_index):
-    '''Creates a namedtuple for a row as an indirection layer.'''
-    elems_number = len(LOGENTRY._fields)-1
-    log_entry = LOGENTRY(*(spreadsheet_row[:elems_number]), index=row_index+2)
-    return log_entry
+def paste_instances(bot, instances):
+    '''Pastes the found instances and says the link. Runs on the worker pool.'''
+    answer = '\U0001F914 ' + create_configured_paste(bot, '\n'.join(instances))
+    bot.say(answer, max_messages=3)
 
 
 def format_spreadsheet_line(entry, sheet_name):
-    '''Returns a formatted spreadsheet line for report.'''
+    '''Returns a formatted spreadsheet line for report, entry being a view of the row.'''
     report_str = '{} on {} ({}) '.format(entry.result, entry.username, entry.host)
     if entry.length:
         report_str += '(duration: {}) '.format(entry.length)
@@ -198,21 +241,69 @@ def format_spreadsheet_line(entry, sheet_name):
     return report_str
 
 
-RELEVANT_RANGE = 'a2:l'
+RELEVANT_RANGE = 'a{}:l'
+FIRST_ROW = 2
+
+REFRESH_LOCK = threading.Lock()
+
+
+def get_sheet_ranges(bot, sheets, full_refresh):
+    '''Returns the value ranges of the rows of the sheets, all of them for a full refresh,
+    the ones after the known rows otherwise, with a single call.'''
+    ranges = []
+    for sheet in sheets:
+        first_row = FIRST_ROW if full_refresh else FIRST_ROW + len(bot.memory[sheet])
+        ranges.append(sheet+'!'+RELEVANT_RANGE.format(first_row))
+
+    values_obj = bot.memory['google_sheets_service'].spreadsheets().values()
+    return values_obj.batchGet(spreadsheetId=bot.config.logtools.spreadsheet_id,
+                               ranges=ranges).execute().get('valueRanges', [])
 
 
 @module.interval(60)
 def refresh_spreadsheet_content(bot):
     '''Periodically refreshes the spreadsheet content.
-    This is done this way to limits calls to the API.'''
-
-    values_obj = bot.memory['google_sheets_service'].spreadsheets().values()
-    spreadsheet_id = bot.config.logtools.spreadsheet_id
+    This is done this way to limits calls to the API: a single call gets the rows added
+    to every sheet, and every full_refresh_every refreshes all the rows are downloaded
+    to catch the edits. The search indexes are updated with the sheets.
+    A failed call counts as a refresh, so that the full refreshes still happen, and a failed
+    incremental call (e.g. for rows past the end of a sheet) is retried as a full refresh.'''
+    sheets = bot.config.logtools.relevant_sheets
+    with REFRESH_LOCK:
+        refresh_number = bot.memory['sheet_refresh_number']
+        full_refresh = (refresh_number % max(1, bot.config.logtools.full_refresh_every) == 0 or
+                        any(sheet not in bot.memory for sheet in sheets))
+        try:
+            try:
+                value_ranges = get_sheet_ranges(bot, sheets, full_refresh)
+            except HttpError as err:
+                if full_refresh:
+                    raise
+                print('could not get the new rows of the sheets, getting all of them: {}'.format(
+                    err))
+                full_refresh = True
+                value_ranges = get_sheet_ranges(bot, sheets, full_refresh)
+        finally:
+            bot.memory['sheet_refresh_number'] = refresh_number + 1
+
+        changed = False
+        for sheet, value_range in zip(sheets, value_ranges):
+            rows = value_range.get('values', [])
+            if sheet not in bot.memory:
+                bot.memory[sheet] = Sheet(rows, NICK_COLUMN, HOST_COLUMN, SHEET_FIELDS,
+                                          INTERNED_FIELDS)
+                changed = True
+            elif full_refresh:
+                changed = bot.memory[sheet].reconcile(rows) or changed
+            else:
+                changed = bot.memory[sheet].extend(rows) or changed
 
-    for sheet in bot.config.logtools.relevant_sheets:
-        curr_range = sheet+'!'+RELEVANT_RANGE
-        bot.memory[sheet] = values_obj.get(spreadsheetId=spreadsheet_id,
-                                           range=curr_range).execute().get('values', [])
+        if changed and bot.config.logtools.snapshot_path:
+            try:
+                save_snapshot(bot.config.logtools.snapshot_path,
+                              {sheet: bot.memory[sheet] for sheet in sheets})
+            except OSError as err:
+                print('could not save the sheet snapshot: {}'.format(err))
 
 
 @module.commands('helpsearch')
@@ -221,7 +312,10 @@ def helpsearch(bot, trigger):
     '''Serves the help documentation.'''
     help_content = SEARCH_CMD_PARSER.format_help()
     help_content = help_content.replace('sopel', ',search')
-    url = create_s3_paste(bot.config.banlogger.s3_bucket_name,
-                          help_content,
-                          wanted_title="searchcommandhelp")
+    run_in_background(bot, 'helpsearch', paste_search_help, bot, help_content)
+
+
+def paste_search_help(bot, help_content):
+    '''Pastes the help documentation and replies with the link. Runs on the worker pool.'''
+    url = create_configured_paste(bot, help_content, wanted_title="searchcommandhelp")
     bot.reply(url)
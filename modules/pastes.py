@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+'''This module contains the places where the pastes are stored.
+It does not depend on the bot framework.
+
+A paste backend stores the text and html versions of a paste under a title,
+and returns the url of the html version.'''
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+TEXT_CONTENT_TYPE = 'text/plain; charset=utf-8'
+HTML_CONTENT_TYPE = 'text/html; charset=utf-8'
+
+
+class FallbackUrl(str):
+    '''The url of a paste stored by the fallback of a backend rather than by the backend itself.'''
+
+
+class S3PasteBackend:
+    '''Stores the pastes in an S3 bucket served as a website.
+    A single client is kept for the life of the backend, the objects are uploaded from memory
+    with their content type, and the text and html versions are uploaded at the same time.
+    If a fallback backend is given, it stores the pastes that could not be uploaded,
+    and their url is a FallbackUrl.'''
+
+    def __init__(self, bucket_name, client=None, fallback=None):
+        self.bucket_name = bucket_name
+        self.location = 's3://' + bucket_name
+        self.fallback = fallback
+        self._client = client
+        self._client_lock = threading.Lock()
+        self._uploader = ThreadPoolExecutor(2)
+
+    @property
+    def client(self):
+        '''The S3 client, created on first use (clients are thread-safe, unlike resources).'''
+        with self._client_lock:
+            if self._client is None:
+                self._client = boto3.client('s3')
+            return self._client
+
+    def _upload(self, key, body, content_type):
+        '''Uploads a single object.'''
+        self.client.put_object(Bucket=self.bucket_name, Key=key, Body=body,
+                               ContentType=content_type)
+
+    def store(self, title, text, html):
+        '''Uploads the text and html (bytes) of a paste, returns the url of the html.'''
+        try:
+            text_upload = self._uploader.submit(self._upload, title + '.txt', text,
+                                                TEXT_CONTENT_TYPE)
+            self._upload(title + '.html', html, HTML_CONTENT_TYPE)
+            text_upload.result()
+        except (BotoCoreError, ClientError) as err:
+            if self.fallback is None:
+                raise
+            print('could not upload the paste {} to S3, storing it locally: {}'.format(title, err))
+            return FallbackUrl(self.fallback.store(title, text, html))
+        return 'http://{}/{}.html'.format(self.bucket_name, title)
+
+
+class LocalPasteBackend:
+    '''Stores the pastes in a directory, served at base_url if given.'''
+
+    def __init__(self, directory, base_url=None):
+        self.directory = directory
+        self.base_url = base_url
+        self.location = os.path.abspath(directory)
+
+    def _write(self, filename, body):
+        '''Writes a file atomically, so that a paste is never served half written.'''
+        file_handle, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.' + filename)
+        with os.fdopen(file_handle, 'wb') as tmp_file:
+            tmp_file.write(body)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, os.path.join(self.directory, filename))
+
+    def store(self, title, text, html):
+        '''Writes the text and html (bytes) of a paste, returns the url of the html.'''
+        os.makedirs(self.directory, exist_ok=True)
+        self._write(title + '.txt', text)
+        self._write(title + '.html', html)
+        if self.base_url:
+            return '{}/{}.html'.format(self.base_url.rstrip('/'), title)
+        return 'file://' + os.path.join(os.path.abspath(self.directory), title + '.html')
+
+
+class PasteCache:
+    '''Remembers the urls of the pastes by a hash of their content, to not upload them twice.
+    The least recently used urls are forgotten beyond max_entries.
+    The cache is kept in a JSON file if a path is given.'''
+
+    def __init__(self, path=None, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None:
+            try:
+                with open(path, 'r', encoding='utf8') as cache_file:
+                    self._urls.update(json.load(cache_file))
+            except FileNotFoundError:
+                pass
+            except ValueError:
+                print('the paste cache was corrupted, using a new one')
+
+    def __len__(self):
+        return len(self._urls)
+
+    @staticmethod
+    def key(location, title, content):
+        '''Returns the cache key of a paste content stored at a location under a title
+        (None for a generated title).'''
+        digest = hashlib.sha256()
+        for part in (location, title or ''):
+            digest.update(part.encode('utf8') + b'\0')
+        digest.update(content.encode('utf8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        '''Returns the url of a paste, or None if it is not known.'''
+        with self._lock:
+            url = self._urls.get(key)
+            if url is not None:
+                self._urls.move_to_end(key)
+            return url
+
+    def put(self, key, url):
+        '''Remembers the url of a paste.'''
+        with self._lock:
+            self._urls[key] = url
+            self._urls.move_to_end(key)
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+            if self.path is not None:
+                try:
+                    self._save()
+                except OSError as err:
+                    print('could not save the paste cache: {}'.format(err))
+
+    def _save(self):
+        '''Writes the cache file atomically, least recently used first. Lock must be held.'''
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as cache_file:
+            json.dump(list(self._urls.items()), cache_file)
+        os.replace(tmp_path, self.path)
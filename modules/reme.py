@@ -2,19 +2,21 @@
 """
 A kit of reme-related code
 """
-import datetime
 import os
-import pickle
 import random
+import sqlite3
 import sys
+import time
 from collections import defaultdict
 import sopel.module
+from sopel.tools import Identifier
 from sopel.config.types import StaticSection, ListAttribute, ValidatedAttribute, FilenameAttribute
 
 # hack for relative import
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from utils import from_admin_channel_only
+from utils import from_admin_channel_only, get_live_users
+from remestore import open_user_store, ExpiryQueue, UserStats, UserTable
 
 PRIV_BIT_MASK = (sopel.module.HALFOP | sopel.module.OP | sopel.module.ADMIN | sopel.module.OWNER)
 
@@ -28,6 +30,7 @@ class RemeSection(StaticSection):
     minimum_line_number = ValidatedAttribute('minimum_line_number', int, default=30)
     sass_list = ListAttribute('sass_list')
     db_path = FilenameAttribute('db_path')
+    store_path = FilenameAttribute('store_path', default=None)
 
 
 def configure(config):
@@ -39,68 +42,104 @@ def configure(config):
 
 
 def setup(bot):
-    '''Invoked when the module is loaded.'''
+    '''Invoked when the module is loaded.
+    The users are kept in a SQLite database (store_path, by default db_path with
+    a .sqlite3 extension), the pickle file of db_path is imported into it once.'''
     bot.config.define_section('reme', RemeSection, validate=True)
+    shutdown(bot)
+    store_path = bot.config.reme.store_path
+    if not store_path:
+        store_path = os.path.splitext(bot.config.reme.db_path)[0] + '.sqlite3'
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    bot.memory['reme_store'], users = open_user_store(store_path)
+    users = users or bot.memory['reme_store'].import_pickle(bot.config.reme.db_path)
+    # the nicks are case-insensitive, like the ones of sopel
+    bot.memory['ops_cmd_users'] = UserTable({Identifier(nick): stats
+                                             for nick, stats in users.items()})
+    bot.memory['reme_expiry'] = ExpiryQueue(
+        bot.config.reme.days_before_forgotten * 86400,
+        {nick: stats.last_seen for nick, stats in bot.memory['ops_cmd_users'].items()})
+
+
+def shutdown(bot):
+    '''Invoked when the module is unloaded or the bot quits.'''
+    if bot.memory.contains('reme_store'):
+        save_to_store(bot)
+        bot.memory['reme_store'].close()
+        del bot.memory['reme_store']
+
+
+# seconds between the writes of the changed users
+FLUSH_INTERVAL = 5
+
+
+@sopel.module.interval(FLUSH_INTERVAL)
+def save_to_store(bot):
+    '''Writes the users changed since the last time to the database, away from the handlers'''
     try:
-        with open(bot.config.reme.db_path, 'rb') as file_handle:
-            bot.memory['ops_cmd_users'] = pickle.load(file_handle)
-    except FileNotFoundError:
-        bot.memory['ops_cmd_users'] = dict()
-    except EOFError:
-        print('the reme file was corrupted, using a new one')
-        bot.memory['ops_cmd_users'] = dict()
+        bot.memory['reme_store'].flush(bot.memory['ops_cmd_users'])
+    except sqlite3.Error as err:
+        print('could not save the reme users: {}'.format(err))
 
 
-@sopel.module.interval(1200)
-def save_to_file(bot):
-    '''Saves the data as backup in a file'''
-    db_path = bot.config.reme.db_path
-    db_dir = os.path.dirname(db_path)
-    if not os.path.exists(db_dir):
-        os.makedirs(db_dir)
+def seen_user(bot, nick, new_lines=0):
+    '''Records that a user is around now, with a number of new lines.'''
+    now = int(time.time())
+    bot.memory['ops_cmd_users'].seen(nick, now, new_lines)
+    bot.memory['reme_expiry'].seen(nick, now)
+    bot.memory['reme_store'].changed(nick)
 
-    with open(db_path, 'wb') as file_handle:
-        pickle.dump(bot.memory['ops_cmd_users'], file_handle)
+
+def is_in_allowed_channels(bot, nick):
+    '''Returns True if a user is in one of the allowed channels.'''
+    return any(nick in bot.privileges[channel] for channel in list(bot.privileges)
+               if channel in bot.config.reme.allowed_channels)
 
 
 @sopel.module.interval(30)
 def manage_mini_users_dict(bot):
-    '''Manages the users dict for this module only'''
-
-    # keep track of current users
-    users_to_add = dict()
-    for channel in bot.privileges.keys():
-        if channel in bot.config.reme.allowed_channels:
-            for user in bot.privileges[channel]:
-                if user not in bot.memory['ops_cmd_users']:
-                    # first seen, last seen, line number
-                    users_to_add[user] = [datetime.datetime.now(),
-                                          datetime.datetime.now(), 0]
-                else:
-                    bot.memory['ops_cmd_users'][user][1] = datetime.datetime.now()
-    bot.memory['ops_cmd_users'].update(users_to_add)
-
-    # purge users if they were not in the channel for two weeks
-    users_to_delete = []
-    for user in bot.memory['ops_cmd_users']:
-        first_seen = bot.memory['ops_cmd_users'][user][0]
-        last_seen = bot.memory['ops_cmd_users'][user][1]
-        if (last_seen-first_seen).days > bot.config.reme.days_before_forgotten:
-            users_to_delete.append(user)
-
-    for user in users_to_delete:
-        del bot.memory['ops_cmd_users'][user]
+    '''Manages the users dict for this module only: forgets the users that were not seen
+    for days_before_forgotten days, only reading the ones whose time came.
+    The ones still in the allowed channels, silent since, are kept, as well as the ones seen
+    since their time came, which are tracked again.'''
+    now = time.time()
+    unseen_since = now - bot.config.reme.days_before_forgotten * 86400
+    for user in bot.memory['reme_expiry'].expired(now):
+        if is_in_allowed_channels(bot, user):
+            seen_user(bot, user)
+        elif bot.memory['ops_cmd_users'].pop(user, None, unseen_since) is not None:
+            bot.memory['reme_store'].changed(user)
+
+
+@sopel.module.rule('.*')
+@sopel.module.event('JOIN', 'PART', 'QUIT')
+@sopel.module.unblockable
+def track_presence(bot, trigger):
+    '''Records the users joining or leaving the allowed channels, and the known users quitting,
+    as seen now.'''
+    if trigger.event == 'QUIT':
+        if trigger.nick in bot.memory['ops_cmd_users']:
+            seen_user(bot, trigger.nick)
+    elif trigger.sender in bot.config.reme.allowed_channels:
+        seen_user(bot, trigger.nick)
+
+
+@sopel.module.rule('.*')
+@sopel.module.event('315')
+@sopel.module.unblockable
+def track_present_users(bot, trigger):
+    '''Records the users of an allowed channel once the server listed them (end of the WHO
+    reply), which includes the ones that were there before the bot joined.'''
+    channel = Identifier(trigger.args[1])
+    if channel in bot.config.reme.allowed_channels and channel in bot.privileges:
+        for user in list(bot.privileges[channel]):
+            seen_user(bot, user)
 
 
 @sopel.module.rule('.*')
 def increment_msg_counter(bot, message):
     '''When a user message happens, increments the counter.'''
-    if message.nick in bot.memory['ops_cmd_users']:
-        bot.memory['ops_cmd_users'][message.nick][2] += 1
-    else:
-        # The 1 is for the current message
-        bot.memory['ops_cmd_users'][message.nick] = [datetime.datetime.now(),
-                                                     datetime.datetime.now(), 1]
+    seen_user(bot, message.nick, 1)
 
 
 @sopel.module.rule(r"\?ops(?:\s.*|$)")
@@ -109,14 +148,14 @@ def smart_ops(bot, message):
     if message.sender in bot.config.reme.allowed_channels:
         users = bot.privileges[message.sender]
 
-        if message.nick in bot.memory['ops_cmd_users']:
-            asker_info = bot.memory['ops_cmd_users'][message.nick]
-        else:
-            asker_info = [datetime.datetime.now(), datetime.datetime.now(), 1]
+        now = int(time.time())
+        asker_info = bot.memory['ops_cmd_users'].get(message.nick)
+        if asker_info is None:
+            asker_info = UserStats(now, now, 1)
 
-        minimum_time_delta = datetime.timedelta(0, bot.config.reme.minimum_time_seconds)
-        is_old_enough = (asker_info[1]-asker_info[0]) > minimum_time_delta
-        has_enough_lines = asker_info[2] > bot.config.reme.minimum_line_number
+        # the last seen time is only updated by events, the asker is around now
+        is_old_enough = (now-asker_info.first_seen) > bot.config.reme.minimum_time_seconds
+        has_enough_lines = asker_info.lines > bot.config.reme.minimum_line_number
         is_privileged = users[message.nick] & PRIV_BIT_MASK
         if (is_old_enough and has_enough_lines) or is_privileged:
             # get relevant users to alert
@@ -135,19 +174,33 @@ def smart_ops(bot, message):
 def multipleusers(bot, trigger):
     '''Finds users that are joined multiple times'''
     nicks_by_host = defaultdict(set)
+    for user_host, channels_by_nick in get_shared_hosts(bot).items():
+        if 'snoonet/' in user_host.lower():  # avoid the network administrators
+            continue
+        for user_nick, channels in channels_by_nick.items():
+            # avoid the administrator peeps, in the channels where they are
+            is_privileged = all(bot.privileges[a_channel].get(Identifier(user_nick), 0)
+                                & PRIV_BIT_MASK for a_channel in channels)
+            if not is_privileged:
+                nicks_by_host[user_host].add(user_nick)
+    multiple_users = {k: v for k, v in nicks_by_host.items() if len(v) > 1}
+    bot.say(str(multiple_users)+'.', max_messages=3)
+
+
+def get_shared_hosts(bot):
+    '''Returns the hosts of several nicks in the allowed channels, with the channels of every
+    nick, from the live index of chanlogs, or else from the users of the channels.'''
+    live_users = get_live_users(bot)
+    if live_users is not None:
+        return live_users.shared_hosts(bot.config.reme.allowed_channels)
+    channels_by_nick_by_host = defaultdict(lambda: defaultdict(set))
     for a_channel in bot.config.reme.allowed_channels:
         for user_nick in bot.privileges[a_channel]:
             user_obj = bot.users[user_nick]
-            if user_obj.host is None:
-                continue
-            user_host = user_obj.host
-            is_privileged = bot.privileges[a_channel][user_nick] & PRIV_BIT_MASK
-            is_network_admin = 'snoonet/' in user_host.lower()
-            if is_network_admin or is_privileged:  # avoid the administrator peeps
-                continue
-            nicks_by_host[user_host].add(user_nick)
-    multiple_users = {k: v for k, v in nicks_by_host.items() if len(v) > 1}
-    bot.say(str(multiple_users)+'.', max_messages=3)
+            if user_obj.host is not None:
+                channels_by_nick_by_host[user_obj.host][user_nick].add(a_channel)
+    return {user_host: channels_by_nick for user_host, channels_by_nick
+            in channels_by_nick_by_host.items() if len(channels_by_nick) > 1}
 
 
 @sopel.module.commands('idlist')
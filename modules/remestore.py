@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+'''This module keeps the users of reme in a SQLite database, and tells when they expire.
+It does not depend on the bot framework.
+
+The database is in WAL mode: every flush is one transaction, which either happens entirely
+or not at all, so that a crash never loses more than the changes since the last flush.'''
+
+import heapq
+import os
+import pickle
+import sqlite3
+import threading
+from array import array
+
+
+class UserStats:
+    '''What reme knows about a user: the times it was first and last seen, in epoch seconds,
+    and its number of lines.'''
+    __slots__ = ('first_seen', 'last_seen', 'lines')
+
+    def __init__(self, first_seen, last_seen, lines=0):
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.lines = lines
+
+    def __eq__(self, other):
+        return isinstance(other, UserStats) and \
+            (self.first_seen, self.last_seen, self.lines) == \
+            (other.first_seen, other.last_seen, other.lines)
+
+    def __repr__(self):
+        return 'UserStats({}, {}, {})'.format(self.first_seen, self.last_seen, self.lines)
+
+
+class UserTable:
+    '''The UserStats of the users by nick, kept in columns: every nick maps to a slot
+    of arrays of epoch seconds and numbers of lines rather than to objects of its own.
+    The slots of the removed users are reused.'''
+
+    def __init__(self, users=None):
+        # nick -> slot
+        self._slots = dict()
+        self._first_seen = array('I')
+        self._last_seen = array('I')
+        self._lines = array('I')
+        self._free_slots = []
+        self._lock = threading.Lock()
+        for nick, stats in (users or {}).items():
+            self.put(nick, stats)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, nick):
+        return nick in self._slots
+
+    def __iter__(self):
+        return iter(list(self._slots))
+
+    def get(self, nick):
+        '''Returns a copy of the UserStats of a nick, or None.'''
+        with self._lock:
+            slot = self._slots.get(nick)
+            if slot is None:
+                return None
+            return UserStats(self._first_seen[slot], self._last_seen[slot], self._lines[slot])
+
+    def items(self):
+        '''Returns the (nick, UserStats) of the users.'''
+        return [(nick, self.get(nick)) for nick in self]
+
+    def put(self, nick, stats):
+        '''Sets the UserStats of a nick.'''
+        with self._lock:
+            slot = self._slots.get(nick)
+            if slot is None:
+                slot = self._slots[nick] = self._new_slot()
+            self._first_seen[slot] = stats.first_seen
+            self._last_seen[slot] = stats.last_seen
+            self._lines[slot] = stats.lines
+
+    def _new_slot(self):
+        '''Returns a free slot. Lock must be held.'''
+        if self._free_slots:
+            return self._free_slots.pop()
+        for column in (self._first_seen, self._last_seen, self._lines):
+            column.append(0)
+        return len(self._lines) - 1
+
+    def seen(self, nick, when, new_lines=0):
+        '''Records that a nick was seen at a time, with a number of new lines.'''
+        with self._lock:
+            slot = self._slots.get(nick)
+            if slot is None:
+                slot = self._slots[nick] = self._new_slot()
+                self._first_seen[slot] = when
+                self._lines[slot] = 0
+            self._last_seen[slot] = when
+            self._lines[slot] += new_lines
+
+    def pop(self, nick, default=None, unseen_since=None):
+        '''Removes a nick, returns its UserStats, or the default if it was unknown.
+        If unseen_since is given, the nick is only removed if it was not seen after that time.'''
+        with self._lock:
+            slot = self._slots.get(nick)
+            if slot is None or (unseen_since is not None and
+                                self._last_seen[slot] > unseen_since):
+                return default
+            del self._slots[nick]
+            self._free_slots.append(slot)
+            return UserStats(self._first_seen[slot], self._last_seen[slot], self._lines[slot])
+
+
+class UserStore:
+    '''Stores the users of reme: nick -> UserStats.
+    The users live in a UserTable (or a dict), the nicks whose entry changed are marked
+    and written by flush, away from the message handlers. The users without an entry anymore
+    are deleted.'''
+
+    def __init__(self, path):
+        self.path = path
+        self._changed = set()
+        self._changed_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS users (nick TEXT PRIMARY KEY, '
+                                     'first_seen INTEGER, last_seen INTEGER, lines INTEGER)')
+
+    def load(self):
+        '''Returns the stored users.'''
+        with self._lock:
+            rows = self._connection.execute('SELECT nick, first_seen, last_seen, lines '
+                                            'FROM users').fetchall()
+        # the times were stored as floats by the previous versions
+        return {nick: UserStats(int(first_seen), int(last_seen), lines)
+                for nick, first_seen, last_seen, lines in rows}
+
+    def changed(self, nick):
+        '''Marks the entry of a nick as changed, or removed.'''
+        with self._changed_lock:
+            self._changed.add(nick)
+
+    def flush(self, users):
+        '''Writes the entries of the changed nicks from the users, in one transaction.
+        Returns the number of written entries.'''
+        with self._changed_lock:
+            nicks, self._changed = self._changed, set()
+        if not nicks:
+            return 0
+        updated = []
+        removed = []
+        for nick in nicks:
+            entry = users.get(nick)
+            if entry is None:
+                removed.append((str(nick),))
+            else:
+                updated.append((str(nick), entry.first_seen, entry.last_seen, entry.lines))
+        try:
+            with self._lock, self._connection:
+                self._connection.executemany('INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)',
+                                             updated)
+                self._connection.executemany('DELETE FROM users WHERE nick = ?', removed)
+        except sqlite3.Error:
+            # written at the next flush
+            with self._changed_lock:
+                self._changed.update(nicks)
+            raise
+        return len(nicks)
+
+    def import_pickle(self, pickle_path):
+        '''Imports the users of the pickle file of the previous versions, if any, then renames it
+        so that it is only imported once. Returns the imported users.
+        The file maps the nicks to [first seen, last seen, number of lines], with datetimes.'''
+        try:
+            with open(pickle_path, 'rb') as file_handle:
+                users = {nick: UserStats(int(first_seen.timestamp()), int(last_seen.timestamp()),
+                                         lines)
+                         for nick, (first_seen, last_seen, lines)
+                         in pickle.load(file_handle).items()}
+        except FileNotFoundError:
+            return dict()
+        except (EOFError, pickle.UnpicklingError) as err:
+            print('the reme file {} was corrupted, not importing it: {}'.format(pickle_path, err))
+            return dict()
+        for nick in users:
+            self.changed(nick)
+        self.flush(users)
+        os.replace(pickle_path, pickle_path + '.imported')
+        return users
+
+    def close(self):
+        '''Closes the database.'''
+        with self._lock:
+            self._connection.close()
+
+
+class ExpiryQueue:
+    '''Tells which keys expired: the ones not seen for lifetime seconds.
+    The keys are in a heap by expiry time, once each: seeing a key again only records when,
+    the key is put back in the heap when its former expiry time comes. Finding the expired
+    keys only reads the ones whose expiry time came.'''
+
+    def __init__(self, lifetime, last_seen=None):
+        self.lifetime = lifetime
+        # key -> [last seen, expiry time of its entry in the heap]
+        self._keys = {key: [when, when + lifetime] for key, when in (last_seen or {}).items()}
+        # (expiry time, key), the ones of keys forgotten or put back in since then are left out
+        self._heap = [(expiry, key) for key, (_, expiry) in self._keys.items()]
+        heapq.heapify(self._heap)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def seen(self, key, when):
+        '''Records that a key was seen at a time, in seconds.'''
+        with self._lock:
+            times = self._keys.get(key)
+            if times is None:
+                self._keys[key] = [when, when + self.lifetime]
+                heapq.heappush(self._heap, (when + self.lifetime, key))
+            elif times[0] < when:
+                times[0] = when
+
+    def forget(self, key):
+        '''Stops tracking a key.'''
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def expired(self, now):
+        '''Returns the keys not seen for lifetime seconds at a time, which are then forgotten.'''
+        expired = []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                expiry, key = heapq.heappop(heap)
+                times = self._keys.get(key)
+                if times is None or times[1] != expiry:
+                    continue
+                if times[0] + self.lifetime > now:
+                    times[1] = times[0] + self.lifetime
+                    heapq.heappush(heap, (times[1], key))
+                else:
+                    del self._keys[key]
+                    expired.append(key)
+        return expired
+
+
+def open_user_store(path):
+    '''Returns the UserStore of a database and the stored users. A database that cannot be read
+    is moved aside with its WAL files (with a .corrupt extension) for a manual recovery
+    rather than overwritten.'''
+    store = None
+    try:
+        store = UserStore(path)
+        return store, store.load()
+    except sqlite3.DatabaseError as err:
+        if store is not None:
+            store.close()
+        print('the reme database {} could not be read, moving it aside: {}'.format(path, err))
+        os.replace(path, path + '.corrupt')
+        # the WAL of the corrupt database would be used with the new one
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.replace(path + suffix, path + suffix + '.corrupt')
+        return UserStore(path), dict()
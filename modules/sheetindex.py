@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+'''This module indexes the rows of the spreadsheets for the searches of logtools.
+It does not depend on the bot framework.
+
+The postings of the indexes are arrays of rows, and the indexed values are packed
+like the rows, so that the sheets and their indexes can be saved in a snapshot
+that loads in a few milliseconds.'''
+
+import os
+import pickle
+import sys
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from fuzzywuzzy import fuzz
+
+# hack for relative import
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sheetstore import PackedColumn, RowStore
+
+SNAPSHOT_VERSION = 2
+# the number of searches whose results a sheet remembers until it changes
+SEARCH_CACHE_SIZE = 256
+
+
+# marks both ends of the texts, so that their first and last characters are in two bigrams
+PADDING = '\0'
+# mark the start and the end of the hosts, so that the searches can be anchored to them
+HOST_START = '\x02'
+HOST_END = '\x03'
+# a term starting with ^ or ending with $ only matches the start or the end of the hosts
+START_ANCHOR = '^'
+END_ANCHOR = '$'
+
+
+def padded_bigrams(text):
+    '''Returns the bigrams of a padded text, numbered from their second occurrence on (e.g. "ab1"),
+    so that the bigrams shared by two texts are the ones shared by their lists.'''
+    text = PADDING + text + PADDING
+    bigrams = [text[position:position + 2] for position in range(len(text) - 1)]
+    if len(set(bigrams)) == len(bigrams):
+        return bigrams
+    occurrences = Counter()
+    numbered = []
+    for bigram in bigrams:
+        numbered.append(bigram + str(occurrences[bigram]) if occurrences[bigram] else bigram)
+        occurrences[bigram] += 1
+    return numbered
+
+
+def required_bigrams(term_length, length, ratio):
+    '''Returns the number of padded bigrams that a text must share with a term for their fuzz.ratio
+    to reach a ratio, or None if the text cannot reach it because of its length.'''
+    total = term_length + length
+    # fuzz.ratio rounds 100 * 2 * M / total, M being at most the longest common subsequence
+    common = -(-total * (2 * ratio - 1) // 400)
+    if min(term_length, length) < common:
+        return None
+    # every character outside of the common subsequence breaks at most two bigrams of a text,
+    # and every character inserted between two of its characters at most one
+    return max(term_length + 1 - 2 * (term_length - common) - (length - common),
+               length + 1 - 2 * (length - common) - (term_length - common))
+
+
+class NickIndex:
+    '''Finds the rows whose nick is close to a term according to fuzz.ratio, lowercased.
+    The nicks are lowercased once and indexed by length and by bigram: a nick can only reach
+    the ratio if its length is close enough to the one of the term and if it shares enough
+    bigrams with the term, so only those candidates are compared.'''
+
+    def __init__(self, nicks=()):
+        self.nicks = PackedColumn()
+        self._nick_lengths = array('H')
+        self._lengths = dict()
+        self._bigrams = dict()
+        for nick in nicks:
+            self.append(nick)
+
+    def __len__(self):
+        return len(self.nicks)
+
+    def append(self, nick):
+        '''Indexes the nick of the next row, None or empty if it has none.'''
+        row = len(self.nicks)
+        nick = nick.lower() if nick else ''
+        self.nicks.append(nick)
+        self._nick_lengths.append(len(nick))
+        if nick:
+            for postings, keys in ((self._lengths, (len(nick),)),
+                                   (self._bigrams, padded_bigrams(nick))):
+                for key in keys:
+                    try:
+                        postings[key].append(row)
+                    except KeyError:
+                        postings[key] = array('I', [row])
+
+    def search(self, term, ratio):
+        '''Returns the rows whose nick has a fuzz.ratio of at least ratio (1 to 100) with a term,
+        in order.'''
+        term = term.lower()
+        if not term:
+            return []
+        candidates = []
+        required = dict()
+        for length, rows in self._lengths.items():
+            length_required = required_bigrams(len(term), length, ratio)
+            if length_required is None:
+                continue
+            if length_required <= 0:
+                candidates.extend(rows)
+            else:
+                required[length] = length_required
+        if required:
+            shared = Counter()
+            for bigram in padded_bigrams(term):
+                shared.update(self._bigrams.get(bigram, ()))
+            # a nick never shares more than len(term) + 1 bigrams: the other lengths are left out
+            candidates.extend(row for row, count in shared.items()
+                              if count >= required.get(self._nick_lengths[row], len(term) + 2))
+        return sorted(row for row in candidates if fuzz.ratio(term, self.nicks[row]) >= ratio)
+
+
+def trigrams(text):
+    '''Returns the distinct trigrams of a text.'''
+    return {text[position:position + 3] for position in range(len(text) - 2)}
+
+
+class HostIndex:
+    '''Finds the rows whose host contains a fragment, or starts or ends with it.
+    The hosts are indexed by trigram, with their start and end marked: only the rows having
+    every trigram of a fragment can contain it, the shortest postings narrow them down first.'''
+
+    def __init__(self, hosts=()):
+        self.hosts = PackedColumn()
+        self._trigrams = dict()
+        for host in hosts:
+            self.append(host)
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def append(self, host):
+        '''Indexes the host of the next row, None or empty if it has none.'''
+        row = len(self.hosts)
+        self.hosts.append(host or '')
+        if host:
+            postings = self._trigrams
+            for trigram in trigrams(HOST_START + host + HOST_END):
+                try:
+                    postings[trigram].append(row)
+                except KeyError:
+                    postings[trigram] = array('I', [row])
+
+    def search(self, fragment, at_start=False, at_end=False):
+        '''Returns the rows whose host contains a fragment, in order.
+        With at_start or at_end, the host must start or end with the fragment.'''
+        marked = (HOST_START if at_start else '') + fragment + (HOST_END if at_end else '')
+        fragment_trigrams = trigrams(marked)
+        if not fragment_trigrams:
+            candidates = range(len(self.hosts))
+        else:
+            postings = sorted((self._trigrams.get(trigram, ()) for trigram in fragment_trigrams),
+                              key=len)
+            candidates = set(postings[0])
+            for rows in postings[1:]:
+                # checking a few candidates is cheaper than reading long postings
+                if len(candidates) * 8 < len(rows):
+                    break
+                candidates.intersection_update(rows)
+        if at_start and at_end:
+            matches = fragment.__eq__
+        elif at_start:
+            matches = lambda host: host.startswith(fragment)
+        elif at_end:
+            matches = lambda host: host.endswith(fragment)
+        else:
+            matches = lambda host: fragment in host
+        if len(candidates) * 8 > len(self.hosts):
+            # reading the packed hosts in order is cheaper than reading that many of them
+            return [row for row, host in enumerate(self.hosts) if host and matches(host)]
+        hosts = self.hosts
+        return sorted(row for row in candidates if hosts[row] and matches(hosts[row]))
+
+
+class SheetIndex:
+    '''Indexes the nicks and hosts of the rows of a sheet for the searches of logtools.'''
+
+    def __init__(self, rows=(), nick_column=1, host_column=8):
+        self.nick_column = nick_column
+        self.host_column = host_column
+        self.nicks = NickIndex()
+        self.hosts = HostIndex()
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return len(self.nicks)
+
+    def append(self, row):
+        '''Indexes the next row.'''
+        self.nicks.append(row[self.nick_column] if len(row) > self.nick_column else None)
+        self.hosts.append(row[self.host_column] if len(row) > self.host_column else None)
+
+    def search(self, term, ratio):
+        '''Returns the rows whose nick has a fuzz.ratio of at least ratio with a term
+        or whose host contains it, in order. A term with a leading ^ or a trailing $
+        only searches the hosts starting or ending with it.'''
+        fragment = term
+        at_start = len(fragment) > 1 and fragment.startswith(START_ANCHOR)
+        if at_start:
+            fragment = fragment[1:]
+        at_end = len(fragment) > 1 and fragment.endswith(END_ANCHOR)
+        if at_end:
+            fragment = fragment[:-1]
+        if at_start or at_end:
+            return self.hosts.search(fragment, at_start, at_end)
+        found = set(self.nicks.search(term, ratio))
+        found.update(self.hosts.search(fragment))
+        return sorted(found)
+
+
+class Sheet:
+    '''The rows of a sheet and their search index, updated in place as the sheet changes.
+    The generation is incremented at every change. The RowStore of the rows is only ever
+    appended to, a changed sheet gets a new one, so a reader holding it sees consistent rows.
+    The fields name the columns, the interned ones have few distinct values.
+    The results of the last searches are kept until the sheet changes.'''
+
+    def __init__(self, rows=(), nick_column=1, host_column=8, fields=(), interned_fields=()):
+        self.nick_column = nick_column
+        self.host_column = host_column
+        self.rows = RowStore((), fields, interned_fields)
+        self.index = SheetIndex((), nick_column, host_column)
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        for row in rows:
+            self.rows.append(row)
+            self.index.append(row)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        del state['_results']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, position):
+        return self.rows[position]
+
+    def extend(self, rows):
+        '''Appends the new rows of the sheet, returns True if there were some.'''
+        if not rows:
+            return False
+        with self._lock:
+            for row in rows:
+                self.rows.append(row)
+                self.index.append(row)
+            self.generation += 1
+            self._results.clear()
+        return True
+
+    def reconcile(self, rows):
+        '''Updates the rows to all the current rows of the sheet, returns True if they changed.
+        Only the new rows are indexed if the known ones did not change, otherwise all of them
+        are indexed again, without blocking the searches in the meantime.'''
+        with self._lock:
+            known_rows = self.rows
+        if known_rows.starts(rows):
+            return self.extend(rows[len(known_rows):])
+        changed = Sheet(rows, self.nick_column, self.host_column, known_rows.fields,
+                        known_rows.interned_fields)
+        with self._lock:
+            self.rows = changed.rows
+            self.index = changed.index
+            self.generation += 1
+            self._results.clear()
+        return True
+
+    def search(self, term, ratio):
+        '''Returns the RowStore of the rows and the positions of the ones found
+        by SheetIndex.search, in order. The positions are remembered until the sheet changes.'''
+        key = (term.strip(), ratio)
+        with self._lock:
+            positions = self._results.get(key)
+            if positions is None:
+                positions = self._results[key] = tuple(self.index.search(*key))
+                while len(self._results) > SEARCH_CACHE_SIZE:
+                    self._results.popitem(last=False)
+            else:
+                self._results.move_to_end(key)
+            return self.rows, positions
+
+
+def save_snapshot(path, sheets):
+    '''Writes the sheets (a dict of Sheet by name) to a snapshot file, atomically.'''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as snapshot_file:
+        pickle.dump((SNAPSHOT_VERSION, sheets), snapshot_file, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    '''Returns the sheets of a snapshot file, or an empty dict if it is missing or unusable.'''
+    try:
+        with open(path, 'rb') as snapshot_file:
+            version, sheets = pickle.load(snapshot_file)
+    except FileNotFoundError:
+        return dict()
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError,
+            ImportError) as err:
+        print('could not load the sheet snapshot {}: {}'.format(path, err))
+        return dict()
+    if version != SNAPSHOT_VERSION:
+        print('ignoring the sheet snapshot {} of version {}'.format(path, version))
+        return dict()
+    return sheets
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+'''This module stores the rows of the spreadsheets compactly.
+It does not depend on the bot framework.
+
+The values of a column are packed in strings of CHUNK_SIZE values with the offsets of
+the values, so that a sheet is a few big objects rather than lists of small strings:
+it takes less memory, and is pickled and unpickled in a few milliseconds.
+The columns with few distinct values (results, operators...) only keep the number of
+the value of every row. The rows are read through views, by field name.'''
+
+from array import array
+
+CHUNK_SIZE = 1024
+
+
+class PackedColumn:
+    '''A list of strings packed by chunks, only appended to. The last values are kept
+    in a list until there are enough of them for a chunk.'''
+
+    def __init__(self, values=()):
+        # (text of the values, offsets of the values and of the end of the text)
+        self._chunks = []
+        self._tail = []
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return len(self._chunks) * CHUNK_SIZE + len(self._tail)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        chunk_number, value_number = divmod(position, CHUNK_SIZE)
+        if chunk_number < len(self._chunks):
+            text, offsets = self._chunks[chunk_number]
+            return text[offsets[value_number]:offsets[value_number + 1]]
+        return self._tail[value_number]
+
+    def __iter__(self):
+        for text, offsets in self._chunks:
+            yield from (text[start:end] for start, end in zip(offsets, offsets[1:]))
+        yield from self._tail
+
+    def append(self, value):
+        '''Appends a string.'''
+        self._tail.append(value)
+        if len(self._tail) == CHUNK_SIZE:
+            offsets = array('I', [0])
+            for tail_value in self._tail:
+                offsets.append(offsets[-1] + len(tail_value))
+            self._chunks.append((''.join(self._tail), offsets))
+            self._tail = []
+
+
+class InternedColumn:
+    '''A list of strings with few distinct values, only appended to: every distinct value
+    is kept once, with the number of the value of every position.'''
+
+    def __init__(self, values=()):
+        self._values = []
+        self._numbers = dict()
+        self._codes = array('H')
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __getitem__(self, position):
+        return self._values[self._codes[position]]
+
+    def __iter__(self):
+        values = self._values
+        return (values[code] for code in self._codes)
+
+    def append(self, value):
+        '''Appends a string.'''
+        code = self._numbers.get(value)
+        if code is None:
+            code = self._numbers[value] = len(self._values)
+            self._values.append(value)
+            if code > 0xFFFF and self._codes.typecode == 'H':
+                self._codes = array('I', self._codes)
+        self._codes.append(code)
+
+
+class RowView:
+    '''A row of a RowStore whose values are read by field name (e.g. view.host) or by column
+    number (e.g. view[8]), without building the row. The index is its number in the sheet,
+    if given, and is also read after the last field, like in a namedtuple of the fields.'''
+    __slots__ = ('_store', '_position', 'index')
+
+    def __init__(self, store, position, index=None):
+        self._store = store
+        self._position = position
+        self.index = index
+
+    def __getattr__(self, name):
+        try:
+            column_number = self._store._field_columns[name]
+        except KeyError:
+            raise AttributeError(name)
+        return self._store.value(self._position, column_number)
+
+    def __getitem__(self, column_number):
+        if column_number == len(self._store.fields):
+            return self.index
+        return self._store.value(self._position, column_number)
+
+    def __iter__(self):
+        return iter(self._store[self._position])
+
+
+class RowStore:
+    '''The rows of a sheet stored by column, only appended to. A row is read as a new list
+    of its values, as long as the row was (the sheets leave out the empty trailing cells),
+    or through a RowView. The columns of the interned fields are InternedColumns.'''
+
+    def __init__(self, rows=(), fields=(), interned_fields=()):
+        self.fields = tuple(fields)
+        self.interned_fields = tuple(interned_fields)
+        self._field_columns = {name: column_number for column_number, name in enumerate(fields)}
+        self._interned = {self._field_columns[name] for name in interned_fields
+                          if name in self._field_columns}
+        self._columns = []
+        self._widths = array('B')
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return len(self._widths)
+
+    def __getitem__(self, position):
+        return [column[position] for column in self._columns[:self._widths[position]]]
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def value(self, position, column_number):
+        '''Returns a value of a row, empty if the row is too short to have it.'''
+        if column_number >= self._widths[position]:
+            return ''
+        return self._columns[column_number][position]
+
+    def view(self, position, index=None):
+        '''Returns a RowView of a row.'''
+        return RowView(self, position, index)
+
+    def append(self, row):
+        '''Appends a row, a list of strings.'''
+        while len(self._columns) < len(row):
+            if len(self._columns) in self._interned:
+                self._columns.append(InternedColumn([''] * len(self)))
+            else:
+                self._columns.append(PackedColumn([''] * len(self)))
+        for column_number, column in enumerate(self._columns):
+            column.append(row[column_number] if column_number < len(row) else '')
+        self._widths.append(len(row))
+
+    def column(self, column_number):
+        '''Returns the values of a column, empty for the rows too short to have it.'''
+        if column_number >= len(self._columns):
+            return [''] * len(self)
+        return list(self._columns[column_number])
+
+    def starts(self, rows):
+        '''Returns True if the stored rows are the first of a list of rows.'''
+        if len(rows) < len(self):
+            return False
+        rows = rows[:len(self)]
+        if list(self._widths) != [len(row) for row in rows]:
+            return False
+        return all(self.column(column_number) ==
+                   [row[column_number] if column_number < len(row) else '' for row in rows]
+                   for column_number in range(len(self._columns)))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+from modules.banlogger import *
+import datetime
+import types
+import pytest
+
+
+class FakeMemory(dict):
+    def contains(self, key):
+        return key in self
+
+
+class FakeBot:
+    def __init__(self, tmp_path, loggable_channels):
+        banlogger = types.SimpleNamespace(loggable_channels=loggable_channels, workers=2,
+                                          max_queued_work=4, ack_delay=60, paste_backend='local',
+                                          paste_dir=str(tmp_path / 'pastes'),
+                                          paste_base_url='https://paste.local',
+                                          paste_cache_path=None, paste_cache_size=10,
+                                          s3_bucket_name=None)
+        chanlogs = types.SimpleNamespace(dir=str(tmp_path))
+        self.config = types.SimpleNamespace(banlogger=banlogger, chanlogs=chanlogs)
+        self.memory = FakeMemory()
+        self.replies = []
+
+    def reply(self, message):
+        self.replies.append(message)
+
+
+def write_channel_log(tmp_path, channel, actions):
+    '''Writes the log of a channel where every (minutes ago, nick) joins, talks and is kicked.'''
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    lines = []
+    for minutes_ago, nick in actions:
+        stamp = (now - datetime.timedelta(minutes=minutes_ago)).isoformat()
+        lines += ['{} --> {} ({}!u@ip.{}.example) has joined {}'.format(stamp, nick, nick, nick,
+                                                                        channel),
+                  '{}     {} ({}!u@ip.{}.example) hello'.format(stamp, nick, nick, nick),
+                  '{} <-- op (op!o@staff) has kicked {} (spam)'.format(stamp, nick)]
+    (tmp_path / '{}.log'.format(channel.lstrip('#'))).write_text('\n'.join(lines) + '\n')
+
+
+def batch_args(**kwargs):
+    args = dict(mode='batch', allchans=True, chan='#casualconversation', maxautolines=4000,
+                maxlogautolines=400, followinglines=2, skip=0, count=10, window=60)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+@pytest.fixture
+def bot(tmp_path):
+    write_channel_log(tmp_path, '#casualconversation', [(120, 'bob'), (30, 'carol'), (10, 'dave')])
+    write_channel_log(tmp_path, '#talk', [(20, 'eve')])
+    bot = FakeBot(tmp_path, ['#casualconversation', '#talk'])
+    yield bot
+    bot.memory['command_executor'].shutdown()
+
+
+def test_batch_log_pastes_the_actions_of_every_channel_oldest_first(bot, tmp_path):
+    make_batch_log(bot, batch_args())
+    records = bot.memory['last_log_information']
+    assert [(record['nick'], record['host'], record['channel']) for record in records] == [
+        ('carol', 'ip.carol.example', '#Casualconversation'),
+        ('eve', 'ip.eve.example', '#Talk'),
+        ('dave', 'ip.dave.example', '#Casualconversation')]
+    url = records[0]['log_url']
+    assert all(record['log_url'] == url for record in records)
+    assert bot.replies == ['Logged 3 actions here: {} (,form gives their forms)'.format(url)]
+
+    paste, = (tmp_path / 'pastes').glob('*.txt')
+    headers = [line for line in paste.read_text().splitlines() if line.startswith('=====')]
+    assert [header.split(' (')[0] for header in headers] == [
+        '===== 1/3 #casualconversation: Kick on carol',
+        '===== 2/3 #talk: Kick on eve',
+        '===== 3/3 #casualconversation: Kick on dave']
+    assert 'bob' not in paste.read_text()
+
+
+def test_batch_log_skips_the_most_recent_actions_of_every_channel(bot):
+    make_batch_log(bot, batch_args(skip=1, window=0))
+    assert [record['nick'] for record in bot.memory['last_log_information']] == ['bob', 'carol']
+
+
+def test_batch_log_of_a_single_channel(bot):
+    make_batch_log(bot, batch_args(allchans=False, chan='#talk', count=1))
+    assert [record['nick'] for record in bot.memory['last_log_information']] == ['eve']
+
+
+def test_auto_log_takes_the_host_of_a_kicked_user_from_the_action_index(tmp_path):
+    bot = FakeBot(tmp_path, ['#talk'])
+    lines = ['2019-03-01T09:59:00+00:00     op (op!o@staff) hi\n',
+             '2019-03-01T10:00:00+00:00 <-- op (op!o@staff) has kicked zed (spam)\n']
+    (tmp_path / 'talk.log').write_text(''.join(lines))
+    action = {'kind': 'kick', 'operator': 'op', 'target': 'zed',
+              'hostmask': 'zed!u@ip.zed.example', 'offset': len(lines[0])}
+    bot.memory['chanlog_writer'] = types.SimpleNamespace(sync=lambda timeout: True)
+    bot.memory['chanlog_actions'] = types.SimpleNamespace(latest=lambda fpath, skip: action)
+    relevant_info, _, _ = read_relevant_log(bot, batch_args(mode='auto', chan='#talk'))
+    assert relevant_info['nick'] == 'zed'
+    assert relevant_info['host'] == 'ip.zed.example'
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+from modules.chanlogs import *
+import datetime
+import types
+import pytest
+
+STAMP = ('2019-03-01T12:30:05+00:00', '2019-03-01', '12:30:05+00:00')
+
+
+class FakeTrigger(str):
+    '''A trigger of a line sent to a channel, which formats as its channel.'''
+    def __new__(cls, sender, args, nick='nick', host='host.example'):
+        trigger = super().__new__(cls, sender)
+        trigger.sender = sender
+        trigger.args = args
+        trigger.nick = nick
+        trigger.hostmask = '{}!user@{}'.format(nick, host)
+        return trigger
+
+
+def format_like_str(tpl, trigger, **kwargs):
+    return tpl.format(trigger=trigger, datetime=STAMP[0], date=STAMP[1], time=STAMP[2],
+                      **kwargs) + '\n'
+
+
+@pytest.mark.parametrize('tpl', [tpl for _, tpl in TEMPLATES.values()])
+def test_compile_template_formats_the_default_templates_like_str_format(tpl):
+    trigger = FakeTrigger('#channel', ['#channel', '+b', 'other!*@*'])
+    assert compile_template(tpl)(trigger, STAMP, {'message': 'hello {there}'}) == \
+        format_like_str(tpl, trigger, message='hello {there}')
+
+
+@pytest.mark.parametrize('tpl', [
+    '{date} {time} {trigger.nick!r:>10} {trigger.args[0]} {trigger.args[2]!s:.3}',
+    '{{literal}} {message!a} {count:05d} {trigger.hostmask:*^30}',
+    '{time} {message:>{count}} {trigger.nick}',
+])
+def test_compile_template_formats_custom_templates_like_str_format(tpl):
+    trigger = FakeTrigger('#channel', ['#channel', 'kicked', 'reason'])
+    kwargs = {'message': 'héllo', 'count': 12}
+    assert compile_template(tpl)(trigger, STAMP, kwargs) == \
+        format_like_str(tpl, trigger, **kwargs)
+
+
+@pytest.mark.parametrize('tpl', ['{} {message}', '{0} {message}', '{1.nick}'])
+def test_compile_template_rejects_positional_fields(tpl):
+    with pytest.raises(ValueError):
+        compile_template(tpl)
+
+
+def test_compile_templates_uses_the_kick_template():
+    config = types.SimpleNamespace(**{setting: None for setting, _ in TEMPLATES.values()})
+    config.kick_template = '{trigger.args[1]} kicked'
+    config.mode_template = '{trigger.args[1]} mode'
+    formatters = compile_templates(config)
+    trigger = FakeTrigger('#channel', ['#channel', 'someone', 'reason'])
+    assert formatters['kick'](trigger, STAMP, {}) == 'someone kicked\n'
+    assert formatters['mode_2'](trigger, STAMP, {}) == 'someone mode\n'
+
+
+def old_stamp(timestamp, tz_name, microseconds):
+    '''The timestamps of a line as formatted for every line before LogClock.'''
+    dt_obj = datetime.datetime.utcfromtimestamp(timestamp).replace(tzinfo=timezone('UTC'))
+    if tz_name:
+        dt_obj = dt_obj.astimezone(timezone(tz_name))
+    if not microseconds:
+        dt_obj = dt_obj.replace(microsecond=0)
+    return dt_obj.isoformat(), dt_obj.date().isoformat(), dt_obj.time().isoformat()
+
+
+@pytest.mark.parametrize('tz_name', [None, 'Europe/Paris', 'America/New_York'])
+@pytest.mark.parametrize('microseconds', [False, True])
+def test_log_clock_formats_like_the_per_line_timestamps(monkeypatch, tz_name, microseconds):
+    clock = LogClock(tz_name, microseconds)
+    for timestamp in (1551443405.25, 1551443405.75, 1551443406.5, 1572136200.125):
+        monkeypatch.setattr(time, 'time', lambda: timestamp)
+        assert clock.now()[:3] == old_stamp(timestamp, tz_name, microseconds)
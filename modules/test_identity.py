@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+from modules.identity import *
+
+
+def test_nick_and_host_at_a_time():
+    tracker = IdentityTracker()
+    tracker.seen('chan.log', 'alice', 'host.a', 100)
+    tracker.seen('chan.log', 'alice', 'host.a', 150)
+    tracker.seen('chan.log', 'alice_', 'host.a', 200)
+    tracker.seen('chan.log', 'alice', 'host.b', 300)
+    assert tracker.nick_of('chan.log', 'host.a') == 'alice_'
+    assert tracker.nick_of('chan.log', 'host.a', 199) == 'alice'
+    assert tracker.nick_of('chan.log', 'host.a', 99) is None
+    assert tracker.host_of('chan.log', 'alice') == 'host.b'
+    assert tracker.host_of('chan.log', 'alice', 250) == 'host.a'
+    assert tracker.nick_of('other.log', 'host.a') is None
+
+
+def test_join_offsets_from_writer_records():
+    tracker = IdentityTracker()
+    chunks = [b'line one\n', b'join line\n', b'line three\n']
+    tracker('chan.log', 1000, chunks, {1: {'kind': JOIN_RECORD, 'host': 'host.a', 'time': 50},
+                                       2: {'kind': 'kick'}})
+    tracker('chan.log', 2000, [b'join again\n'], {0: {'kind': JOIN_RECORD, 'host': 'host.a',
+                                                      'time': 80}})
+    assert tracker.join_of('chan.log', 'host.a') == 2000
+    assert tracker.join_of('chan.log', 'host.a', 79) == 1009
+    assert tracker.join_of('chan.log', 'host.a', 49) is None
+
+
+def test_users_not_seen_are_forgotten():
+    tracker = IdentityTracker(max_age=100)
+    tracker.seen('chan.log', 'alice', 'host.a', 0)
+    tracker.seen('chan.log', 'bob', 'host.b', 50)
+    tracker.seen('chan.log', 'carol', 'host.c', 120)
+    assert tracker.nick_of('chan.log', 'host.a') is None
+    assert tracker.host_of('chan.log', 'bob') == 'host.b'
+    assert len(tracker) == 2
+
+
+def test_live_users_follow_the_channels():
+    users = LiveUsers()
+    users.synced('#Chan', [('Alice', 'uid1', 'host.a'), ('bob', 'bob', 'host.b')])
+    users.joined('#other', 'Alice', 'uid1', 'host.a')
+    users.joined('#chan', 'alice_[2]', 'uid1', 'host.a')
+    assert users.host_of('ALICE') == 'host.a' and users.host_of('Alice_{2}') == 'host.a'
+    assert users.hostmask_of('bob') == ('bob', 'bob', 'host.b')
+    assert users.shared_hosts(['#CHAN']) == {'host.a': {'Alice': {'#chan'},
+                                                         'alice_[2]': {'#chan'}}}
+    users.renamed('alice_[2]', 'carol')
+    users.left('#chan', 'Alice')
+    assert users.host_of('alice') == 'host.a' and users.host_of('carol') == 'host.a'
+    assert users.shared_hosts(['#chan']) == dict()
+    users.quit('carol')
+    users.forget_channel('#other')
+    assert users.host_of('alice') is None and users.host_of('carol') is None
+    assert len(users) == 1
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+from modules.logactions import *
+import pytest
+
+LOG = '''\
+2019-03-01T10:00:00+00:00 --> bob (bob!uid3@ip.bob.example) has joined #casualconversation
+2019-03-01T10:00:05+00:00     bob (bob!uid3@ip.bob.example) hello
+2019-03-01T10:01:00+00:00     op1 (op1!op@mods.example) !ban +1d bob being rude
+2019-03-01T10:01:01+00:00 --  Mode #casualconversation (+b *!*@ip.bob.example) by ChanServ (CS!c@s)
+2019-03-01T10:02:00+00:00     carol (carol!uid4@ip.carol.example) hi
+2019-03-01T10:02:30+00:00 <-- op2 (op2!op@mods.example) has kicked carol (spam)
+'''
+
+
+def write_log(tmpdir):
+    log_file = tmpdir.join('casualconversation-2019-03-01.log')
+    log_file.write_binary(LOG.encode('utf8'))
+    return str(log_file)
+
+
+def test_actions_are_completed(tmpdir):
+    log_path = write_log(tmpdir)
+    ban, kick = extract_actions([log_path], jobs=1)
+    assert ban['channel'] == '#casualconversation'
+    assert ban['nick'] == 'bob'
+    assert ban['operator'] == 'op1'
+    assert ban['result'] == 'Timed Ban'
+    assert ban['reason'] == 'being rude'
+    assert kick['host'] == 'ip.carol.example'
+    assert kick['offset'] == LOG.encode('utf8').index(b'2019-03-01T10:02:30')
+
+
+def test_byte_ranges_give_the_same_actions(tmpdir):
+    log_path = write_log(tmpdir)
+    whole = list(extract_actions([log_path], jobs=1))
+    chunked = list(extract_actions([log_path], jobs=1, chunk_size=100, warmup=1000))
+    assert chunked == whole
+
+
+def test_lines_without_timestamp_keep_the_users(tmpdir):
+    log_file = tmpdir.join('casualconversation.log')
+    lines = LOG.splitlines(keepends=True)
+    lines.insert(2, 'garbled     dave (dave!uid5@ip.dave.example) hey\n')
+    log_file.write_binary(''.join(lines).encode('utf8'))
+    ban, kick = extract_actions([str(log_file)], jobs=1)
+    assert ban['nick'] == 'bob'
+    assert kick['host'] == 'ip.carol.example'
+
+
+def test_byte_ranges_only_know_the_warmup_lines(tmpdir):
+    log_path = write_log(tmpdir)
+    ban, kick = extract_actions([log_path], jobs=1, chunk_size=400, warmup=0)
+    assert ban['nick'] == 'bob'
+    assert 'host' not in kick
+    ban, kick = extract_actions([log_path], jobs=1, chunk_size=400, warmup=100)
+    assert kick['host'] == 'ip.carol.example'
+
+
+def test_find_log_files_skips_the_other_files(tmpdir):
+    log_path = write_log(tmpdir)
+    for name in ('casualconversation-2019-03-01.log.idx', 'casualconversation.log.1', 'notes'):
+        tmpdir.join(name).write('')
+    assert find_log_files([str(tmpdir)]) == [log_path]
+    with pytest.raises(ValueError):
+        find_log_files([str(tmpdir.join('notes'))])
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+from modules.logfiles import *
+
+
+def test_handle_pool_evicts_least_recently_used(tmp_path):
+    pool = HandlePool(max_open=2)
+    paths = [str(tmp_path / name) for name in ('a.log', 'b.log', 'c.log')]
+    pool.write(paths[0], b'1\n')
+    pool.write(paths[1], b'2\n')
+    pool.write(paths[0], b'3\n')
+    pool.write(paths[2], b'4\n')
+    assert len(pool) == 2
+    assert paths[0] in pool and paths[1] not in pool
+    pool.close_all()
+    assert open(paths[0], 'rb').read() == b'1\n3\n'
+
+
+def test_handle_pool_returns_offsets(tmp_path):
+    fpath = str(tmp_path / 'a.log')
+    with open(fpath, 'wb') as file_handle:
+        file_handle.write(b'old\n')
+    pool = HandlePool()
+    assert pool.write(fpath, b'new\n') == 4
+    assert pool.write(fpath, b'line\n') == 8
+    pool.close_all()
+
+
+def test_group_commit_writer_batches_per_file(tmp_path):
+    fpath = str(tmp_path / 'a.log')
+    writer = GroupCommitWriter(HandlePool(), flush_interval=60)
+    writer.start()
+    for number in range(100):
+        writer.write(fpath, '{}\n'.format(number).encode('utf8'))
+    assert writer.sync(5)
+    assert writer.commits == 1
+    writer.stop(5)
+    assert open(fpath, 'rb').read().count(b'\n') == 100
+
+
+def test_recent_lines_caps_lines_and_bytes():
+    recent = RecentLines(max_lines=3, max_bytes=10)
+    for line in ('aaaa', 'bbbb', 'cccc'):
+        recent.append('a.log', line)
+    assert recent.tail('a.log', 2) == ['bbbb', 'cccc']
+    assert recent.tail('a.log', 3) is None
+    for line in ('d', 'e', 'f'):
+        recent.append('a.log', line)
+    assert recent.tail('a.log', 3) == ['d', 'e', 'f']
+    assert recent.tail('b.log', 1) is None
+
+
+def test_group_commit_writer_survives_failing_listeners(tmp_path):
+    fpath = str(tmp_path / 'a.log')
+    written = []
+
+    def failing_listener(fpath, offset, chunks, records):
+        raise ValueError('bad record')
+
+    writer = GroupCommitWriter(HandlePool(), flush_interval=0)
+    writer.listeners.extend([failing_listener, lambda *args: written.append(args[2])])
+    writer.start()
+    writer.write(fpath, b'1\n')
+    writer.write(fpath, b'2\n')
+    assert writer.sync(5)
+    writer.stop(5)
+    assert open(fpath, 'rb').read() == b'1\n2\n'
+    assert written == [[b'1\n'], [b'2\n']]
+
+
+def test_recent_lines_count_utf8_bytes():
+    recent = RecentLines(max_lines=10, max_bytes=8)
+    for line in ('été', 'çà'):
+        recent.append('a.log', line)
+    assert recent.tail('a.log', 1) == ['çà']
+    assert recent.tail('a.log', 2) is None
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+import io
+import pygments
+import pytest
+from pygments.lexers import IrcLogsLexer
+from pygments.formatters import HtmlFormatter
+from modules.loghtml import *
+
+
+@pytest.mark.parametrize('text', [
+    '2019-03-01 10:00:00     <alice> hello <b> & "world"',
+    '2019-03-01 10:00:00     <alice> bob: carol:dave: hi http://x.com: ok',
+    '2019-03-01 10:00:01 --> bob (bob!b@ip.example) has joined #cc',
+    '2019-03-01 10:00:02 <-- op (op!o@staff) has kicked bob (spam)',
+    '2019-03-01 10:00:02 <-- bob (bob!b@ip.example) has left (bye >:( )',
+    '2019-03-01 10:00:03 --  Mode #cc (+b *!*@ip.example) by op (op!o@staff)',
+    '2019-03-01 10:00:04 *** carol (c!c@h) has quit IRC (Quit: bye)',
+    '\nusage: ,log [-h] {recent,auto}\n\n  -h, --help  show this help message\n',
+    '',
+])
+def test_render_html_matches_pygments(text):
+    buffer = io.BytesIO()
+    render_html(text, buffer)
+    expected = pygments.highlight(text, IrcLogsLexer(), HtmlFormatter(full=True, style='monokai'))
+    assert buffer.getvalue().decode('utf8') == expected
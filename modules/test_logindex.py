@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+from modules.logindex import *
+from modules.logfiles import HandlePool, GroupCommitWriter
+
+LINE_TPL = '2019-03-0{}T{:02}:{:02}:00+00:00     somebody (somebody!u@h) line {}\n'
+
+
+def write_lines(log_path, days):
+    lines = []
+    for day in range(1, days + 1):
+        for hour in range(24):
+            for minute in range(0, 60, 7):
+                lines.append(LINE_TPL.format(day, hour, minute, len(lines)))
+    with open(log_path, 'w') as file_handle:
+        file_handle.writelines(lines)
+    return [line.rstrip('\n') for line in lines]
+
+
+def test_parse_timestamp_with_offset():
+    assert parse_timestamp('2019-03-01T01:00:00+01:00 --> x') == 1551398400
+    assert parse_timestamp('2019-03-01T00:00:00.123456 --> x') == 1551398400
+    assert parse_timestamp(b'no timestamp') is None
+
+
+def test_read_lines_between_uses_rebuilt_index(tmp_path):
+    log_path = str(tmp_path / 'chan.log')
+    lines = write_lines(log_path, 3)
+    assert build_index(log_path) == len(lines)
+    start = datetime.datetime(2019, 3, 2, 10, 0)
+    end = datetime.datetime(2019, 3, 2, 10, 30)
+    expected = [line for line in lines if line.startswith('2019-03-02T10:') and
+                line[14:16] <= '30']
+    assert read_lines_between(log_path, start, end) == expected
+    assert find_offset(log_path, start) > 0
+
+
+def test_time_indexer_matches_rebuilt_index(tmp_path):
+    log_path = str(tmp_path / 'chan.log')
+    lines = [(line + '\n').encode('utf8') for line in write_lines(log_path, 1)]
+    os.remove(log_path)
+    pool = HandlePool()
+    indexer = TimeIndexer(pool)
+    offset = pool.write(log_path, b''.join(lines))
+    indexer(log_path, offset, lines, dict())
+    pool.close_all()
+    with open(index_path(log_path), 'rb') as file_handle:
+        live_index = file_handle.read()
+    build_index(log_path)
+    with open(index_path(log_path), 'rb') as file_handle:
+        assert file_handle.read() == live_index
+
+
+def test_action_index_persists_actions(tmp_path):
+    log_path = str(tmp_path / 'chan.log')
+    pool = HandlePool()
+    actions = ActionIndex(pool)
+    lines = [b'2019-03-01T10:00:00+00:00     op (op!o@staff) hello\n',
+             b'2019-03-01T10:00:01+00:00 <-- op (op!o@staff) has kicked bob (spam)\n']
+    offset = pool.write(log_path, b''.join(lines))
+    actions(log_path, offset, lines, {1: {'kind': 'kick', 'operator': 'op', 'target': 'bob',
+                                          'hostmask': None}})
+    assert actions.latest(log_path)['offset'] == len(lines[0])
+    pool.close_all()
+
+    reloaded = ActionIndex(HandlePool())
+    assert reloaded.last(log_path, 5) == [actions.latest(log_path)]
+    assert reloaded.latest(log_path, skip=1) is None
+    build_actions(log_path)
+    assert ActionIndex(HandlePool()).latest(log_path)['time'] == '2019-03-01T10:00:01+00:00'
+
+
+def test_time_indexer_forgets_the_files_on_rollover(tmp_path):
+    pool = HandlePool()
+    indexer = TimeIndexer(pool)
+    writer = GroupCommitWriter(pool, flush_interval=0)
+    writer.listeners.append(indexer)
+    writer.start()
+    writer.write(str(tmp_path / 'chan-2019-03-01.log'), LINE_TPL.format(1, 10, 0, 0).encode())
+    assert writer.sync(5)
+    assert len(indexer._state) == 1
+    writer.rollover()
+    assert writer.sync(5)
+    assert not indexer._state
+    writer.stop(5)
+
+
+def test_action_index_drops_the_files_on_rollover(tmp_path):
+    log_path = str(tmp_path / 'chan-2019-03-01.log')
+    pool = HandlePool()
+    actions = ActionIndex(pool)
+    line = b'2019-03-01T10:00:01+00:00 <-- op (op!o@staff) has kicked bob (spam)\n'
+    offset = pool.write(log_path, line)
+    actions(log_path, offset, [line], {0: {'kind': 'kick', 'operator': 'op', 'target': 'bob',
+                                           'hostmask': None}})
+    pool.flush()
+    actions.rollover()
+    assert not actions._actions
+    assert actions.latest(log_path)['target'] == 'bob'
+    pool.close_all()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+from modules.logparse import *
+import pytest
+
+STAMP = '2019-03-01T10:00:00+00:00'
+
+
+@pytest.mark.parametrize('rest, kind, nick, host, target, text', [
+    ('     bob (bob!u@h) hi (there) x', MESSAGE, 'bob', 'h', None, 'hi (there) x'),
+    (' --> bob (bob!u@h) has joined #cc', JOIN, 'bob', 'h', '#cc', None),
+    (' <-- op (op!o@staff) has kicked bob (spam (lol))', KICK, 'op', 'staff', 'bob', 'spam (lol)'),
+    (' <-- bob (bob!u@h) has left (Removed by op: bye)', REMOVED, 'bob', 'h', 'op',
+     'Removed by op: bye'),
+    (' <-- bob (bob!u@h) has left (bye)', PART, 'bob', 'h', None, 'bye'),
+    (' --  Mode #cc (+b m:*!*@h) by op (op!o@staff)', MODE, 'op', 'staff', 'm:*!*@h', '+b'),
+    (' --  Mode #cc (+i)  by op (op!o@staff)', MODE, 'op', 'staff', None, '+i'),
+    (' --  Mode (Mode!u@h) is now known as x', NICK, 'Mode', 'h', 'x', None),
+    (' *** bob (bob!u@h) has quit IRC (Quit: bye)', QUIT, 'bob', 'h', None, 'Quit: bye'),
+    ('     not a message', MESSAGE, None, None, None, ''),
+])
+def test_parse_line(rest, kind, nick, host, target, text):
+    event = parse_line(STAMP + rest)
+    assert (event.kind, event.nick, event.host, event.target, event.text) == \
+        (kind, nick, host, target, text)
+    assert event.timestamp == STAMP
+
+
+def test_parse_line_without_timestamp():
+    assert parse_line('').kind == OTHER
+    assert parse_line('garbage').timestamp is None
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+from modules.logtools import *
+import types
+import httplib2
+import pytest
+from modules.identity import LiveUsers
+
+FIELDS = ['date', 'username', 'result', 'length', 'operator', 'operator2', 'reason', 'channel',
+          'host']
+
+
+def make_row(number):
+    return ['2019-03-01', 'nick{}'.format(number), 'Kick', '', 'op', '', 'spam', '#cc',
+            'nick{}!u@ip{}.example'.format(number, number)]
+
+
+class FakeMemory(dict):
+    def contains(self, key):
+        return key in self
+
+
+class FakeSheetsService:
+    '''Serves the rows of the sheets, failing the requests of rows past their end.'''
+    def __init__(self, sheets):
+        self.sheets = sheets
+        self.requests = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def batchGet(self, spreadsheetId, ranges):
+        self.requests.append(ranges)
+        value_ranges = []
+        for sheet_range in ranges:
+            sheet, cells = sheet_range.split('!')
+            first_row = int(cells[1:].split(':')[0])
+            rows = self.sheets[sheet]
+            if first_row > len(rows) + 1:
+                raise HttpError(httplib2.Response({'status': 400}), b'exceeds grid limits')
+            value_ranges.append({'values': rows[first_row - 2:]})
+        return types.SimpleNamespace(execute=lambda: {'valueRanges': value_ranges})
+
+
+@pytest.fixture
+def bot():
+    logtools = types.SimpleNamespace(relevant_sheets=['Bans'], full_refresh_every=10,
+                                     spreadsheet_id='id', snapshot_path=None)
+    bot = types.SimpleNamespace(config=types.SimpleNamespace(logtools=logtools), memory=dict())
+    bot.memory['google_sheets_service'] = FakeSheetsService({'Bans': [make_row(0), make_row(1)]})
+    bot.memory['sheet_refresh_number'] = 1
+    bot.memory['Bans'] = Sheet([make_row(0), make_row(1), make_row(2)], NICK_COLUMN, HOST_COLUMN,
+                               FIELDS, INTERNED_FIELDS)
+    return bot
+
+
+def test_failed_incremental_refresh_is_retried_as_a_full_refresh(bot):
+    refresh_spreadsheet_content(bot)
+    assert bot.memory['google_sheets_service'].requests == [['Bans!a5:l'], ['Bans!a2:l']]
+    assert len(bot.memory['Bans']) == 2
+    assert bot.memory['sheet_refresh_number'] == 2
+
+
+def test_failed_refresh_still_counts(bot):
+    bot.memory['sheet_refresh_number'] = 0
+    bot.memory['google_sheets_service'].batchGet = lambda **kwargs: 1 / 0
+    with pytest.raises(ZeroDivisionError):
+        refresh_spreadsheet_content(bot)
+    assert bot.memory['sheet_refresh_number'] == 1
+
+
+def test_find_host_falls_back_to_the_users_of_sopel():
+    live_users = LiveUsers()
+    live_users.joined('#cc', 'Alice', 'a', 'ip.alice.example')
+    bot = types.SimpleNamespace(memory=FakeMemory(live_users=live_users), users={
+        Identifier('bob'): types.SimpleNamespace(host='ip.bob.example')})
+    assert find_host(bot, 'alice') == 'ip.alice.example'
+    assert find_host(bot, 'Bob') == 'ip.bob.example'
+    assert find_host(bot, 'carol') is None
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+from botocore.exceptions import EndpointConnectionError
+from modules.pastes import *
+
+
+class FakeS3Client:
+    def __init__(self, error=None):
+        self.objects = dict()
+        self.error = error
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        if self.error:
+            raise self.error
+        self.objects[(Bucket, Key)] = (Body, ContentType)
+
+
+def test_s3_backend_uploads_with_content_types():
+    client = FakeS3Client()
+    backend = S3PasteBackend('paste.example', client=client)
+    assert backend.store('title', b'text', b'<html>') == 'http://paste.example/title.html'
+    assert client.objects == {('paste.example', 'title.txt'): (b'text', TEXT_CONTENT_TYPE),
+                              ('paste.example', 'title.html'): (b'<html>', HTML_CONTENT_TYPE)}
+
+
+def test_s3_backend_falls_back_to_local_directory(tmp_path):
+    client = FakeS3Client(EndpointConnectionError(endpoint_url='http://s3'))
+    local = LocalPasteBackend(str(tmp_path / 'pastes'), 'https://paste.local/')
+    backend = S3PasteBackend('paste.example', client=client, fallback=local)
+    assert backend.store('title', b'text', b'<html>') == 'https://paste.local/title.html'
+    assert (tmp_path / 'pastes' / 'title.txt').read_bytes() == b'text'
+    assert (tmp_path / 'pastes' / 'title.html').read_bytes() == b'<html>'
+
+
+def test_local_backend_without_base_url(tmp_path):
+    backend = LocalPasteBackend(str(tmp_path))
+    assert backend.store('title', b'', b'') == 'file://' + str(tmp_path / 'title.html')
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['title.html', 'title.txt']
+
+
+def test_paste_cache_evicts_least_recently_used_and_persists(tmp_path):
+    path = str(tmp_path / 'pastes.json')
+    cache = PasteCache(path, max_entries=2)
+    keys = [PasteCache.key('s3://bucket', None, content) for content in ('a', 'b', 'c')]
+    assert len(set(keys)) == 3
+    assert PasteCache.key('s3://bucket', 'help', 'a') != keys[0]
+    cache.put(keys[0], 'url a')
+    cache.put(keys[1], 'url b')
+    assert cache.get(keys[0]) == 'url a'
+    cache.put(keys[2], 'url c')
+    assert cache.get(keys[1]) is None
+    assert PasteCache(path, max_entries=2).get(keys[0]) == 'url a'
+    assert len(PasteCache(path)) == 2
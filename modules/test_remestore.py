@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import datetime
+import pickle
+from modules.remestore import *
+
+
+def test_flush_writes_the_changed_users(tmp_path):
+    path = str(tmp_path / 'reme.sqlite3')
+    users = {'alice': UserStats(1000, 2000, 3), 'bob': UserStats(1500, 1500, 1)}
+    store = UserStore(path)
+    store.changed('alice')
+    store.changed('bob')
+    assert store.flush(users) == 2 and store.flush(users) == 0
+    users['alice'].lines = 4
+    del users['bob']
+    store.changed('alice')
+    store.changed('bob')
+    store.flush(users)
+    store.close()
+    assert UserStore(path).load() == {'alice': UserStats(1000, 2000, 4)}
+
+
+def test_user_table_reuses_the_slots():
+    table = UserTable({'alice': UserStats(1000, 2000, 3)})
+    table.seen('alice', 3000, 2)
+    table.seen('bob', 2500)
+    assert table.get('alice') == UserStats(1000, 3000, 5)
+    assert table.pop('bob') == UserStats(2500, 2500, 0) and table.pop('bob') is None
+    table.seen('carol', 4000, 1)
+    assert sorted(table.items()) == [('alice', UserStats(1000, 3000, 5)),
+                                     ('carol', UserStats(4000, 4000, 1))]
+    assert len(table) == 2 and 'bob' not in table and len(table._lines) == 2
+    assert table.pop('carol', unseen_since=3999) is None and 'carol' in table
+    assert table.pop('carol', unseen_since=4000) == UserStats(4000, 4000, 1)
+
+
+def test_pickle_import_and_corrupt_database(tmp_path):
+    now = datetime.datetime(2019, 3, 1, 12, 30)
+    epoch = int(now.timestamp())
+    pickle_path = str(tmp_path / 'reme.pickle')
+    with open(pickle_path, 'wb') as file_handle:
+        pickle.dump({'alice': [now, now, 3]}, file_handle)
+    store = UserStore(str(tmp_path / 'reme.sqlite3'))
+    assert store.import_pickle(pickle_path) == {'alice': UserStats(epoch, epoch, 3)}
+    assert store.load() == {'alice': UserStats(epoch, epoch, 3)}
+    assert store.import_pickle(pickle_path) == dict()
+
+    store.close()
+    store, users = open_user_store(str(tmp_path / 'reme.sqlite3'))
+    assert users == {'alice': UserStats(epoch, epoch, 3)}
+    store.close()
+
+    corrupt_path = tmp_path / 'corrupt.sqlite3'
+    corrupt_path.write_bytes(b'not a database' * 100)
+    (tmp_path / 'corrupt.sqlite3-wal').write_bytes(b'stale wal')
+    store, users = open_user_store(str(corrupt_path))
+    assert users == dict() and store.load() == dict()
+    assert (tmp_path / 'corrupt.sqlite3.corrupt').read_bytes() == b'not a database' * 100
+    assert (tmp_path / 'corrupt.sqlite3-wal.corrupt').read_bytes() == b'stale wal'
+
+
+def test_expiry_queue_only_expires_the_keys_not_seen():
+    queue = ExpiryQueue(100, {'alice': 0, 'bob': 50})
+    queue.seen('carol', 120)
+    queue.seen('alice', 90)
+    assert queue.expired(99) == []
+    assert queue.expired(150) == ['bob']
+    queue.forget('carol')
+    queue.seen('carol', 160)
+    assert queue.expired(200) == ['alice'] and 'carol' in queue
+    assert queue.expired(260) == ['carol'] and len(queue) == 0
+    assert queue.expired(1000) == []
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import random
+from fuzzywuzzy import fuzz
+from modules.sheetindex import *
+
+
+def test_nick_search_matches_fuzz_ratio():
+    rng = random.Random(3)
+    nicks = [''.join(rng.choice('abcd_1') for _ in range(rng.randint(1, 12)))
+             for _ in range(500)] + ['Alice', 'ALICE_', '', None]
+    nick_index = NickIndex(nicks)
+    for ratio in (50, 75, 90, 100):
+        for term in nicks[:40] + ['alice', 'aaaaaaaa', 'x']:
+            expected = [row for row, nick in enumerate(nicks)
+                        if nick and fuzz.ratio(term.lower(), nick.lower()) >= ratio]
+            assert nick_index.search(term, ratio) == expected
+
+
+def test_required_bigrams():
+    assert required_bigrams(8, 3, 75) is None
+    assert required_bigrams(8, 8, 100) == 9
+    assert required_bigrams(4, 4, 75) == 2
+
+
+def test_host_search_matches_substrings():
+    rng = random.Random(5)
+    hosts = ['uid{}@ip.{}.example'.format(rng.randint(0, 30), rng.randint(0, 30))
+             for _ in range(300)] + ['irccloud.com', 'x', None]
+    host_index = HostIndex(hosts)
+    for fragment in ('uid1', 'ip.2', '.example', 'd2@', 'i', '', 'cloud', 'nothing'):
+        expected = [row for row, host in enumerate(hosts) if host is not None and fragment in host]
+        assert host_index.search(fragment) == expected
+    assert host_index.search('irc', at_start=True) == [300]
+    assert host_index.search('.com', at_end=True) == [300]
+    assert host_index.search('x', at_start=True, at_end=True) == [301]
+
+
+def test_sheet_search_combines_nicks_and_hosts():
+    rows = [['', 'alice', '', '', '', '', '', '', 'uid1@host.example'],
+            [],
+            ['', 'bob', '', '', '', '', '', '', 'uid2@alice.example'],
+            ['', 'someone', '', '', '', '', '', '', 'alice.example']]
+    sheet_index = SheetIndex(rows)
+    assert sheet_index.search('alice', 75) == [0, 2, 3]
+    assert sheet_index.search('^alice', 75) == [3]
+    assert sheet_index.search('uid2@alice.example$', 75) == [2]
+
+
+def test_sheet_extend_and_reconcile():
+    rows = [['', 'alice', '', '', '', '', '', '', 'a@ip.1'],
+            ['', 'bob', '', '', '', '', '', '', 'b@ip.2']]
+    sheet = Sheet(rows[:1])
+    known_rows = sheet.rows
+    assert sheet.reconcile(rows)
+    assert sheet.rows is known_rows and sheet.generation == 1
+    assert not sheet.extend([]) and not sheet.reconcile(rows)
+    assert sheet.search('bob', 75) == (known_rows, (1,))
+
+    edited = [['', 'carol', '', '', '', '', '', '', 'c@ip.3'], rows[1]]
+    assert sheet.reconcile(edited)
+    assert sheet.rows is not known_rows and sheet.generation == 2
+    assert sheet.search('alice', 75)[1] == ()
+    assert sheet.search('carol', 75) == (sheet.rows, (0,))
+
+
+def test_sheet_search_results_last_until_a_change():
+    sheet = Sheet([['', 'alice', '', '', '', '', '', '', 'a@ip.1']])
+    assert sheet.search('bob', 75)[1] == ()
+    assert sheet.search(' bob ', 75)[1] == ()
+    assert sheet.extend([['', 'bob']]) and sheet.search('bob', 75)[1] == (1,)
+    assert sheet.reconcile([['', 'bob']]) and sheet.search('bob', 75)[1] == (0,)
+    assert sheet.search('bob', 100)[1] == (0,) and sheet.search('alice', 75)[1] == ()
+
+
+def test_snapshot_round_trip(tmp_path):
+    rows = [['', 'alice', '', '', '', '', '', '', 'a@ip.1'], [], ['', 'bob']]
+    path = str(tmp_path / 'sheets.snapshot')
+    save_snapshot(path, {'2019': Sheet(rows)})
+    sheet = load_snapshot(path)['2019']
+    assert list(sheet.rows) == rows
+    assert sheet.search('alice', 75)[1] == (0,)
+    assert sheet.extend([['', 'carol']]) and sheet.search('carol', 75)[1] == (3,)
+    assert load_snapshot(str(tmp_path / 'missing')) == dict()
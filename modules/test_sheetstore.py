@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import pickle
+from modules.sheetstore import *
+
+
+def test_packed_column_across_chunks():
+    values = ['value{}'.format(number) for number in range(CHUNK_SIZE * 2 + 5)]
+    column = PackedColumn(values)
+    assert len(column) == len(values)
+    assert column[0] == 'value0' and column[CHUNK_SIZE] == values[CHUNK_SIZE]
+    assert column[-1] == values[-1]
+    assert list(column) == values
+    assert list(pickle.loads(pickle.dumps(column))) == values
+
+
+def test_row_store_keeps_ragged_rows():
+    rows = [['a', 'b'], [], ['c', '', 'd'], ['e']]
+    store = RowStore(rows)
+    assert list(store) == rows
+    assert store.column(2) == ['', '', 'd', '']
+    assert store.starts(rows) and store.starts(rows + [['f']])
+    assert not store.starts(rows[:3])
+    assert not store.starts([['a', 'b'], [], ['c', ''], ['e']])
+
+
+def test_interned_column_and_row_views():
+    rows = [['Kick', 'alice'], ['Ban', 'bob', '1d'], ['Kick']]
+    store = RowStore(rows, ['result', 'username', 'length'], ['result', 'length'])
+    assert list(store) == rows
+    assert store.column(0) == ['Kick', 'Ban', 'Kick']
+    view = store.view(1, 3)
+    assert (view.result, view.username, view.length, view.index) == ('Ban', 'bob', '1d', 3)
+    assert store.view(2).username == '' and list(store.view(2)) == ['Kick']
+    assert '{entry.username} {entry.index}'.format(entry=view) == 'bob 3'
+    assert '{entry[1]} {entry[2]} {entry[3]}'.format(entry=view) == 'bob 1d 3'
+    assert store.view(2)[1] == ''
+    assert list(pickle.loads(pickle.dumps(store))) == rows
+    column = InternedColumn(str(number) for number in range(0x10002))
+    assert column[0x10001] == str(0x10001)
@@ -16,3 +16,66 @@ def patch_datetime_now(monkeypatch):
 
 def test_create_timestamp_file_name_now(patch_datetime_now):
     assert create_timestamp_file_name() == '20121225T170555z'
+
+
+@pytest.mark.parametrize('block_size', [1, 3, 64])
+def test_iter_lines_backwards(tmp_path, block_size):
+    filepath = tmp_path / 'chan.log'
+    lines = ['first line', '', 'café \U0001F916 été', 'last line']
+    filepath.write_bytes(('\n'.join(lines) + '\n').encode('utf8'))
+    assert list(iter_lines_backwards(str(filepath), block_size)) == lines[::-1]
+
+
+def test_backward_lines_reads_lazily():
+    consumed = []
+
+    def lines():
+        for number in range(100):
+            consumed.append(number)
+            yield str(number)
+
+    log_lines = BackwardLines(lines(), 50)
+    assert log_lines[2] == '2'
+    assert len(consumed) == 3
+    assert log_lines.chronological(1, 3) == ['3', '2', '1']
+    assert log_lines.read_all() == 50
+
+
+def test_count_lines(tmp_path):
+    filepath = tmp_path / 'chan.log'
+    filepath.write_bytes(b'one\ntwo\nthree\nfour\n')
+    assert count_lines(str(filepath), 4, 14, block_size=3) == 2
+    assert count_lines(str(filepath), 0, 19) == 4
+
+
+def test_create_paste_with_local_backend(tmp_path):
+    from modules.pastes import LocalPasteBackend
+    url = create_paste(LocalPasteBackend(str(tmp_path)), 'a <line>', wanted_title='help')
+    assert url == 'file://' + str(tmp_path / 'help.html')
+    assert (tmp_path / 'help.txt').read_text() == 'a <line>'
+    assert '&lt;line&gt;' in (tmp_path / 'help.html').read_text()
+
+
+def test_create_paste_uploads_the_same_content_once(tmp_path):
+    from modules.pastes import LocalPasteBackend, PasteCache
+    backend = LocalPasteBackend(str(tmp_path))
+    cache = PasteCache()
+    url = create_paste(backend, 'help text', wanted_title='help', cache=cache)
+    (tmp_path / 'help.html').unlink()
+    assert create_paste(backend, 'help text', wanted_title='help', cache=cache) == url
+    assert not (tmp_path / 'help.html').exists()
+
+
+def test_create_paste_does_not_cache_the_fallback_urls(tmp_path):
+    from botocore.exceptions import EndpointConnectionError
+    from modules.test_pastes import FakeS3Client
+    client = FakeS3Client(EndpointConnectionError(endpoint_url='http://s3'))
+    backend = S3PasteBackend('paste.example', client=client,
+                             fallback=LocalPasteBackend(str(tmp_path)))
+    cache = PasteCache()
+    assert create_paste(backend, 'text', wanted_title='help', cache=cache).startswith('file://')
+    assert len(cache) == 0
+    client.error = None
+    url = create_paste(backend, 'text', wanted_title='help', cache=cache)
+    assert url == 'http://paste.example/help.html'
+    assert cache.get(cache.key(backend.location, 'help', 'text')) == url
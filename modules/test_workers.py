@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import threading
+import pytest
+from modules.workers import *
+
+
+def test_stage_timings_summary():
+    timings = StageTimings(history=2)
+    for duration in (5, 1, 3):
+        timings.record('log.read', duration)
+    with timings.measure('paste.upload'):
+        pass
+    summary = timings.summary()
+    assert summary[0] == ('log.read', 2, 2, 3)
+    assert summary[1][:2] == ('paste.upload', 1)
+    assert timings.mean('unknown') is None
+
+
+def test_bounded_executor_limits_waiting_work():
+    executor = BoundedExecutor(max_workers=1, max_queued=1, ack_delay=60)
+    release = threading.Event()
+    futures = [executor.submit('log', release.wait), executor.submit('log', release.wait)]
+    with pytest.raises(QueueFullError):
+        executor.submit('log', release.wait)
+    release.set()
+    for future in futures:
+        future.result(5)
+    executor.submit('log', lambda: None).result(5)
+    assert executor.timings.summary()[0][:2] == ('log.wait', 3)
+    executor.shutdown()
+
+
+def test_bounded_executor_acknowledges_slow_work():
+    executor = BoundedExecutor(max_workers=2, ack_delay=0.01)
+    acknowledgements = []
+    release = threading.Event()
+    future = executor.submit('log', release.wait, 5, on_slow=lambda: acknowledgements.append(1))
+    threading.Timer(0.2, release.set).start()
+    future.result(5)
+    assert acknowledgements == [1]
+    # expected to be slow from the previous run, acknowledged right away
+    executor.submit('log', lambda: None, on_slow=lambda: acknowledgements.append(2))
+    assert acknowledgements == [1, 2]
+    executor.shutdown()
@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 '''This module contains utility functions used by other modules.
-They do not depend on the bot framework.'''
+They do not import the bot framework, but the ones taking the bot as argument
+(the worker pool, the paste backend and the live users) use its memory and configuration.'''
 
 import datetime
 import inspect
-import tempfile
+import io
+import itertools
+import os
+import sys
+import threading
 from collections import defaultdict
-import pygments
-from pygments.lexers import IrcLogsLexer
-from pygments.formatters import HtmlFormatter
-import boto3
+
+# hack for relative import
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from workers import BoundedExecutor, QueueFullError, StageTimings
+from pastes import S3PasteBackend, LocalPasteBackend, PasteCache, FallbackUrl
+from loghtml import render_html
 
 MOD_EMOJIS = defaultdict(lambda __: '\U0001F60E', {'A_D': '\U0001F432',
                                                    'A_Dragon': '\U0001F432',
@@ -44,56 +52,205 @@ def get_mod_emoji(mod_nick):
     return MOD_EMOJIS[mod_nick]
 
 
-def create_s3_paste(s3_bucket_name, paste_content, wanted_title=None):
-    '''Creates a paste and returns the link to the formatted version'''
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_executor(bot):
+    '''Returns the worker pool shared by the slow commands, creating it on first use.'''
+    with _EXECUTOR_LOCK:
+        if not bot.memory.contains('command_executor'):
+            config = bot.config.banlogger
+            bot.memory['command_executor'] = BoundedExecutor(config.workers,
+                                                             config.max_queued_work,
+                                                             config.ack_delay)
+        return bot.memory['command_executor']
+
+
+def get_live_users(bot):
+    '''Returns the index of the nicks and hosts of the users in the channels, kept by chanlogs,
+    or None if it is not loaded.'''
+    if not bot.memory.contains('live_users'):
+        return None
+    return bot.memory['live_users']
+
+
+def run_in_background(bot, name, func, *args):
+    '''Runs the slow part of a command on the shared worker pool.
+    The user is told to wait if it takes a while, or to retry if too much work is waiting.'''
+    try:
+        get_executor(bot).submit(name, func, *args,
+                                 on_slow=lambda: bot.reply('working\u2026'))
+    except QueueFullError:
+        bot.reply('Too much work in progress, please try again in a moment :(')
+
+
+_PASTE_BACKEND_LOCK = threading.Lock()
+_S3_BACKENDS = dict()
+
+
+def get_paste_backend(bot):
+    '''Returns the paste backend configured in the banlogger section, creating it on first use.'''
+    with _PASTE_BACKEND_LOCK:
+        if not bot.memory.contains('paste_backend'):
+            config = bot.config.banlogger
+            local_backend = None
+            if config.paste_dir:
+                local_backend = LocalPasteBackend(config.paste_dir, config.paste_base_url)
+            if config.paste_backend == 'local':
+                backend = local_backend
+            else:
+                backend = S3PasteBackend(config.s3_bucket_name, fallback=local_backend)
+            bot.memory['paste_backend'] = backend
+            bot.memory['paste_cache'] = PasteCache(config.paste_cache_path,
+                                                   config.paste_cache_size)
+        return bot.memory['paste_backend']
+
+
+def create_configured_paste(bot, paste_content, wanted_title=None):
+    '''Creates a paste with the configured backend and paste cache, timing it with the worker pool,
+    and returns the link to the formatted version.'''
+    backend = get_paste_backend(bot)
+    return create_paste(backend, paste_content, wanted_title,
+                        get_executor(bot).timings, bot.memory['paste_cache'])
+
+
+def create_paste(backend, paste_content, wanted_title=None, timings=None, cache=None):
+    '''Creates a paste with a backend and returns the link to the formatted version.
+    The durations of the rendering and of the upload are recorded in the timings, if given.
+    If a paste cache is given, the same content is only pasted once, unless it was stored
+    by the fallback of the backend, which is not used anymore once the backend is back.'''
+    if timings is None:
+        timings = StageTimings(history=0)
+    if cache is not None:
+        cache_key = cache.key(backend.location, wanted_title, paste_content)
+        url = cache.get(cache_key)
+        if url is not None:
+            return url
     if wanted_title:
         file_title = wanted_title
     else:
         file_title = create_timestamp_file_name()
 
-    filename_text = file_title + '.txt'
-    filename_formatted = file_title + '.html'
-
-    paste_formatted = pygments.highlight(paste_content,
-                                         IrcLogsLexer(),
-                                         HtmlFormatter(full=True,
-                                                       style='monokai'))
-
-    filelike_text = tempfile.TemporaryFile()
-    filelike_text.write(paste_content.encode('utf-8'))
-    filelike_text.seek(0)
-
-    filelike_formatted = tempfile.TemporaryFile()
-    filelike_formatted.write(paste_formatted.encode('utf-8'))
-    filelike_formatted.seek(0)
-
-    s3client = boto3.client('s3')
-    s3resource = boto3.resource('s3')
-    s3client.upload_fileobj(filelike_text, s3_bucket_name, filename_text)
-    s3client.upload_fileobj(filelike_formatted,
-                            s3_bucket_name,
-                            filename_formatted)
-
-    # Set the content-type, it cannot be done at upload time it seems...
-    obj_text = s3resource.Object(s3_bucket_name, filename_text)
-    obj_text.copy_from(CopySource={'Bucket': s3_bucket_name,
-                                   'Key': filename_text},
-                       MetadataDirective='REPLACE',
-                       ContentType='text/plain; charset=utf-8')
-    obj_formatted = s3resource.Object(s3_bucket_name, filename_formatted)
-    obj_formatted.copy_from(CopySource={'Bucket': s3_bucket_name,
-                                        'Key': filename_formatted},
-                            MetadataDirective='REPLACE',
-                            ContentType='text/html; charset=utf-8')
-
-    # Make the url to return
-    url = 'http://{}/{}'.format(s3_bucket_name, filename_formatted)
+    with timings.measure('paste.render'):
+        paste_formatted = io.BytesIO()
+        render_html(paste_content, paste_formatted)
+
+    with timings.measure('paste.upload'):
+        url = backend.store(file_title,
+                            paste_content.encode('utf-8'),
+                            paste_formatted.getvalue())
+    if cache is not None and not isinstance(url, FallbackUrl):
+        cache.put(cache_key, url)
     return url
 
 
+def create_s3_paste(s3_bucket_name, paste_content, wanted_title=None, timings=None, cache=None):
+    '''Creates a paste in an S3 bucket and returns the link to the formatted version'''
+    with _PASTE_BACKEND_LOCK:
+        backend = _S3_BACKENDS.get(s3_bucket_name)
+        if backend is None:
+            backend = _S3_BACKENDS[s3_bucket_name] = S3PasteBackend(s3_bucket_name)
+    return create_paste(backend, paste_content, wanted_title, timings, cache)
+
+
 def create_timestamp_file_name():
     '''Creates a filename based on ISO8601 using UTC'''
     current_time = datetime.datetime.now()
     iso_str = current_time.replace(microsecond=0).isoformat()+'z'
     file_title = iso_str.replace(':', '').replace('.', '').replace('-', '')
     return file_title
+
+
+def iter_lines_backwards(filepath, block_size=65536, end_offset=None):
+    '''Yields the lines of a file (without newline), starting from the last one.
+    The file is read by blocks from the end (or from end_offset, which must be
+    the start of a line), only as far as the lines are consumed.'''
+    with open(filepath, 'rb') as file_handle:
+        position = file_handle.seek(0, os.SEEK_END)
+        if end_offset is not None:
+            position = min(position, end_offset)
+        remainder = b''
+        skip_trailing_newline = True
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            file_handle.seek(position)
+            block = file_handle.read(read_size) + remainder
+            if skip_trailing_newline:
+                # like tail, a final newline does not start an empty line
+                skip_trailing_newline = False
+                if block.endswith(b'\n'):
+                    block = block[:-1]
+            # newline bytes never appear inside a multi-byte utf-8 character
+            pieces = block.split(b'\n')
+            remainder = pieces[0]
+            for piece in reversed(pieces[1:]):
+                yield piece.decode('utf8', 'replace')
+        if remainder or not skip_trailing_newline:
+            yield remainder.decode('utf8', 'replace')
+
+
+def iter_lines_from(filepath, offset):
+    '''Yields the lines of a file (without newline), starting from an offset.'''
+    with open(filepath, 'rb') as file_handle:
+        file_handle.seek(offset)
+        for line in file_handle:
+            yield line.rstrip(b'\n').decode('utf8', 'replace')
+
+
+def count_lines(filepath, start_offset, end_offset, block_size=65536):
+    '''Returns the number of lines between two offsets, which must be the starts of lines.'''
+    lines_number = 0
+    with open(filepath, 'rb') as file_handle:
+        file_handle.seek(start_offset)
+        position = start_offset
+        while position < end_offset:
+            block = file_handle.read(min(block_size, end_offset - position))
+            if not block:
+                break
+            lines_number += block.count(b'\n')
+            position += len(block)
+    return lines_number
+
+
+class BackwardLines:
+    '''The lines of an iterator yielding the most recent line first, read only when needed.
+    Position 0 is the most recent line, at most max_lines lines are read,
+    the limit can be raised as long as the lines are not all read.'''
+
+    def __init__(self, lines_iterator, max_lines):
+        self.max_lines = max_lines
+        self._iterator = iter(lines_iterator)
+        self._lines = []
+
+    def _read_up_to(self, position):
+        '''Reads lines until the position is available, returns False if there are not enough.'''
+        if position >= self.max_lines:
+            return False
+        while len(self._lines) <= position:
+            try:
+                self._lines.append(next(self._iterator))
+            except StopIteration:
+                return False
+        return True
+
+    def __getitem__(self, position):
+        if not self._read_up_to(position):
+            raise IndexError(position)
+        return self._lines[position]
+
+    def iter_from(self, position):
+        '''Yields the lines from a position going back in time.'''
+        while self._read_up_to(position):
+            yield self._lines[position]
+            position += 1
+
+    def read_all(self):
+        '''Reads every remaining line, returns the number of lines.'''
+        self._lines.extend(itertools.islice(self._iterator, self.max_lines - len(self._lines)))
+        return len(self._lines)
+
+    def chronological(self, newest_position, oldest_position):
+        '''Returns the lines between two positions (inclusive), oldest first.'''
+        self._read_up_to(oldest_position)
+        return list(reversed(self._lines[newest_position:oldest_position + 1]))
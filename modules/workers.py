@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+'''This module contains the worker pool running the slow parts of the commands.
+It does not depend on the bot framework.'''
+
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    '''Raised when too much work is already waiting for a worker.'''
+
+
+class StageTimings:
+    '''Keeps the last durations of every stage of the work, in seconds.'''
+
+    def __init__(self, history=50):
+        self.history = history
+        self._durations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, stage, duration):
+        '''Records the duration of a stage.'''
+        if self.history <= 0:
+            return
+        with self._lock:
+            durations = self._durations.get(stage)
+            if durations is None:
+                durations = self._durations[stage] = deque(maxlen=self.history)
+            durations.append(duration)
+
+    def measure(self, stage):
+        '''Returns a context manager recording the duration of its block as a stage.'''
+        return _Measure(self, stage)
+
+    def mean(self, stage):
+        '''Returns the mean of the last durations of a stage, or None if it never ran.'''
+        with self._lock:
+            durations = self._durations.get(stage)
+            if not durations:
+                return None
+            return sum(durations) / len(durations)
+
+    def summary(self):
+        '''Returns (stage, runs, mean, maximum) for every stage, in the order they first ran.'''
+        with self._lock:
+            return [(stage, len(durations), sum(durations) / len(durations), max(durations))
+                    for stage, durations in self._durations.items() if durations]
+
+
+class _Measure:
+    '''Context manager of StageTimings.measure.'''
+
+    def __init__(self, timings, stage):
+        self.timings = timings
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.record(self.stage, time.monotonic() - self.start)
+
+
+class BoundedExecutor:
+    '''Runs work on at most max_workers threads, with at most max_queued works waiting.
+    When a work is expected to take longer than ack_delay seconds, or is not done after
+    ack_delay seconds, its on_slow callback is called once, e.g. to tell the user to wait.
+    The time spent waiting and running is recorded in the timings, as "<name>.wait"
+    and "<name>.run" stages.'''
+
+    def __init__(self, max_workers=4, max_queued=16, ack_delay=2.0):
+        self.max_workers = max(1, max_workers)
+        self.max_queued = max(0, max_queued)
+        self.ack_delay = ack_delay
+        self.timings = StageTimings()
+        self._executor = ThreadPoolExecutor(self.max_workers)
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queued)
+        self._lock = threading.Lock()
+        self._in_progress = 0
+
+    def expected_duration(self, name):
+        '''Returns how long a new work would take according to the timings, or None.'''
+        run = self.timings.mean(name + '.run')
+        if run is None:
+            return None
+        with self._lock:
+            ahead = self._in_progress
+        # every worker has to finish a work before the new one starts
+        return run * (1 + ahead // self.max_workers)
+
+    def submit(self, name, func, *args, on_slow=None):
+        '''Queues func(*args), raises QueueFullError if too much work is waiting.
+        Exceptions raised by the work are printed.'''
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError('{} works in progress'.format(self.max_workers + self.max_queued))
+        # acquired by the first of the acknowledgement and the end of the work
+        acknowledged = threading.Lock()
+
+        def acknowledge():
+            if acknowledged.acquire(blocking=False) and on_slow is not None:
+                on_slow()
+
+        expected = self.expected_duration(name)
+        if expected is not None and expected > self.ack_delay:
+            acknowledge()
+        timer = threading.Timer(self.ack_delay, acknowledge)
+        timer.daemon = True
+        queued_at = time.monotonic()
+
+        def work():
+            started_at = time.monotonic()
+            self.timings.record(name + '.wait', started_at - queued_at)
+            try:
+                func(*args)
+            except Exception:  # pylint: disable=broad-except
+                traceback.print_exc()
+            finally:
+                timer.cancel()
+                acknowledged.acquire(blocking=False)
+                self.timings.record(name + '.run', time.monotonic() - started_at)
+                with self._lock:
+                    self._in_progress -= 1
+                self._slots.release()
+
+        with self._lock:
+            self._in_progress += 1
+        timer.start()
+        return self._executor.submit(work)
+
+    def shutdown(self, wait=True):
+        '''Stops accepting work, waits for the work in progress if asked to.'''
+        self._executor.shutdown(wait)